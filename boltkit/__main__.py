@@ -29,7 +29,7 @@ from click import Path
 
 from boltkit.addressing import Address, AddressList
 from boltkit.auth import AuthParamType, Auth
-from boltkit.client import Connection
+from boltkit.client import ConnectionPool
 from boltkit.dist import Distributor
 from boltkit.server import Neo4jService, Neo4jDirectorySpec
 from boltkit.server.scripting import BoltScript, ScriptMismatch
@@ -103,7 +103,8 @@ def client(cypher, server_addr, auth, transaction, bolt_version):
     else:
         bolt_versions = None
     try:
-        with Connection.open(*server_addr or (), auth=auth, bolt_versions=bolt_versions) as cx:
+        with ConnectionPool(auth, bolt_versions=bolt_versions) as pool, \
+                pool.connection(*server_addr or ()) as cx:
             records = []
             if transaction:
                 cx.begin()
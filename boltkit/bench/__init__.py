@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) 2002-2019 "Neo4j,"
+# Neo4j Sweden AB [http://neo4j.com]
+#
+# This file is part of Neo4j.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Micro-benchmarks for the shared PackStream codec, as used by the stub
+server (`boltkit.packstream`), the proxy and the client
+(`boltkit.client.packstream`). Each benchmark encodes or decodes a single
+sample value, and is timed as the best of several repeats. The stub decodes
+with a bounded unpacker and the proxy describes values for its log, as each
+does in service. The client
+codec is also run with bulk packing of numeric lists switched off, as
+"client_scalar", to show what that fast path is worth.
+
+Results are collected into a JSON-friendly dictionary that can be saved as
+a baseline and compared against later runs, so that codec slowdowns show
+up as failures rather than going unnoticed.
+"""
+
+
+from platform import python_implementation, python_version
+from timeit import Timer
+
+from boltkit.client import packstream as client_codec
+from boltkit import packstream as stub_codec
+from boltkit.server.proxy import ProxyPair
+
+
+def samples(structure):
+    """ Return a dictionary of sample values, by name. Structures are built
+    using the given function, which takes a tag and fields, as the two
+    codecs represent structure tags differently.
+    """
+    deep = []
+    for _ in range(50):
+        deep = [deep]
+    return {
+        "float_list": [i / 3 for i in range(10000)],
+        "int_list": list(range(100000, 110000)),
+        "scalars": [None, True, False, 0, -1, 127, -129, 40000, 2 ** 40, 3.14159],
+        "long_string": "Größenmaßstäbe " * 4000,
+        "wide_map": {"key_%d" % i: i for i in range(1000)},
+        "deep_nesting": deep,
+        "record": structure(0x71, [1, "Alice", 33.5, None, True, [1, 2, 3], {"since": 2019}]),
+        "structures": [structure(0x4E, [i, ["Person"], {"name": "Alice", "age": 33}])
+                       for i in range(100)],
+    }
+
+
+class Codec:
+    """ Adapter giving both codecs the same encode/decode interface.
+    """
+
+    name = None
+
+    #: Whether `decode` gives back the value that was encoded.
+    round_trip = True
+
+    def structure(self, tag, fields):
+        raise NotImplementedError
+
+    def encode(self, value):
+        raise NotImplementedError
+
+    def decode(self, data):
+        raise NotImplementedError
+
+
+class StubCodec(Codec):
+
+    name = "stub"
+
+    def __init__(self):
+        self.stream = stub_codec.PackStream(None, None)
+
+    def structure(self, tag, fields):
+        return stub_codec.Structure(bytes([tag]), *fields)
+
+    def encode(self, value):
+        data = bytearray()
+        stub_codec.Packer(stub_codec.BufferWriter(data)).pack(value)
+        return data
+
+    def decode(self, data):
+        return self.stream.unpack_message(data)
+
+
+class ProxyCodec(StubCodec):
+
+    # The proxy only looks inside messages in order to log them, so each
+    # value is wrapped as the single field of a RECORD message, and
+    # "decoding" produces its log description rather than the value itself.
+
+    name = "proxy"
+
+    round_trip = False
+
+    def encode(self, value):
+        return b"\xB1\x71" + super().encode(value)
+
+    def decode(self, data):
+        return ProxyPair.describe_fields(data)[0]
+
+
+class ClientCodec(Codec):
+
+    name = "client"
+
+    def __init__(self):
+        self.packer = client_codec.Packer()
+
+    def structure(self, tag, fields):
+        return client_codec.Structure(tag, *fields)
+
+    def encode(self, value):
+        packer = self.packer
+        packer.reset()
+        packer.pack(value)
+        return packer.buffer
+
+    def decode(self, data):
+        return client_codec.unpack(data)
+
+
+class ScalarClientCodec(ClientCodec):
+
+    name = "client_scalar"
+
+    def __init__(self):
+        super().__init__()
+        self.packer.vectors = False
+
+
+CODECS = [StubCodec, ProxyCodec, ClientCodec, ScalarClientCodec]
+
+
+def run_codec_benchmarks(number=100, repeat=5, names=None):
+    """ Time encoding and decoding of every sample value with every codec.
+
+    Returns:
+        A dictionary mapping benchmark names, such as "client.decode.record",
+        to the best observed time in seconds for a single operation.
+    """
+    results = {}
+    for codec_class in CODECS:
+        codec = codec_class()
+        for sample, value in samples(codec.structure).items():
+            if names and sample not in names:
+                continue
+            data = bytes(codec.encode(value))
+            for operation, function, argument in [("encode", codec.encode, value),
+                                                  ("decode", codec.decode, data)]:
+                timer = Timer(lambda: function(argument))
+                best = min(timer.repeat(repeat=repeat, number=number))
+                results["%s.%s.%s" % (codec.name, operation, sample)] = best / number
+    return results
+
+
+def report(results):
+    """ Wrap a set of results with details of the Python runtime, ready to
+    be written out as JSON.
+    """
+    return {
+        "python": "%s %s" % (python_implementation(), python_version()),
+        "results": results,
+    }
+
+
+def compare(results, baseline, threshold):
+    """ Compare results against a baseline.
+
+    Args:
+        results: Timings, as returned by `run_codec_benchmarks`.
+        baseline: Timings from an earlier run, in the same form.
+        threshold: Permitted slowdown, as a fraction (0.25 allows each
+            benchmark to take up to 25% longer than its baseline).
+
+    Returns:
+        A dictionary mapping the name of each benchmark found in both sets
+        of results to its ratio of current to baseline time, and a list
+        of the names of the benchmarks that exceeded the threshold.
+    """
+    ratios = {}
+    regressions = []
+    for name, seconds in sorted(results.items()):
+        if name not in baseline or not baseline[name]:
+            continue
+        ratio = seconds / baseline[name]
+        ratios[name] = ratio
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return ratios, regressions
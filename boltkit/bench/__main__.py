@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) 2002-2019 "Neo4j,"
+# Neo4j Sweden AB [http://neo4j.com]
+#
+# This file is part of Neo4j.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import sys
+
+from json import dump, dumps, load
+
+import click
+
+from boltkit.bench import compare, report, run_codec_benchmarks
+
+
+@click.group()
+def bench():
+    pass
+
+
+@bench.command(help="""\
+Benchmark PackStream encoding and decoding.
+
+Results are written as JSON, either to standard output or to the file given
+by --output. If a --baseline file from an earlier run is given, each result
+is compared with it and the command fails if any benchmark has slowed down
+by more than the --threshold fraction.
+""")
+@click.option("-n", "--number", default=100, show_default=True,
+              help="Number of operations in each timing run.")
+@click.option("-r", "--repeat", default=5, show_default=True,
+              help="Number of timing runs, of which the best is taken.")
+@click.option("-o", "--output", type=click.Path(dir_okay=False, writable=True),
+              help="File to which to write results.")
+@click.option("-b", "--baseline", type=click.Path(exists=True, dir_okay=False),
+              help="Results file from an earlier run to compare against.")
+@click.option("-t", "--threshold", default=0.25, show_default=True,
+              help="Permitted slowdown against the baseline, as a fraction.")
+@click.argument("sample", nargs=-1)
+def codec(sample, number, repeat, output, baseline, threshold):
+    results = run_codec_benchmarks(number, repeat, sample)
+    data = report(results)
+    if baseline:
+        with open(baseline) as f:
+            baseline_results = load(f)["results"]
+        ratios, regressions = compare(results, baseline_results, threshold)
+        data["baseline"] = {"ratios": ratios, "threshold": threshold,
+                            "regressions": regressions}
+    else:
+        regressions = []
+    if output:
+        with open(output, "w") as f:
+            dump(data, f, indent=2, sort_keys=True)
+    else:
+        click.echo(dumps(data, indent=2, sort_keys=True))
+    for name in regressions:
+        click.echo("Regression: %s is %.0f%% slower than baseline" %
+                   (name, 100 * (data["baseline"]["ratios"][name] - 1)), err=True)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    bench()
@@ -63,14 +63,22 @@ Application Layer:
 """
 
 # You'll need to make sure you have the following items handy...
+from asyncio import IncompleteReadError, open_connection, sleep as async_sleep
+from collections import deque
+from contextlib import contextmanager
 from logging import getLogger
+from select import select
 from socket import socket, AF_INET, AF_INET6
-from struct import pack as raw_pack, unpack_from as raw_unpack
-from time import perf_counter, sleep
+from struct import unpack_from as raw_unpack
+from threading import Condition
+from time import monotonic, perf_counter, sleep
 
 # ...and we'll borrow some things from other modules
 from boltkit.addressing import AddressList
-from boltkit.client.packstream import UINT_16, UINT_32, Structure, pack, unpack
+# (pack is also re-exported from here, for the use of existing callers)
+from boltkit.client.packstream import UINT_16, Structure, Packer, ColumnarRecords, Decoder, pack
+from boltkit.packstream import LazyRecord, RecordShape, UnpackableBuffer, chunk_in_place, \
+    chunk_pieces
 
 
 # CHAPTER 2: CONNECTIONS
@@ -306,14 +314,47 @@ SERVER = {v: {
 log = getLogger("boltkit")
 
 
-class Connection:
-    """ The Connection wraps a socket through which protocol messages are sent
-    and received. The socket is owned by this Connection instance...
+class BaseConnection:
+    """ Protocol state and message handling shared by :class:`.Connection`
+    and :class:`.AsyncConnection`, which each add the means of sending and
+    receiving data.
     """
 
     # Maximum size of a single data chunk.
     max_chunk_size = 65535
 
+    # Size from which byte arrays in requests are sent from where they are,
+    # rather than copied into the outgoing buffer
+    passthrough_size = 0x10000
+
+    # Whether byte arrays in responses are decoded as views of the message
+    # in which they arrived, rather than as copies
+    bytes_views = False
+
+    # KeyCache through which map keys in responses (such as record field
+    # names) are decoded, if any. One cache may be shared by many
+    # connections.
+    key_cache = None
+
+    # StringCache through which map keys and the string fields of requests
+    # (such as query text) are packed, if any
+    string_cache = None
+
+    # Pipelining: when either threshold is set, queued requests are sent as
+    # soon as their number, or the size of their packed data, reaches it.
+    # When `max_in_flight` is set, sending waits (by fetching responses)
+    # until no more than that many requests would be awaiting responses,
+    # and any responses that have already arrived are fetched as sending
+    # continues.
+    flush_count = None
+    flush_size = None
+    max_in_flight = None
+
+    # Class attributes that can be overridden per connection, by passing
+    # them as keyword arguments to `open`
+    setting_names = ("passthrough_size", "bytes_views", "key_cache", "string_cache",
+                     "flush_count", "flush_size", "max_in_flight")
+
     # The default address list to use if no addresses are specified.
     default_address_list = AddressList.parse(":7687 :17601 :17687")
 
@@ -336,97 +377,40 @@ class Connection:
         # Ensure we send exactly 4 versions, padding with zeroes if necessary
         return tuple(list(bolt_versions) + [(0, 0), (0, 0), (0, 0), (0, 0)])[:4]
 
-    @classmethod
-    def _open_to(cls, address, auth, user_agent, bolt_versions):
-        """ Attempt to open a connection to a Bolt server, given a single
-        socket address.
-        """
-        cx = None
-        handshake_data = BOLT + b"".join(bytearray([0, 0, minor, major])
-                                         for (major, minor) in bolt_versions)
-        s = socket(family={2: AF_INET, 4: AF_INET6}[len(address)])
-        try:
-            s.connect(address)
-            s.sendall(handshake_data)
-            raw_bolt_version = bytearray(s.recv(4))
-            if raw_bolt_version:
-                bolt_version = (raw_bolt_version[-1], raw_bolt_version[-2])
-                if bolt_version != (0, 0) and bolt_version in bolt_versions:
-                    cx = cls(s, bolt_version, auth, user_agent)
-                else:
-                    log.error("Could not negotiate protocol version "
-                              "(outcome=%s)", ".".join(map(str, bolt_version)))
-            else:
-                pass  # recv returned empty, peer closed connection
-        finally:
-            if not cx:
-                s.close()
-        return cx
-
-    @classmethod
-    def open(cls, *addresses, auth, user_agent=None, bolt_versions=None,
-             timeout=0):
-        """ Open a connection to a Bolt server. It is here that we create a
-        low-level socket connection and carry out version negotiation.
-        Following this (and assuming success) a Connection instance will be
-        returned. This Connection takes ownership of the underlying socket
-        and is subsequently responsible for managing its lifecycle.
-
-        Args:
-            addresses: Tuples of host and port, such as ("127.0.0.1", 7687).
-            auth:
-            user_agent:
-            bolt_versions:
-            timeout:
-
-        Returns:
-            A connection to the Bolt server.
-
-        Raises:
-            ProtocolError: if the protocol version could not be negotiated.
-        """
-        addresses = AddressList(addresses or cls.default_address_list)
-        addresses.resolve()
-        t0 = perf_counter()
-        bolt_versions = cls.fix_bolt_versions(bolt_versions)
-        log.debug("Trying to open connection to «%s»", addresses)
-        errors = set()
-        again = True
-        wait = 0.1
-        while again:
-            for address in addresses:
-                try:
-                    cx = cls._open_to(address, auth, user_agent, bolt_versions)
-                except OSError as e:
-                    errors.add(" ".join(map(str, e.args)))
-                else:
-                    if cx:
-                        return cx
-            again = perf_counter() - t0 < (timeout or 0)
-            if again:
-                sleep(wait)
-                wait *= 2
-        log.error("Could not open connection to «%s» (%r)",
-                  addresses, errors)
-        raise OSError("Could not open connection")
-
     closed = False
 
-    def __init__(self, s, bolt_version, auth, user_agent=None):
-        self.socket = s
-        self.address = AddressList([self.socket.getpeername()])
+    def __init__(self, bolt_version, **settings):
+        for name, value in settings.items():
+            if name not in self.setting_names:
+                raise TypeError("Unknown connection setting %r" % name)
+            setattr(self, name, value)
         self.bolt_version = bolt_version
-        log.debug("Opened connection to «%s» using Bolt %s",
-                  self.address, ".".join(map(str, self.bolt_version)))
-        self.requests = []
-        self.responses = []
+        # Requests not yet sent, and responses not yet complete (the first
+        # `in_flight` of which belong to requests already sent)
+        self.requests = deque()
+        self.responses = deque()
+        self.unsent = 0
+        # Packed data not yet sent: a list of pieces, followed by the
+        # contents of the packer buffer
+        self.output = []
+        self.output_size = 0
+        self.packer = Packer(string_cache=self.string_cache,
+                             passthrough_size=self.passthrough_size)
+        self.decoder = Decoder(key_cache=self.key_cache, bytes_views=self.bytes_views)
+        # The most recent RUN response, plus the fields of each query in
+        # the current transaction by qid, for use by columnar results
+        self.query = None
+        self.query_fields = {}
+
+    def _hello(self, auth, user_agent):
+        # Enqueue the initialisation message for this protocol version
         try:
             user, password = auth
         except (TypeError, ValueError):
             user, password = "neo4j", ""
         if user_agent is None:
             user_agent = self.default_user_agent()
-        if bolt_version >= (3, 0):
+        if self.bolt_version >= (3, 0):
             args = {
                 "scheme": "basic",
                 "principal": user,
@@ -443,31 +427,27 @@ class Connection:
             }
             log.debug("C: INIT %r %r", user_agent, dict(auth_token, credentials="..."))
             request = Structure(CLIENT[self.bolt_version]["INIT"], user_agent, auth_token)
-        self.requests.append(request)
-        response = Response(self)
-        self.responses.append(response)
-        self.send_all()
-        self.fetch_all()
-        self.server_agent = response.metadata["server"]
-
-    def __enter__(self):
-        return self
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self.close()
-
-    def close(self):
-        if not self.closed:
-            log.debug("Closing connection to «%s»", self.address)
-            self.socket.close()
-            self.closed = True
+        return self._enqueue(request, Response(self))
 
     def reset(self):
         log.debug("C: RESET")
-        self.requests.append(Structure(CLIENT[self.bolt_version]["RESET"]))
-        self.send_all()
+        # This may be called while handling a response, so is sent straight
+        # away, without waiting on the in-flight window
         response = Response(self)
+        self.requests.append(Structure(CLIENT[self.bolt_version]["RESET"]))
         self.responses.append(response)
+        self.unsent += 1
+        self._send_output()
+        return response
+
+    def goodbye(self):
+        """ Send a GOODBYE message, where available, to tell the server that
+        the connection is about to close. No response follows.
+        """
+        if self.bolt_version >= (3, 0):
+            log.debug("C: GOODBYE")
+            self.requests.append(Structure(CLIENT[self.bolt_version]["GOODBYE"]))
+            self._send_output()
 
     def run(self, cypher, parameters=None, metadata=None):
         parameters = parameters or {}
@@ -481,9 +461,8 @@ class Connection:
         else:
             log.debug("C: RUN %r %r", cypher, parameters)
             run = Structure(CLIENT[self.bolt_version]["RUN"], cypher, parameters)
-        self.requests.append(run)
-        response = QueryResponse(self)
-        self.responses.append(response)
+        response = self._enqueue(run, QueryResponse(self))
+        self.query = response
         return response
 
     def discard(self, n, qid):
@@ -500,24 +479,27 @@ class Connection:
             if qid >= 0:
                 args["qid"] = qid
             log.debug("C: DISCARD %r", args)
-            self.requests.append(Structure(CLIENT[v]["DISCARD"], args))
+            request = Structure(CLIENT[v]["DISCARD"], args)
         elif n >= 0 or qid >= 0:
             raise ProtocolError("Reactive DISCARD is not available in "
                                 "Bolt %s" % ".".join(map(str, self.bolt_version)))
         else:
             log.debug("C: DISCARD_ALL")
-            self.requests.append(Structure(CLIENT[v]["DISCARD_ALL"]))
-        response = QueryResponse(self)
-        self.responses.append(response)
-        return response
+            request = Structure(CLIENT[v]["DISCARD_ALL"])
+        return self._enqueue(request, QueryResponse(self))
 
-    def pull(self, n, qid, records):
+    def pull(self, n, qid, records, lazy=False, shaped=False):
         """ Enqueue a PULL message.
 
         :param n: number of records to pull (-1 means all)
         :param qid: the query for which to pull records (-1 means the query
                     immediately preceding)
-        :param records: list-like container into which records may be appended
+        :param records: list-like container into which records may be
+                        appended, or a :class:`.ColumnarRecords` object
+        :param lazy: if true, records are delivered as :class:`.LazyRecord`
+                     objects, which decode each field only on access
+        :param shaped: if true, records are decoded by a :class:`.RecordShape`
+                       specialised to the shape of the first record received
         :return: :class:`.QueryResponse` object
         """
         v = self.bolt_version
@@ -526,87 +508,372 @@ class Connection:
             if qid >= 0:
                 args["qid"] = qid
             log.debug("C: PULL %r", args)
-            self.requests.append(Structure(CLIENT[v]["PULL"], args))
+            request = Structure(CLIENT[v]["PULL"], args)
         elif n >= 0 or qid >= 0:
             raise ProtocolError("Reactive PULL is not available in "
                                 "Bolt %s" % ".".join(map(str, self.bolt_version)))
         else:
             log.debug("C: PULL_ALL")
-            self.requests.append(Structure(CLIENT[v]["PULL_ALL"]))
-        response = QueryResponse(self, records)
-        self.responses.append(response)
-        return response
+            request = Structure(CLIENT[v]["PULL_ALL"])
+        return self._enqueue(request, QueryResponse(self, records, lazy=lazy, shaped=shaped,
+                                                    query=self.query, qid=qid))
 
     def begin(self, metadata=None):
         metadata = metadata or {}
         if self.bolt_version >= (3, 0):
             log.debug("C: BEGIN %r", metadata)
-            self.requests.append(Structure(CLIENT[self.bolt_version]["BEGIN"], metadata))
+            request = Structure(CLIENT[self.bolt_version]["BEGIN"], metadata)
         else:
             raise ProtocolError("BEGIN is not available in "
                                 "Bolt %s" % ".".join(map(str, self.bolt_version)))
-        response = QueryResponse(self)
-        self.responses.append(response)
-        return response
+        return self._enqueue(request, QueryResponse(self))
 
     def commit(self):
         if self.bolt_version >= (3, 0):
             log.debug("C: COMMIT")
-            self.requests.append(Structure(CLIENT[self.bolt_version]["COMMIT"]))
+            request = Structure(CLIENT[self.bolt_version]["COMMIT"])
         else:
             raise ProtocolError("COMMIT is not available in "
                                 "Bolt %s" % ".".join(map(str, self.bolt_version)))
-        response = QueryResponse(self)
-        self.responses.append(response)
-        return response
+        return self._enqueue(request, QueryResponse(self))
 
     def rollback(self):
         if self.bolt_version >= (3, 0):
             log.debug("C: ROLLBACK")
-            self.requests.append(Structure(CLIENT[self.bolt_version]["ROLLBACK"]))
+            request = Structure(CLIENT[self.bolt_version]["ROLLBACK"])
         else:
             raise ProtocolError("ROLLBACK is not available in "
                                 "Bolt %s" % ".".join(map(str, self.bolt_version)))
-        response = QueryResponse(self)
+        return self._enqueue(request, QueryResponse(self))
+
+    @property
+    def in_flight(self):
+        """ The number of requests sent for which responses are not yet
+        complete.
+        """
+        return len(self.responses) - self.unsent
+
+    def _enqueue(self, request, response):
+        self.requests.append(request)
         self.responses.append(response)
+        self.unsent += 1
+        if self.flush_size:
+            self._pack_requests()
+        if ((self.flush_count and self.unsent >= self.flush_count) or
+                (self.flush_size and self.output_size >= self.flush_size)):
+            self._flush()
         return response
 
+    def _pack_requests(self):
+        # Every message is packed straight into the one outgoing buffer,
+        # after a space reserved for its first chunk header. Once the size
+        # of the message is known, the header is filled in (or, for a large
+        # message, the payload is split into chunks in place).
+        #
+        # Large byte arrays are not copied into the buffer. A message that
+        # holds any is instead framed as a list of pieces, which follow
+        # everything packed before it, and packing carries on into a fresh
+        # buffer.
+        packer = self.packer
+        data = packer.buffer
+        while self.requests:
+            request = self.requests.popleft()
+            start = len(data)
+            data += b"\x00\x00"
+            packer.pack(request)
+            if packer.references:
+                framed = chunk_pieces(packer.pieces(start + 2), self.max_chunk_size)
+                del data[start:]
+                if data:
+                    self.output.append(data)
+                    self.output_size += len(data)
+                    data = packer.buffer = bytearray()
+                self.output += framed
+                self.output_size += sum(map(len, framed))
+                packer.reset()
+            else:
+                self.output_size += len(data) - start
+                chunk_in_place(data, start, self.max_chunk_size)
+
+    def _send_output(self):
+        # Pack and send everything queued, all at once
+        self._pack_requests()
+        packer = self.packer
+        if packer.buffer:
+            self.output.append(packer.buffer)
+        if self.output:
+            self._send(self.output)
+        self.output = []
+        self.output_size = 0
+        self.unsent = 0
+        packer.reset()
+
+    def _handle(self, response, data):
+        if data[1] != SERVER[self.bolt_version]["RECORD"]:
+            message, _ = self.decoder.decode_from(data)
+            response.on_message(message.tag, *message.fields)
+        elif response.records is None and isinstance(response, QueryResponse):
+            # Nobody wants this record, so there's no need to decode it
+            log.debug("S: RECORD (%d bytes)", len(data) - 2)
+        elif response.lazy:
+            # Skip the structure header and tag, leaving the record fields
+            buffer = UnpackableBuffer(data)
+            buffer.p = 2
+            response.on_record(LazyRecord(buffer, self.decoder))
+        elif isinstance(response.records, ColumnarRecords):
+            response.on_packed_record(data, 2)
+        elif response.shaped:
+            response.on_shaped_record(data, 2)
+        else:
+            message, _ = self.decoder.decode_from(data)
+            response.on_message(message.tag, *message.fields)
+
+    def _on_message(self, data):
+        # Handle one received message, in the context of the oldest
+        # outstanding response
+        response = self.responses[0]
+        self._handle(response, data)
+        if response.complete:
+            self.responses.popleft()
+
+
+class Connection(BaseConnection):
+    """ The Connection wraps a socket through which protocol messages are sent
+    and received. The socket is owned by this Connection instance...
+    """
+
+    # Maximum number of buffers handed to the socket in one call (which
+    # should not exceed the IOV_MAX of the platform)
+    max_send_pieces = 1024
+
+    # Initial size of the receive buffer, into which the socket is read in
+    # as large pieces as are available. The buffer grows if a single chunk,
+    # plus the headers either side of it, would not otherwise fit.
+    receive_buffer_size = 0x10000
+
+    setting_names = BaseConnection.setting_names + ("receive_buffer_size",)
+
+    @classmethod
+    def _open_to(cls, address, auth, user_agent, bolt_versions, settings):
+        """ Attempt to open a connection to a Bolt server, given a single
+        socket address.
+        """
+        cx = None
+        handshake_data = BOLT + b"".join(bytearray([0, 0, minor, major])
+                                         for (major, minor) in bolt_versions)
+        s = socket(family={2: AF_INET, 4: AF_INET6}[len(address)])
+        try:
+            s.connect(address)
+            s.sendall(handshake_data)
+            raw_bolt_version = bytearray(s.recv(4))
+            if raw_bolt_version:
+                bolt_version = (raw_bolt_version[-1], raw_bolt_version[-2])
+                if bolt_version != (0, 0) and bolt_version in bolt_versions:
+                    cx = cls(s, bolt_version, auth, user_agent, **settings)
+                else:
+                    log.error("Could not negotiate protocol version "
+                              "(outcome=%s)", ".".join(map(str, bolt_version)))
+            else:
+                pass  # recv returned empty, peer closed connection
+        finally:
+            if not cx:
+                s.close()
+        return cx
+
+    @classmethod
+    def open(cls, *addresses, auth, user_agent=None, bolt_versions=None,
+             timeout=0, **settings):
+        """ Open a connection to a Bolt server. It is here that we create a
+        low-level socket connection and carry out version negotiation.
+        Following this (and assuming success) a Connection instance will be
+        returned. This Connection takes ownership of the underlying socket
+        and is subsequently responsible for managing its lifecycle.
+
+        Args:
+            addresses: Tuples of host and port, such as ("127.0.0.1", 7687).
+            auth:
+            user_agent:
+            bolt_versions:
+            timeout:
+            settings: Values for any of the class attributes named in
+                `setting_names`, for this connection only.
+
+        Returns:
+            A connection to the Bolt server.
+
+        Raises:
+            ProtocolError: if the protocol version could not be negotiated.
+        """
+        addresses = AddressList(addresses or cls.default_address_list)
+        addresses.resolve()
+        t0 = perf_counter()
+        bolt_versions = cls.fix_bolt_versions(bolt_versions)
+        log.debug("Trying to open connection to «%s»", addresses)
+        errors = set()
+        again = True
+        wait = 0.1
+        while again:
+            for address in addresses:
+                try:
+                    cx = cls._open_to(address, auth, user_agent, bolt_versions, settings)
+                except OSError as e:
+                    errors.add(" ".join(map(str, e.args)))
+                else:
+                    if cx:
+                        return cx
+            again = perf_counter() - t0 < (timeout or 0)
+            if again:
+                sleep(wait)
+                wait *= 2
+        log.error("Could not open connection to «%s» (%r)",
+                  addresses, errors)
+        raise OSError("Could not open connection")
+
+    def __init__(self, s, bolt_version, auth, user_agent=None, **settings):
+        super().__init__(bolt_version, **settings)
+        self.socket = s
+        self.address = AddressList([self.socket.getpeername()])
+        log.debug("Opened connection to «%s» using Bolt %s",
+                  self.address, ".".join(map(str, self.bolt_version)))
+        # Received data not yet handled lies between the start and end
+        # offsets of the receive buffer
+        self.receive_buffer = bytearray(self.receive_buffer_size)
+        self.receive_start = 0
+        self.receive_end = 0
+        response = self._hello(auth, user_agent)
+        self.send_all()
+        self.fetch_all()
+        self.server_agent = response.metadata["server"]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if not self.closed:
+            log.debug("Closing connection to «%s»", self.address)
+            self.socket.close()
+            self.closed = True
+
+    def _flush(self):
+        self.send_all()
+
     def send_all(self):
         """ Send all pending request messages to the server.
         """
-        if not self.requests:
+        if not self.unsent:
             return
-        data = []
-        while self.requests:
-            request = self.requests.pop(0)
-            request_data = pack(request)
-            for offset in range(0, len(request_data), self.max_chunk_size):
-                end = offset + self.max_chunk_size
-                chunk = request_data[offset:end]
-                data.append(raw_pack(UINT_16, len(chunk)))
-                data.append(chunk)
-            data.append(raw_pack(UINT_16, 0))
-        self.socket.sendall(b"".join(data))
+        if self.max_in_flight:
+            while self.in_flight and self.in_flight + self.unsent > self.max_in_flight:
+                self.fetch_one()
+        self._send_output()
+        if self.max_in_flight:
+            self.fetch_available()
+
+    def _send(self, pieces):
+        """ Send a list of buffers, gathering as many as possible into each
+        `sendmsg` call rather than joining them first. Where a call only
+        sends part of the data, the next resumes from where it left off.
+        """
+        if len(pieces) == 1 or not hasattr(self.socket, "sendmsg"):
+            for piece in pieces:
+                self.socket.sendall(piece)
+            return
+        views = [memoryview(piece).cast("B") for piece in pieces]
+        i = 0
+        while i < len(views):
+            sent = self.socket.sendmsg(views[i:i + self.max_send_pieces])
+            while i < len(views) and sent >= views[i].nbytes:
+                sent -= views[i].nbytes
+                i += 1
+            if sent:
+                views[i] = views[i][sent:]
+
+    def _receive(self, size):
+        """ Ensure that at least `size` bytes of received data are held in
+        the receive buffer, reading from the socket as many bytes as will
+        fit at a time until they are. Unhandled data is first moved to the
+        front of the buffer if there is not enough room after it.
+        """
+        buffer = self.receive_buffer
+        start = self.receive_start
+        end = self.receive_end
+        while end - start < size:
+            if start + size > len(buffer):
+                buffer[:end - start] = buffer[start:end]
+                end -= start
+                start = self.receive_start = 0
+                if size > len(buffer):
+                    buffer.extend(bytes(size - len(buffer)))
+            with memoryview(buffer) as view:
+                n = self.socket.recv_into(view[end:])
+            if n == 0:
+                self.receive_end = end
+                self.close()
+                raise OSError("Connection closed by peer")
+            end += n
+        self.receive_end = end
+
+    def _receive_message(self):
+        """ Receive the chunks of the next message. A message that arrives
+        in a single chunk is returned as a view of the receive buffer, which
+        is only valid until the next receive; one split across chunks is
+        joined into a new bytearray.
+        """
+        buffer = self.receive_buffer
+        data = None
+        while True:
+            # Wait for the chunk, along with the header of the next one, so
+            # that we know whether this chunk ends the message
+            self._receive(2)
+            chunk_size, = raw_unpack(UINT_16, buffer, self.receive_start)
+            if chunk_size == 0:
+                # No-op chunk between messages
+                self.receive_start += 2
+                continue
+            self._receive(chunk_size + 4)
+            start = self.receive_start + 2
+            end = start + chunk_size
+            last = buffer[end] == 0 and buffer[end + 1] == 0
+            if last:
+                self.receive_start = end + 2
+                if data is None:
+                    return memoryview(buffer)[start:end]
+                data += buffer[start:end]
+                return data
+            self.receive_start = end
+            if data is None:
+                data = bytearray()
+            data += buffer[start:end]
 
     def fetch_one(self):
         """ Receive exactly one response message from the server. This method
         blocks until either a message arrives or the connection is terminated.
         """
-
-        # Receive chunks of data until chunk_size == 0
-        data = []
-        chunk_size = -1
-        while chunk_size != 0 or not data:
-            chunk_size, = raw_unpack(UINT_16, self.socket.recv(2))
-            if chunk_size > 0:
-                data.append(self.socket.recv(chunk_size))
-        message = unpack(b"".join(data))
-
-        # Handle message
+        if not self.in_flight:
+            # The request for the response awaited has not yet been sent
+            self._send_output()
+        data = self._receive_message()
         response = self.responses[0]
-        response.on_message(message.tag, *message.fields)
-        if response.complete:
-            self.responses.pop(0)
+        if isinstance(data, memoryview) and (response.lazy or self.decoder.bytes_views):
+            # Anything that outlives this call can't refer to the receive
+            # buffer, so the message needs its own copy
+            data = bytearray(data)
+        try:
+            self._on_message(data)
+        finally:
+            if isinstance(data, memoryview):
+                data.release()
+
+    def fetch_available(self):
+        """ Fetch those messages that have already been received, without
+        waiting for any others.
+        """
+        while self.in_flight and not self.closed and (self.receive_end > self.receive_start or
+                                                      select([self.socket], [], [], 0)[0]):
+            self.fetch_one()
 
     def fetch_summary(self):
         """ Fetch all messages up to and including the next summary message.
@@ -622,9 +889,379 @@ class Connection:
             self.fetch_summary()
 
 
+class AsyncConnection(BaseConnection):
+    """ A connection for use with asyncio, which sends and receives through
+    a pair of asyncio streams. The requests and responses are the same as
+    those of a :class:`.Connection`, but the methods which wait on the
+    network are coroutines.
+
+    As writing to a stream does not block, requests that reach a pipelining
+    threshold are written straight away; the in-flight window is applied
+    by `send_all`.
+    """
+
+    @classmethod
+    async def _open_to(cls, address, auth, user_agent, bolt_versions, settings):
+        """ Attempt to open a connection to a Bolt server, given a single
+        socket address.
+        """
+        cx = None
+        handshake_data = BOLT + b"".join(bytearray([0, 0, minor, major])
+                                         for (major, minor) in bolt_versions)
+        reader, writer = await open_connection(*address[:2])
+        try:
+            writer.write(handshake_data)
+            raw_bolt_version = bytearray(await reader.read(4))
+            if raw_bolt_version:
+                bolt_version = (raw_bolt_version[-1], raw_bolt_version[-2])
+                if bolt_version != (0, 0) and bolt_version in bolt_versions:
+                    cx = cls(reader, writer, bolt_version, **settings)
+                    await cx._init(auth, user_agent)
+                else:
+                    log.error("Could not negotiate protocol version "
+                              "(outcome=%s)", ".".join(map(str, bolt_version)))
+            else:
+                pass  # read returned empty, peer closed connection
+        finally:
+            if not cx:
+                writer.close()
+        return cx
+
+    @classmethod
+    async def open(cls, *addresses, auth, user_agent=None, bolt_versions=None,
+                   timeout=0, **settings):
+        """ Open a connection to a Bolt server, as for
+        :meth:`.Connection.open`.
+        """
+        addresses = AddressList(addresses or cls.default_address_list)
+        addresses.resolve()
+        t0 = perf_counter()
+        bolt_versions = cls.fix_bolt_versions(bolt_versions)
+        log.debug("Trying to open connection to «%s»", addresses)
+        errors = set()
+        again = True
+        wait = 0.1
+        while again:
+            for address in addresses:
+                try:
+                    cx = await cls._open_to(address, auth, user_agent, bolt_versions, settings)
+                except OSError as e:
+                    errors.add(" ".join(map(str, e.args)))
+                else:
+                    if cx:
+                        return cx
+            again = perf_counter() - t0 < (timeout or 0)
+            if again:
+                await async_sleep(wait)
+                wait *= 2
+        log.error("Could not open connection to «%s» (%r)",
+                  addresses, errors)
+        raise OSError("Could not open connection")
+
+    def __init__(self, reader, writer, bolt_version, **settings):
+        super().__init__(bolt_version, **settings)
+        self.reader = reader
+        self.writer = writer
+        self.address = AddressList([writer.get_extra_info("peername")])
+        log.debug("Opened connection to «%s» using Bolt %s",
+                  self.address, ".".join(map(str, self.bolt_version)))
+        self.server_agent = None
+
+    async def _init(self, auth, user_agent):
+        response = self._hello(auth, user_agent)
+        await self.send_all()
+        await self.fetch_all()
+        self.server_agent = response.metadata["server"]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        if hasattr(self.writer, "wait_closed"):     # Python 3.7+
+            await self.writer.wait_closed()
+
+    def close(self):
+        if not self.closed:
+            log.debug("Closing connection to «%s»", self.address)
+            self.writer.close()
+            self.closed = True
+
+    def _flush(self):
+        self._send_output()
+
+    def _send(self, pieces):
+        for piece in pieces:
+            self.writer.write(piece)
+        # The stream may hold on to what it has been given until it can be
+        # sent, so packing carries on into a fresh buffer
+        self.packer.buffer = bytearray()
+
+    async def send_all(self):
+        """ Send all pending request messages to the server.
+        """
+        if self.unsent:
+            if self.max_in_flight:
+                while self.in_flight and self.in_flight + self.unsent > self.max_in_flight:
+                    await self.fetch_one()
+            self._send_output()
+        await self.writer.drain()
+
+    async def _receive_message(self):
+        data = bytearray()
+        read = self.reader.readexactly
+        try:
+            while True:
+                chunk_size, = raw_unpack(UINT_16, await read(2))
+                if chunk_size:
+                    data += await read(chunk_size)
+                elif data:
+                    return data
+        except IncompleteReadError:
+            self.close()
+            raise OSError("Connection closed by peer")
+
+    async def fetch_one(self):
+        """ Receive exactly one response message from the server.
+        """
+        if not self.in_flight:
+            # The request for the response awaited has not yet been sent
+            self._send_output()
+            await self.writer.drain()
+        self._on_message(await self._receive_message())
+
+    async def fetch_summary(self):
+        """ Fetch all messages up to and including the next summary message.
+        """
+        response = self.responses[0]
+        while not response.complete and not self.closed:
+            await self.fetch_one()
+
+    async def fetch_all(self):
+        """ Fetch all messages from all outstanding responses.
+        """
+        while self.responses and not self.closed:
+            await self.fetch_summary()
+
+
+class ConnectionPool:
+    """ A thread-safe pool of :class:`.Connection` objects, kept by the
+    addresses to which they were opened, for reuse across many short
+    pieces of work.
+
+    Each connection is validated with a RESET as it is released, and any
+    that fail are closed rather than kept. Idle connections are evicted
+    once idle for longer than `max_idle_time`, or open for longer than
+    `max_lifetime`, seconds. Connections are closed with a GOODBYE.
+
+    When `max_size` connections to the same addresses are already in use,
+    acquiring another waits for one to be released, for up to
+    `acquire_timeout` seconds.
+    """
+
+    max_size = 100
+
+    acquire_timeout = 60.0
+
+    max_idle_time = None
+
+    max_lifetime = None
+
+    def __init__(self, auth, user_agent=None, bolt_versions=None, max_size=None,
+                 acquire_timeout=None, max_idle_time=None, max_lifetime=None,
+                 **settings):
+        self.auth = auth
+        self.user_agent = user_agent
+        self.bolt_versions = bolt_versions
+        if max_size is not None:
+            self.max_size = max_size
+        if acquire_timeout is not None:
+            self.acquire_timeout = acquire_timeout
+        if max_idle_time is not None:
+            self.max_idle_time = max_idle_time
+        if max_lifetime is not None:
+            self.max_lifetime = max_lifetime
+        self.settings = settings
+        self.closed = False
+        self._lock = Condition()
+        self._idle = {}         # addresses -> deque of (connection, release time)
+        self._in_use = {}       # addresses -> number of connections acquired
+        self._owners = {}       # connection -> (addresses, open time)
+        self.created = 0
+        self.waits = 0
+        self.evicted = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def stats(self):
+        """ Return a dictionary of pool statistics: the number of connections
+        in use and idle, plus totals of those created, those evicted, and
+        acquisitions that had to wait.
+        """
+        with self._lock:
+            return {
+                "in_use": sum(self._in_use.values()),
+                "idle": sum(map(len, self._idle.values())),
+                "created": self.created,
+                "evicted": self.evicted,
+                "waits": self.waits,
+            }
+
+    def _expired(self, cx, released, now):
+        _, opened = self._owners[cx]
+        return ((self.max_idle_time is not None and now - released > self.max_idle_time) or
+                (self.max_lifetime is not None and now - opened > self.max_lifetime))
+
+    def _evict(self, key, now):
+        # Take expired connections out of the pool, returning them so they
+        # can be closed once the lock is released
+        idle = self._idle.get(key)
+        if not idle:
+            return []
+        expired = [cx for cx, released in idle if self._expired(cx, released, now)]
+        if expired:
+            idle = deque((cx, released) for cx, released in idle if cx not in expired)
+            self._idle[key] = idle
+            for cx in expired:
+                del self._owners[cx]
+            self.evicted += len(expired)
+        return expired
+
+    def _close(self, connections):
+        for cx in connections:
+            try:
+                cx.goodbye()
+            except OSError:
+                pass
+            cx.close()
+
+    def evict(self):
+        """ Close all idle connections that have expired.
+        """
+        now = monotonic()
+        with self._lock:
+            expired = [cx for key in list(self._idle) for cx in self._evict(key, now)]
+        self._close(expired)
+
+    def acquire(self, *addresses, open_timeout=0):
+        """ Take an idle connection to the given addresses from the pool, or
+        open a new one if there is none.
+
+        Raises:
+            TimeoutError: if no connection is released in time when the
+                pool is full.
+        """
+        key = tuple(addresses)
+        deadline = monotonic() + self.acquire_timeout
+        expired = []
+        waited = timed_out = False
+        with self._lock:
+            while True:
+                if self.closed:
+                    raise RuntimeError("Connection pool is closed")
+                now = monotonic()
+                expired += self._evict(key, now)
+                idle = self._idle.get(key)
+                in_use = self._in_use.get(key, 0)
+                if idle:
+                    cx, _ = idle.pop()
+                    self._in_use[key] = in_use + 1
+                    break
+                if in_use < self.max_size:
+                    cx = None
+                    self._in_use[key] = in_use + 1
+                    break
+                if now >= deadline:
+                    timed_out = True
+                    break
+                if not waited:
+                    self.waits += 1
+                    waited = True
+                self._lock.wait(deadline - now)
+        self._close(expired)
+        if timed_out:
+            raise TimeoutError("No connection to «%s» became available "
+                               "within %rs" % (AddressList(key), self.acquire_timeout))
+        if cx is None:
+            try:
+                cx = Connection.open(*addresses, auth=self.auth, user_agent=self.user_agent,
+                                     bolt_versions=self.bolt_versions, timeout=open_timeout,
+                                     **self.settings)
+            except BaseException:
+                with self._lock:
+                    self._in_use[key] -= 1
+                    self._lock.notify()
+                raise
+            with self._lock:
+                self._owners[cx] = (key, monotonic())
+                self.created += 1
+        return cx
+
+    def release(self, cx):
+        """ Return a connection to the pool, after resetting it. Connections
+        that cannot be reset, or that have expired, are closed instead.
+        """
+        key, _ = self._owners[cx]
+        keep = not cx.closed and not self.closed
+        if keep:
+            try:
+                response = cx.reset()
+                cx.fetch_all()
+            except (OSError, ProtocolError):
+                keep = False
+            else:
+                keep = not cx.closed and response.error is None
+        now = monotonic()
+        with self._lock:
+            self._in_use[key] -= 1
+            if keep and not self.closed and not self._expired(cx, now, now):
+                self._idle.setdefault(key, deque()).append((cx, now))
+            else:
+                del self._owners[cx]
+                keep = False
+            self._lock.notify()
+        if not keep:
+            self._close([cx])
+
+    @contextmanager
+    def connection(self, *addresses, open_timeout=0):
+        """ Acquire a connection for the duration of a `with` block.
+        """
+        cx = self.acquire(*addresses, open_timeout=open_timeout)
+        try:
+            yield cx
+        finally:
+            self.release(cx)
+
+    def close(self):
+        """ Close all idle connections, and any others as they are released.
+        """
+        with self._lock:
+            self.closed = True
+            idle = [cx for connections in self._idle.values() for cx, _ in connections]
+            self._idle.clear()
+            for cx in idle:
+                del self._owners[cx]
+            self._lock.notify_all()
+        self._close(idle)
+
+
 class Response:
     # Basic request that expects SUCCESS or FAILURE back, e.g. RESET
 
+    # Whether RECORD messages should be delivered as LazyRecord objects
+    lazy = False
+
+    # Whether RECORD messages should be decoded by a RecordShape
+    shaped = False
+
+    # Container into which RECORD messages are delivered, if any
+    records = None
+
     def __init__(self, connection):
         self.connection = connection
         self.metadata = {}
@@ -661,10 +1298,32 @@ class Response:
 class QueryResponse(Response):
     # Can also be IGNORED (RUN, DISCARD_ALL)
 
-    def __init__(self, connection, records=None):
+    def __init__(self, connection, records=None, lazy=False, shaped=False, query=None, qid=-1):
         super().__init__(connection)
         self.ignored = False
         self.records = records
+        self.lazy = lazy
+        self.shaped = shaped
+        self.shape = None
+        self.query = query
+        self.qid = qid
+
+    @property
+    def fields(self):
+        """ The field names of the query whose records this response
+        receives, if known.
+        """
+        if self.qid >= 0:
+            return self.connection.query_fields.get(self.qid)
+        elif self.query is not None:
+            return self.query.metadata.get("fields")
+        else:
+            return self.metadata.get("fields")
+
+    def on_success(self, data):
+        super().on_success(data)
+        if "qid" in data and "fields" in data:
+            self.connection.query_fields[data["qid"]] = data["fields"]
 
     def on_ignored(self, _):
         log.debug("S: IGNORED")
@@ -676,6 +1335,32 @@ class QueryResponse(Response):
         if self.records is not None:
             self.records.append(data)
 
+    def on_packed_record(self, data, offset):
+        # Decode the record fields straight into a ColumnarRecords object
+        log.debug("S: RECORD (%d bytes)", len(data) - offset)
+        if self.records.fields is None and self.fields is not None:
+            self.records.set_fields(self.fields)
+        self.records.append_packed(data, offset, self.connection.decoder)
+
+    def on_shaped_record(self, data, offset):
+        # Decode the record fields through a decoder specialised to the shape
+        # of the first record, provided that it has as many fields as the
+        # query has columns. Otherwise, this and all later records take the
+        # generic path, as does any single record of a different size.
+        decoder = self.connection.decoder
+        if self.shape is None:
+            self.shape = RecordShape(decoder, data, offset)
+            fields = self.fields
+            if fields is not None and len(fields) != self.shape.size:
+                self.shaped = False
+        values = None
+        if self.shaped:
+            values, _ = self.shape.decode_from(data, offset)
+        if values is None:
+            message, _ = decoder.decode_from(data)
+            values, = message.fields
+        self.on_record(values)
+
     def on_failure(self, data):
         log.debug("S: FAILURE %r", data)
         self.metadata.update(data)
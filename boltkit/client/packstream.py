@@ -29,7 +29,24 @@ Neo4j and also allows for extension data types via the `Structure` mechanism.
 """
 
 # You'll need to make sure you have the following items handy...
-from struct import pack as raw_pack, unpack_from as raw_unpack
+from array import array
+from datetime import date, datetime, time, timedelta, timezone
+from struct import pack as raw_pack
+from sys import byteorder
+
+from boltkit.packstream import BufferWindow, Decoder as CoreDecoder, Encoder, byte_view, \
+    packed_size as core_packed_size, unpack_list_header
+# (these are re-exported from here, for the use of existing callers)
+from boltkit.packstream import Extent, measure, skip  # noqa: F401
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    ZoneInfo = None
 
 
 # Python provides a module called `struct` for coercing data to and from binary
@@ -82,15 +99,20 @@ class Structure:
     uniquely identified by a unique byte `tag`.
     """
 
+    __slots__ = ("tag", "fields")
+
     def __init__(self, tag, *fields):
         self.tag = tag
         self.fields = fields
 
     def __eq__(self, other):
+        if not isinstance(other, Structure):
+            return NotImplemented
         return self.tag == other.tag and self.fields == other.fields
 
     def __ne__(self, other):
-        return not self.__eq__(other)
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
 
 
 def pack(*values):
@@ -208,7 +230,7 @@ def pack(*values):
                 data.append(b"\xCB")
                 data.append(raw_pack(INT_64, value))  # INT_64
             else:
-                raise ValueError("Integer value out of packable range")
+                raise OverflowError("Integer value out of packable range")
 
         # Floating Point Numbers
         # ----------------------
@@ -280,12 +302,49 @@ def pack(*values):
                 data.append(b"\xD2")
                 data.append(raw_pack(UINT_32, size))
             else:
-                raise ValueError("String too long to pack")
+                raise OverflowError("String too long to pack")
             data.append(utf_8)
 
         # Bytes
         # -----
-        # TODO
+        # Byte arrays are passed as raw binary data, preceded by a marker and
+        # a size, in the same way as longer strings. Unlike strings, there is
+        # no tiny form, so even an empty byte array carries a one byte size.
+        #
+        #   Marker | Size                               | Maximum size
+        #  ========|====================================|=====================
+        #   CC     | 8-bit big-endian unsigned integer  | 255 bytes
+        #   CD     | 16-bit big-endian unsigned integer | 65 535 bytes
+        #   CE     | 32-bit big-endian unsigned integer | 4 294 967 295 bytes
+        #
+        # Any object supporting the buffer protocol can be packed as a byte
+        # array by wrapping it in a `memoryview`; the data is then added to
+        # the output as it is, without an intermediate copy.
+        #
+        # Examples follow below:
+        #
+        #     b"" -> CC:00
+        #
+        #     b"\x01\x02\x03" -> CC:03:01:02:03
+        #
+        #     memoryview(array("H", [1])) -> CC:02:01:00  (on little-endian hosts)
+        #
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            if isinstance(value, memoryview):
+                value = byte_view(value)
+            size = len(value)
+            if size < 0x100:
+                data.append(b"\xCC")
+                data.append(raw_pack(UINT_8, size))
+            elif size < 0x10000:
+                data.append(b"\xCD")
+                data.append(raw_pack(UINT_16, size))
+            elif size < 0x100000000:
+                data.append(b"\xCE")
+                data.append(raw_pack(UINT_32, size))
+            else:
+                raise OverflowError("Bytes value too long to pack")
+            data.append(value)
 
         # Lists
         # -----
@@ -337,7 +396,7 @@ def pack(*values):
                 data.append(b"\xD6")
                 data.append(raw_pack(UINT_32, size))
             else:
-                raise ValueError("List too long to pack")
+                raise OverflowError("List too long to pack")
             data.extend(map(pack, value))
 
         # Dictionaries
@@ -393,7 +452,7 @@ def pack(*values):
                 data.append(b"\xDA")
                 data.append(raw_pack(UINT_32, size))
             else:
-                raise ValueError("Dictionary too long to pack")
+                raise OverflowError("Dictionary too long to pack")
             data.extend(pack(k, v) for k, v in value.items())
 
         # Structures
@@ -439,7 +498,7 @@ def pack(*values):
                 data.append(b"\xDD")
                 data.append(raw_pack(UINT_16, size))
             else:
-                raise ValueError("Structure too big to pack")
+                raise OverflowError("Structure too big to pack")
             data.append(raw_pack(UINT_8, value.tag))
             data.extend(map(pack, value.fields))
 
@@ -455,86 +514,676 @@ def pack(*values):
     return b"".join(data)
 
 
+# Graph values
+# ------------
+# Nodes, relationships and paths are sent by the server as structures. Left
+# generic, every one of these would carry its own attribute dictionary, and
+# callers would need a second pass to make sense of them. Instead, they are
+# hydrated as they are decoded into the compact types below, which keep
+# their fields in a single tuple and have no per-instance dictionary. As
+# these are still structures, they compare equal to (and pack exactly the
+# same as) the generic structures they replace.
+#
+class Node(Structure):
+    """ A node, with an `id`, a list of `labels` and a dictionary of
+    `properties`.
+    """
+
+    __slots__ = ()
+
+    tag = 0x4E
+
+    def __init__(self, id, labels, properties):
+        self.fields = (id, labels, properties)
+
+    def __repr__(self):
+        return "Node(id=%r, labels=%r, properties=%r)" % self.fields
+
+    @property
+    def id(self):
+        return self.fields[0]
+
+    @property
+    def labels(self):
+        return self.fields[1]
+
+    @property
+    def properties(self):
+        return self.fields[2]
+
+
+class Relationship(Structure):
+    """ A relationship of a given `type`, from the node with id `start` to
+    the node with id `end`.
+    """
+
+    __slots__ = ()
+
+    tag = 0x52
+
+    def __init__(self, id, start, end, type, properties):
+        self.fields = (id, start, end, type, properties)
+
+    def __repr__(self):
+        return ("Relationship(id=%r, start=%r, end=%r, type=%r, "
+                "properties=%r)" % self.fields)
+
+    @property
+    def id(self):
+        return self.fields[0]
+
+    @property
+    def start(self):
+        return self.fields[1]
+
+    @property
+    def end(self):
+        return self.fields[2]
+
+    @property
+    def type(self):
+        return self.fields[3]
+
+    @property
+    def properties(self):
+        return self.fields[4]
+
+
+class UnboundRelationship(Structure):
+    """ A relationship without its end nodes, as found within a `Path`.
+    """
+
+    __slots__ = ()
+
+    tag = 0x72
+
+    def __init__(self, id, type, properties):
+        self.fields = (id, type, properties)
+
+    def __repr__(self):
+        return "UnboundRelationship(id=%r, type=%r, properties=%r)" % self.fields
+
+    @property
+    def id(self):
+        return self.fields[0]
+
+    @property
+    def type(self):
+        return self.fields[1]
+
+    @property
+    def properties(self):
+        return self.fields[2]
+
+
+class Path(Structure):
+    """ A path through the graph. This holds the distinct `nodes` and
+    `relationships` along the path, with the order in which they are
+    visited given by `sequence`: a list of alternating relationship and
+    node indexes, where relationship indexes count from one and are
+    negative if the relationship is traversed backwards.
+    """
+
+    __slots__ = ()
+
+    tag = 0x50
+
+    def __init__(self, nodes, relationships, sequence):
+        self.fields = (nodes, relationships, sequence)
+
+    def __repr__(self):
+        return "Path(nodes=%r, relationships=%r, sequence=%r)" % self.fields
+
+    @property
+    def nodes(self):
+        return self.fields[0]
+
+    @property
+    def relationships(self):
+        return self.fields[1]
+
+    @property
+    def sequence(self):
+        return self.fields[2]
+
+
+# Temporal and spatial values
+# ---------------------------
+# Dates, times and durations are sent as structures made up of whole numbers
+# of days, seconds and nanoseconds, counted from the Unix epoch or from
+# midnight. The functions below convert these to and from the types in
+# Python's `datetime` module. Python only holds times to the nearest
+# microsecond, so any finer part of a time value is dropped when it is
+# unpacked. Durations, which have separate month and day components, and
+# points are given types of their own.
+#
+# Times which carry a time zone are packed with a fixed offset, unless the
+# zone has a name (as do those from the `zoneinfo` module) in which case
+# that is sent instead. Like the timestamps themselves, times in a named
+# zone can only be unpacked where the `zoneinfo` module is available.
+#
+UNIX_EPOCH = datetime(1970, 1, 1)
+UNIX_EPOCH_ORDINAL = UNIX_EPOCH.toordinal()
+
+NANOSECONDS_PER_DAY = 86400000000000
+
+
+class Duration(Structure):
+    """ An amount of time, made up of separate numbers of `months`, `days`,
+    `seconds` and `nanoseconds`.
+    """
+
+    __slots__ = ()
+
+    tag = 0x45
+
+    def __init__(self, months=0, days=0, seconds=0, nanoseconds=0):
+        self.fields = (months, days, seconds, nanoseconds)
+
+    def __repr__(self):
+        return "Duration(months=%r, days=%r, seconds=%r, nanoseconds=%r)" % self.fields
+
+    @property
+    def months(self):
+        return self.fields[0]
+
+    @property
+    def days(self):
+        return self.fields[1]
+
+    @property
+    def seconds(self):
+        return self.fields[2]
+
+    @property
+    def nanoseconds(self):
+        return self.fields[3]
+
+
+class Point2D(Structure):
+    """ A point in two dimensions, in the coordinate reference system
+    identified by `srid`.
+    """
+
+    __slots__ = ()
+
+    tag = 0x58
+
+    def __init__(self, srid, x, y):
+        self.fields = (srid, x, y)
+
+    def __repr__(self):
+        return "Point2D(srid=%r, x=%r, y=%r)" % self.fields
+
+    @property
+    def srid(self):
+        return self.fields[0]
+
+    @property
+    def x(self):
+        return self.fields[1]
+
+    @property
+    def y(self):
+        return self.fields[2]
+
+
+class Point3D(Structure):
+    """ A point in three dimensions, in the coordinate reference system
+    identified by `srid`.
+    """
+
+    __slots__ = ()
+
+    tag = 0x59
+
+    def __init__(self, srid, x, y, z):
+        self.fields = (srid, x, y, z)
+
+    def __repr__(self):
+        return "Point3D(srid=%r, x=%r, y=%r, z=%r)" % self.fields
+
+    @property
+    def srid(self):
+        return self.fields[0]
+
+    @property
+    def x(self):
+        return self.fields[1]
+
+    @property
+    def y(self):
+        return self.fields[2]
+
+    @property
+    def z(self):
+        return self.fields[3]
+
+
+_timezones = {}
+
+
+def fixed_timezone(offset):
+    """ Return a time zone that is `offset` seconds ahead of UTC.
+    """
+    try:
+        return _timezones[offset]
+    except KeyError:
+        return _timezones.setdefault(offset, timezone(timedelta(seconds=offset)))
+
+
+def hydrate_date(days):
+    return date.fromordinal(UNIX_EPOCH_ORDINAL + days)
+
+
+def hydrate_local_time(nanoseconds):
+    seconds, nanoseconds = divmod(nanoseconds, 1000000000)
+    minutes, second = divmod(seconds, 60)
+    hour, minute = divmod(minutes, 60)
+    return time(hour, minute, second, nanoseconds // 1000)
+
+
+def hydrate_time(nanoseconds, offset):
+    return hydrate_local_time(nanoseconds).replace(tzinfo=fixed_timezone(offset))
+
+
+def hydrate_local_datetime(seconds, nanoseconds):
+    return UNIX_EPOCH + timedelta(seconds=seconds, microseconds=nanoseconds // 1000)
+
+
+def hydrate_datetime(seconds, nanoseconds, offset):
+    return hydrate_local_datetime(seconds, nanoseconds).replace(tzinfo=fixed_timezone(offset))
+
+
+def hydrate_datetime_zone_id(seconds, nanoseconds, zone_id):
+    if ZoneInfo is None:
+        return Structure(0x66, seconds, nanoseconds, zone_id)
+    return hydrate_local_datetime(seconds, nanoseconds).replace(tzinfo=ZoneInfo(zone_id))
+
+
+def dehydrate_date(value):
+    return 0x44, (value.toordinal() - UNIX_EPOCH_ORDINAL,)
+
+
+def dehydrate_time(value):
+    nanoseconds = (1000000 * (3600 * value.hour + 60 * value.minute + value.second)
+                   + value.microsecond) * 1000
+    if value.tzinfo is None:
+        return 0x74, (nanoseconds,)
+    # Bolt can only carry a time with a fixed offset: a time in a named zone
+    # has no offset without a date, so cannot be packed without losing it
+    offset = value.utcoffset()
+    if offset is None:
+        raise ValueError("Cannot pack time %r, as its time zone has no fixed offset" % (value,))
+    return 0x54, (nanoseconds, offset.days * 86400 + offset.seconds)
+
+
+def dehydrate_datetime(value):
+    local = value.replace(tzinfo=None) - UNIX_EPOCH
+    seconds = local.days * 86400 + local.seconds
+    nanoseconds = local.microseconds * 1000
+    tzinfo = value.tzinfo
+    if tzinfo is None:
+        return 0x64, (seconds, nanoseconds)
+    zone_id = getattr(tzinfo, "key", None)
+    if zone_id is not None:
+        return 0x66, (seconds, nanoseconds, zone_id)
+    offset = value.utcoffset()
+    if offset is None:
+        raise ValueError("Cannot pack datetime %r, as its time zone has no offset" % (value,))
+    return 0x46, (seconds, nanoseconds, offset.days * 86400 + offset.seconds)
+
+
+def dehydrate_timedelta(value):
+    return 0x45, (0, value.days, value.seconds, value.microseconds * 1000)
+
+
+#: Types (or functions) into which structures are hydrated as they are
+#: unpacked, by tag.
+STRUCTURE_TYPES = {
+    0x4E: Node,
+    0x52: Relationship,
+    0x72: UnboundRelationship,
+    0x50: Path,
+    0x44: hydrate_date,
+    0x74: hydrate_local_time,
+    0x54: hydrate_time,
+    0x64: hydrate_local_datetime,
+    0x46: hydrate_datetime,
+    0x66: hydrate_datetime_zone_id,
+    0x45: Duration,
+    0x58: Point2D,
+    0x59: Point3D,
+}
+
+#: Functions for packing values of other types as structures, by type.
+DEHYDRATORS = {
+    date: dehydrate_date,
+    time: dehydrate_time,
+    datetime: dehydrate_datetime,
+    timedelta: dehydrate_timedelta,
+}
+
+
+# The `pack` function above is written for clarity rather than speed: each
+# nested collection recurses back into `pack` and every level joins its own
+# pieces together, so a deeply nested value is copied once per level. For
+# real work, the client shares its encoder and decoder with the stub server
+# and proxy, in `boltkit.packstream`. These produce exactly the same bytes,
+# but write every piece straight into a single buffer and walk nested
+# collections using an explicit stack instead of recursion. The classes below
+# adapt them to the conventions used here: structures have integer tags, and
+# iterables of unknown length are always packed with a sized header.
+#
+class Packer(Encoder):
+    """ Reusable PackStream encoder. Packed values are appended to a single
+    growable `bytearray`, which may be supplied by the caller. Calling
+    `reset` discards everything packed so far (any data that was already in
+    a caller-supplied buffer is left alone) so that the same allocation can
+    be reused for the next message.
+
+    If a `boltkit.packstream.StringCache` is supplied, map keys and string
+    fields of structures (such as the query text of a RUN message) are
+    packed through that cache.
+    """
+
+    structure_class = Structure
+
+    dehydrators = DEHYDRATORS
+
+    stream_markers = False
+
+
+class Decoder(CoreDecoder):
+    """ PackStream decoder producing structures with integer tags. Structures
+    whose tag appears in `structure_types` (by default, the graph, temporal
+    and spatial types above) are hydrated as they are decoded.
+    """
+
+    def __init__(self, key_cache=None, structure_types=None, bytes_views=False):
+        super().__init__(key_cache, bytes_views)
+        if structure_types is None:
+            structure_types = STRUCTURE_TYPES
+        self.structure_types = structure_types
+
+    def structure(self, tag, fields):
+        structure_type = self.structure_types.get(tag)
+        if structure_type is None:
+            return Structure(tag, *fields)
+        try:
+            return structure_type(*fields)
+        except (TypeError, ValueError, OverflowError, KeyError):
+            # The structure does not have the fields that its tag calls for,
+            # or holds a value that Python cannot represent (such as a date
+            # beyond year 9999, an offset of a day or more or an unknown time
+            # zone), so it is passed on as it is rather than failing the
+            # message.
+            return Structure(tag, *fields)
+
+
+def packed_size(*values):
+    """ Return the exact number of bytes that packing a series of values
+    would produce, without packing them.
+    """
+    return core_packed_size(*values, structure_class=Structure, dehydrators=DEHYDRATORS)
+
+
+def pack_into(buffer, offset, *values, string_cache=None):
+    """ Pack a series of values directly into a writable buffer (such as a
+    `bytearray` sized using `packed_size`) at the given offset. Returns
+    the offset immediately following the packed data.
+    """
+    window = BufferWindow(buffer, offset)
+    try:
+        Packer(window, string_cache).pack(*values)
+        return window.offset
+    finally:
+        window.release()
+
+
+# Unpacking
+# ---------
+# Decoding works on a plain offset into the packed data. `unpack_from` takes
+# the data and the offset at which to start reading, and returns the decoded
+# value along with the offset immediately following it; `unpack_all` decodes
+# everything from the offset onwards. `skip`, `measure` and
+# `unpack_list_header` step through packed data without decoding it.
+#
+_decoder = Decoder()
+
+unpack_from = _decoder.decode_from
+
+unpack_all = _decoder.decode_all
+
+
 class Unpackable:
-    """ The Packed class provides a framework for "unpacking" packed data.
-    Given a string of byte data and an initial offset, values can be extracted
-    via the unpack method.
+    """ The Unpackable class wraps packed data together with a current
+    offset, for callers that prefer to step through values one at a time.
+    Decoding is delegated to `unpack_from`.
     """
 
     def __init__(self, data, offset=0):
         self.data = data
         self.offset = offset
 
-    def raw_unpack(self, type_code):
-        value, = raw_unpack(type_code, self.data, self.offset)
-        self.offset += {
-            INT_8: 1, INT_16: 2, INT_32: 4, INT_64: 8,
-            UINT_8: 1, UINT_16: 2, UINT_32: 4, FLOAT_64: 8,
-        }[type_code]
-        return value
-
-    def unpack_string(self, size):
-        end = self.offset + size
-        value = self.data[self.offset:end].decode("UTF-8")
-        self.offset = end
-        return value
-
     def unpack(self, count=1):
         for _ in range(count):
-            marker_byte = self.raw_unpack(UINT_8)
-            if marker_byte == 0xC0:
-                yield None
-            elif marker_byte == 0xC3:
-                yield True
-            elif marker_byte == 0xC2:
-                yield False
-            elif marker_byte < 0x80:
-                yield marker_byte
-            elif marker_byte >= 0xF0:
-                yield marker_byte - 0x100
-            elif marker_byte == 0xC8:
-                yield self.raw_unpack(INT_8)
-            elif marker_byte == 0xC9:
-                yield self.raw_unpack(INT_16)
-            elif marker_byte == 0xCA:
-                yield self.raw_unpack(INT_32)
-            elif marker_byte == 0xCB:
-                yield self.raw_unpack(INT_64)
-            elif marker_byte == 0xC1:
-                yield self.raw_unpack(FLOAT_64)
-            elif 0x80 <= marker_byte < 0x90:
-                yield self.unpack_string(marker_byte & 0x0F)
-            elif marker_byte == 0xD0:
-                yield self.unpack_string(self.raw_unpack(UINT_8))
-            elif marker_byte == 0xD1:
-                yield self.unpack_string(self.raw_unpack(UINT_16))
-            elif marker_byte == 0xD2:
-                yield self.unpack_string(self.raw_unpack(UINT_32))
-            elif 0x90 <= marker_byte < 0xA0:
-                yield list(self.unpack(marker_byte & 0x0F))
-            elif marker_byte == 0xD4:
-                yield list(self.unpack(self.raw_unpack(UINT_8)))
-            elif marker_byte == 0xD5:
-                yield list(self.unpack(self.raw_unpack(UINT_16)))
-            elif marker_byte == 0xD6:
-                yield list(self.unpack(self.raw_unpack(UINT_32)))
-            elif 0xA0 <= marker_byte < 0xB0:
-                yield dict(tuple(self.unpack(2)) for _ in range(marker_byte & 0x0F))
-            elif marker_byte == 0xD8:
-                yield dict(tuple(self.unpack(2)) for _ in range(self.raw_unpack(UINT_8)))
-            elif marker_byte == 0xD9:
-                yield dict(tuple(self.unpack(2)) for _ in range(self.raw_unpack(UINT_16)))
-            elif marker_byte == 0xDA:
-                yield dict(tuple(self.unpack(2)) for _ in range(self.raw_unpack(UINT_32)))
-            elif 0xB0 <= marker_byte < 0xC0:
-                yield Structure(self.raw_unpack(UINT_8), *self.unpack(marker_byte & 0x0F))
-            else:
-                raise ValueError("Unknown marker byte {:02X}".format(marker_byte))
+            value, self.offset = unpack_from(self.data, self.offset)
+            yield value
 
     def unpack_all(self):
-        while self.offset < len(self.data):
-            yield next(self.unpack(1))
+        values = unpack_all(self.data, self.offset)
+        self.offset = len(self.data)
+        return values
 
 
 def unpack(data, offset=0):
-    return next(Unpackable(data, offset).unpack())
+    value, _ = unpack_from(data, offset)
+    return value
+
+
+# Lists of points, such as those making up a route or a shape, can be decoded
+# straight into arrays of coordinates. Where every point in the list has the
+# same SRID and the same packed layout, which is usually the case, the
+# coordinates are copied out of the packed data in bulk by slicing across the
+# points, in much the same way as numeric lists are packed above.
+#
+POINT_MARKERS = {0xB3: (0x58, 2), 0xB4: (0x59, 3)}
+
+
+def unpack_coordinates(data, offset=0):
+    """ Unpack a packed list of points straight into arrays, without
+    creating an object for each point. All points must have the same number
+    of dimensions.
+
+    Returns:
+        A 4-tuple of the number of dimensions, an `array('q')` of SRIDs, an
+        `array('d')` holding the coordinates of each point in turn and the
+        offset immediately following the list. With NumPy, the coordinates
+        can be viewed as a two-dimensional array, using
+        `numpy.frombuffer(coordinates).reshape(-1, dimensions)`.
+    """
+    size, offset = unpack_list_header(data, offset)
+    srids = array("q")
+    coordinates = array("d")
+    if not size:
+        return 0, srids, coordinates, offset
+    marker = data[offset]
+    tag, dimensions = POINT_MARKERS.get(marker, (None, None))
+    if tag is None or data[offset + 1] != tag:
+        raise ValueError("Expected a list of points")
+    srid, p = unpack_from(data, offset + 2)
+    head = p - offset
+    stride = head + 9 * dimensions
+    end = offset + stride * size
+    if end <= len(data) and _uniform_points(data, offset, end, stride, head, dimensions):
+        width = 8 * dimensions
+        raw = bytearray(width * size)
+        for i in range(dimensions):
+            start = offset + head + 9 * i + 1
+            for j in range(8):
+                raw[8 * i + j::width] = data[start + j:end:stride]
+        coordinates.frombytes(raw)
+        if byteorder == "little":
+            coordinates.byteswap()
+        srids.append(srid)
+        return dimensions, srids * size, coordinates, end
+    for _ in range(size):
+        point, offset = unpack_from(data, offset)
+        if not isinstance(point, (Point2D, Point3D)) or len(point.fields) != dimensions + 1:
+            raise ValueError("Expected a list of points with %d dimensions" % dimensions)
+        srids.append(point.fields[0])
+        coordinates.extend(point.fields[1:])
+    return dimensions, srids, coordinates, offset
+
+
+def _uniform_points(data, offset, end, stride, head, dimensions):
+    # Check that every point repeats the marker, tag and SRID of the first,
+    # and has a float marker ahead of each coordinate
+    size = (end - offset) // stride
+    for i in range(offset, offset + head):
+        if data[i:end:stride] != bytes((data[i],)) * size:
+            return False
+    for i in range(dimensions):
+        if data[offset + head + 9 * i:end:stride] != b"\xC1" * size:
+            return False
+    return True
+
+
+# Columnar results
+# ----------------
+# A result made up of millions of rows of numbers is costly to hold as a list
+# of lists, as every value becomes a separate Python object. A
+# `ColumnarRecords` container can be passed to `Connection.pull` in place of
+# a list: each record is then decoded straight from the packed message into
+# one column per field. A column holding only integers or only floats is kept
+# in an `array.array`, using eight bytes per value; a column that turns out to
+# hold anything else (including nulls) reverts to an ordinary list.
+#
+class Column:
+    """ A single column of values, stored as compactly as its contents
+    allow.
+    """
+
+    def __init__(self):
+        self.values = None
+
+    def __len__(self):
+        return 0 if self.values is None else len(self.values)
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __iter__(self):
+        return iter(() if self.values is None else self.values)
+
+    @property
+    def typed(self):
+        """ True if the values in this column are held in an `array.array`.
+        """
+        return isinstance(self.values, array)
+
+    def append(self, value):
+        values = self.values
+        if values is None:
+            if type(value) is int and -0x8000000000000000 <= value < 0x8000000000000000:
+                self.values = array("q", [value])
+            elif type(value) is float:
+                self.values = array("d", [value])
+            else:
+                self.values = [value]
+        elif type(values) is list:
+            values.append(value)
+        elif type(value) is (int if values.typecode == "q" else float):
+            try:
+                values.append(value)
+            except OverflowError:
+                self.values = values.tolist()
+                self.values.append(value)
+        else:
+            self.values = values.tolist()
+            self.values.append(value)
+
+    def to_numpy(self):
+        """ Return the column as a NumPy array. Typed columns are shared
+        with the array rather than copied. NumPy must be installed.
+        """
+        if numpy is None:
+            raise ImportError("NumPy is not installed")
+        if self.values is None:
+            return numpy.array([])
+        elif self.typed:
+            return numpy.frombuffer(self.values, dtype=self.values.typecode)
+        else:
+            return numpy.array(self.values, dtype=object)
+
+
+class ColumnarRecords:
+    """ Result container that holds records column by column. Field names
+    are taken from the `fields` metadata of the RUN response unless given
+    explicitly. Columns may be looked up by name or by position.
+    """
+
+    def __init__(self, fields=None):
+        self.fields = None
+        self.columns = []
+        self.size = 0
+        if fields is not None:
+            self.set_fields(fields)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self.fields.index(key)
+        return self.columns[key]
+
+    def __iter__(self):
+        # Iterate the rows, for compatibility with a list of records
+        return map(list, zip(*self.columns))
+
+    def set_fields(self, fields):
+        if self.fields is not None and list(fields) != self.fields:
+            raise ValueError("Records with fields %r cannot be added to "
+                             "columns %r" % (list(fields), self.fields))
+        self.fields = list(fields)
+        while len(self.columns) < len(self.fields):
+            self.columns.append(Column())
+
+    def _check_size(self, size):
+        if self.fields is None and not self.columns:
+            # No field names are known, so columns are numbered instead
+            self.set_fields(range(size))
+        if size != len(self.columns):
+            raise ValueError("Record has %d values but there are %d "
+                             "columns" % (size, len(self.columns)))
+
+    def append(self, record):
+        """ Add a record given as a list of values.
+        """
+        self._check_size(len(record))
+        for column, value in zip(self.columns, record):
+            column.append(value)
+        self.size += 1
+
+    def append_packed(self, data, offset=0, decoder=None):
+        """ Add a record given as a packed list of values within `data`,
+        without building the intermediate list. Values are decoded with the
+        given `Decoder`, or with the default one if none is given. Returns
+        the offset immediately following the record.
+        """
+        decode_from = unpack_from if decoder is None else decoder.decode_from
+        size, offset = unpack_list_header(data, offset)
+        self._check_size(size)
+        for column in self.columns:
+            value, offset = decode_from(data, offset)
+            column.append(value)
+        self.size += 1
+        return offset
+
+    def to_numpy(self):
+        """ Return a dictionary of NumPy arrays, keyed by field name.
+        """
+        return {field: column.to_numpy()
+                for field, column in zip(self.fields, self.columns)}
@@ -19,9 +19,20 @@
 # limitations under the License.
 
 
+from array import array
 from codecs import decode
-from io import BytesIO
-from struct import pack as struct_pack, unpack as struct_unpack
+from collections import OrderedDict, namedtuple
+from collections.abc import Iterable, Mapping, Sized
+from hashlib import md5
+from itertools import chain
+from tempfile import SpooledTemporaryFile
+from struct import Struct, error as struct_error, pack as struct_pack, unpack as struct_unpack
+from sys import byteorder
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 PACKED_UINT_8 = [struct_pack(">B", value) for value in range(0x100)]
@@ -38,12 +49,41 @@ UNPACKED_MARKERS.update({bytes(bytearray([z + 256])): z for z in range(-0x10, 0x
 INT64_MIN = -(2 ** 63)
 INT64_MAX = 2 ** 63
 
+STRUCT_INT_8 = Struct(">b")
+STRUCT_INT_16 = Struct(">h")
+STRUCT_INT_32 = Struct(">i")
+STRUCT_INT_64 = Struct(">q")
+STRUCT_UINT_8 = Struct(">B")
+STRUCT_UINT_16 = Struct(">H")
+STRUCT_UINT_32 = Struct(">I")
+STRUCT_FLOAT_64 = Struct(">d")
+
+
+def read_only(view):
+    """ Return a read-only version of a memoryview. Before Python 3.8, this
+    is not possible without copying, so the view is returned as it is.
+    """
+    try:
+        return view.toreadonly()
+    except AttributeError:
+        return view
+
+
+# Packers for a marker byte followed by a number, written in one step
+PACK_MARKED_INT_8 = Struct(">Bb").pack
+PACK_MARKED_INT_16 = Struct(">Bh").pack
+PACK_MARKED_INT_32 = Struct(">Bi").pack
+PACK_MARKED_INT_64 = Struct(">Bq").pack
+PACK_MARKED_FLOAT_64 = Struct(">Bd").pack
+
 
 EndOfStream = object()
 
 
 class Structure:
 
+    __slots__ = ("tag", "fields")
+
     def __init__(self, tag, *fields):
         self.tag = tag
         self.fields = list(fields)
@@ -70,299 +110,985 @@ class Structure:
         self.fields[key] = value
 
 
-class Packer:
+class PackedString(bytes):
+    """ Fully packed representation (marker, size and UTF-8 data) of a
+    string, as held in a :class:`.StringCache`.
+    """
 
-    def __init__(self, stream):
-        self.stream = stream
-        self._write = self.stream.write
 
-    def pack_raw(self, data):
-        self._write(data)
+def pack_string(value):
+    """ Pack a string into a :class:`.PackedString`.
+    """
+    encoded = value.encode("utf-8")
+    size = len(encoded)
+    if size < 0x10:
+        header = PACKED_UINT_8[0x80 + size]
+    elif size < 0x100:
+        header = b"\xD0" + PACKED_UINT_8[size]
+    elif size < 0x10000:
+        header = b"\xD1" + PACKED_UINT_16[size]
+    elif size < 0x100000000:
+        header = b"\xD2" + struct_pack(">I", size)
+    else:
+        raise OverflowError("String header size out of range")
+    return PackedString(header + encoded)
+
+
+class StringCache:
+    """ Bounded cache of packed strings, for values that are packed over
+    and over again, such as map keys and query text. The total size of
+    cached data is capped at `max_bytes`; when full, the least recently used
+    strings are evicted. Strings that would take up more than an eighth of
+    the cache are packed on demand but never stored.
+
+    The `hits` and `misses` counters can be used to tune the cache size.
+    """
 
-    def pack(self, value):
-        return self._pack(value)
+    default_max_bytes = 0x100000
 
-    def _pack(self, value):
-        write = self._write
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes or self.default_max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._strings = OrderedDict()
 
-        # None
-        if value is None:
-            write(b"\xC0")  # NULL
+    def __len__(self):
+        return len(self._strings)
 
-        # Boolean
-        elif value is True:
-            write(b"\xC3")
-        elif value is False:
-            write(b"\xC2")
+    def get(self, value):
+        """ Return the packed form of `value` if it is a string, otherwise
+        return `value` unchanged.
+        """
+        if not isinstance(value, str):
+            return value
+        strings = self._strings
+        try:
+            packed = strings[value]
+        except KeyError:
+            self.misses += 1
+            packed = pack_string(value)
+            size = len(packed)
+            if 8 * size <= self.max_bytes:
+                strings[value] = packed
+                self.size += size
+                while self.size > self.max_bytes:
+                    _, evicted = strings.popitem(last=False)
+                    self.size -= len(evicted)
+        else:
+            self.hits += 1
+            strings.move_to_end(value)
+        return packed
+
+    def clear(self):
+        self._strings.clear()
+        self.size = 0
+
+
+# Encoding
+# --------
+# The encoder below is the core of both the stub server and the client
+# packers (`boltkit.client.packstream.Packer` is a thin subclass of it). It
+# appends everything to a single growable `bytearray` and walks nested values
+# with an explicit stack of iterators, so deeply nested values cannot exhaust
+# the Python call stack.
+#
+# Long lists of numbers are common in bulk parameters, and packing these one
+# item at a time is slow. Where a list holds only floats, or only integers
+# which all need the same size of representation, the whole list can be
+# converted to big-endian binary in one go, with marker bytes then woven in
+# between the items. The same applies to `array.array` values and to one-
+# dimensional NumPy arrays, if NumPy is installed. The table below lists,
+# for each integer representation, its marker, the lowest and highest values
+# for which it is the most compact choice and its width in bytes.
+#
+INT_CLASSES = [
+    (b"", -0x10, 0x7F, 1),
+    (b"\xC8", -0x80, 0x7F, 1),
+    (b"\xC9", -0x8000, 0x7FFF, 2),
+    (b"\xCA", -0x80000000, 0x7FFFFFFF, 4),
+    (b"\xCB", -0x8000000000000000, 0x7FFFFFFFFFFFFFFF, 8),
+]
+INT_TYPE_CODES = {array(code).itemsize: code for code in "qlihb"}
+FLOAT_TYPE_CODES = set("fd")
+ARRAY_TYPES = (array,) if numpy is None else (array, numpy.ndarray)
+
+# Lists shorter than this are not worth checking for the fast path.
+VECTOR_MIN_SIZE = 16
+
+
+def int_class(value):
+    """ Return the index into INT_CLASSES of the most compact
+    representation for an integer value.
+    """
+    for i, (_, low, high, _) in enumerate(INT_CLASSES):
+        if low <= value <= high:
+            return i
+    raise OverflowError("Integer %s out of range" % value)
 
-        # Float (only double precision is supported)
-        elif isinstance(value, float):
-            write(b"\xC1")
-            write(struct_pack(">d", value))
 
-        # Integer
-        elif isinstance(value, int):
-            if -0x10 <= value < 0x80:
-                write(PACKED_UINT_8[value % 0x100])
-            elif -0x80 <= value < -0x10:
-                write(b"\xC8")
-                write(PACKED_UINT_8[value % 0x100])
-            elif -0x8000 <= value < 0x8000:
-                write(b"\xC9")
-                write(PACKED_UINT_16[value % 0x10000])
-            elif -0x80000000 <= value < 0x80000000:
-                write(b"\xCA")
-                write(struct_pack(">i", value))
-            elif INT64_MIN <= value < INT64_MAX:
-                write(b"\xCB")
-                write(struct_pack(">q", value))
+def common_int_class(low, high):
+    """ Given the lowest and highest of a set of integers, return the
+    index into INT_CLASSES of the representation shared by all of them, or
+    None if they need a mixture of representations.
+    """
+    low_class = int_class(low)
+    high_class = int_class(high)
+    if low_class == high_class == 0:
+        return 0
+    elif low_class == high_class and (low >= 0 or high < 0):
+        return low_class
+    else:
+        return None
+
+
+def big_endian(values, type_code):
+    """ Convert a sequence of numbers to big-endian binary data.
+    """
+    a = array(type_code, values)
+    if byteorder == "little":
+        a.byteswap()
+    return a.tobytes()
+
+
+def byte_view(value):
+    """ Return a flat view of the bytes held by a buffer. Contiguous buffers
+    are viewed in place; others are first copied.
+    """
+    view = memoryview(value)
+    if view.ndim == 1 and view.format in ("B", "b", "c"):
+        return view
+    elif view.c_contiguous:
+        return view.cast("B")
+    else:
+        return memoryview(view.tobytes())
+
+
+def structure_header(size, tag):
+    """ Return the packed marker, size and tag that begin a structure with
+    the given number of fields. The tag may be an integer or a single byte.
+    """
+    if size < 0x10:
+        header = PACKED_UINT_8[0xB0 + size]
+    elif size < 0x100:
+        header = b"\xDC" + PACKED_UINT_8[size]
+    elif size < 0x10000:
+        header = b"\xDD" + PACKED_UINT_16[size]
+    else:
+        raise OverflowError("Structure size out of range")
+    if type(tag) is int:
+        return PackedString(header + PACKED_UINT_8[tag])
+    elif isinstance(tag, bytes) and len(tag) == 1:
+        return PackedString(header + tag)
+    else:
+        raise ValueError("Structure signature must be a single byte value")
+
+
+class Encoder:
+    """ Reusable PackStream encoder. Packed values are appended to a single
+    growable `bytearray`, which may be supplied by the caller. Calling
+    `reset` discards everything packed so far (any data that was already in
+    a caller-supplied buffer is left alone) so that the same allocation can
+    be reused for the next message.
+
+    Besides lists and dicts, any other mapping or iterable can be packed.
+    Those without a known length (such as generators) are written between
+    LIST_STREAM (or MAP_STREAM) and END_OF_STREAM markers. If a `sink`
+    function is given, the buffer is handed over to it whenever a stream
+    has built up `flush_size` bytes, so that the full collection never
+    needs to be held in memory. For peers that do not accept stream
+    markers, `stream_markers` can be set to false; items are then counted
+    as they are packed and a regular sized header is inserted ahead of them.
+
+    Values of other types can be packed as structures by adding a function
+    for that type to `dehydrators`. Each such function takes a value and
+    returns a structure tag along with a tuple of fields.
+
+    Byte arrays may be given as any object supporting the buffer protocol.
+    If `passthrough_size` is set, those of at least that many bytes are not
+    copied into the buffer. Instead, the position at which each belongs is
+    noted in `references`, along with a view of its contents, and the data
+    is only read from there when it is finally written out (see `flush`,
+    `getvalue` and :func:`.chunk_pieces`). The contents must therefore not
+    be changed until then.
+
+    If a :class:`.StringCache` is supplied, map keys and string fields of
+    structures (such as the query text of a RUN message) are packed through
+    that cache.
+    """
+
+    #: Type of structure value that this encoder packs.
+    structure_class = Structure
+
+    #: Functions for packing values of other types as structures, by type.
+    dehydrators = {}
+
+    #: Whether values of unknown length are packed as streams.
+    stream_markers = True
+
+    #: Amount of buffered stream data that triggers a flush to the sink.
+    flush_size = 0x10000
+
+    #: Size from which byte arrays are referenced rather than copied, or
+    #: None to always copy them.
+    passthrough_size = None
+
+    #: Whether lists and arrays of numbers are packed in bulk, where they
+    #: allow it (see `_pack_vector`).
+    vectors = True
+
+    def __init__(self, buffer=None, string_cache=None, stream_markers=None, sink=None,
+                 passthrough_size=None):
+        if buffer is None:
+            buffer = bytearray()
+        self.buffer = buffer
+        self.start = len(buffer)
+        self.string_cache = string_cache
+        if stream_markers is not None:
+            self.stream_markers = stream_markers
+        self.sink = sink
+        if passthrough_size is not None:
+            self.passthrough_size = passthrough_size
+        self.references = []    # (position, view) for byte arrays not copied
+        self._pending = 0       # number of sized headers still to be inserted
+
+    def __len__(self):
+        return len(self.buffer) - self.start + sum(view.nbytes for _, view in self.references)
+
+    def reset(self):
+        del self.buffer[self.start:]
+        self.references.clear()
+
+    def getvalue(self):
+        return b"".join(self.pieces(self.start))
+
+    def pieces(self, start):
+        """ Return the packed data from `start` onwards as a list of pieces,
+        with copies of the buffer contents interleaved with views of any
+        referenced byte arrays.
+        """
+        buffer = self.buffer
+        pieces = []
+        for position, view in self.references:
+            if position > start:
+                pieces.append(bytes(buffer[start:position]))
+                start = position
+            pieces.append(view)
+        pieces.append(bytes(buffer[start:]))
+        return pieces
+
+    def flush(self):
+        """ Hand everything packed so far to the sink, if there is one.
+        """
+        buffer = self.buffer
+        start = self.start
+        if self.sink is not None and not self._pending:
+            if self.references:
+                for piece in self.pieces(start):
+                    self.sink(piece)
+                self.references.clear()
+            elif len(buffer) > start:
+                self.sink(buffer[start:])
+            del buffer[start:]
+
+    def pack(self, *values):
+        """ Pack a series of values onto the end of the buffer.
+        """
+        self._pack_all(values)
+
+    def _pack_all(self, values):
+        buffer = self.buffer
+        string_cache = self.string_cache
+        structure_class = self.structure_class
+        stack = [iter(values)]
+        while stack:
+            for value in stack[-1]:
+                if value is None:
+                    buffer += b"\xC0"
+                elif value is True:
+                    buffer += b"\xC3"
+                elif value is False:
+                    buffer += b"\xC2"
+                elif isinstance(value, int):
+                    if -0x10 <= value < 0x80:
+                        buffer.append(value & 0xFF)
+                    elif -0x80 <= value < 0x80:
+                        buffer += PACK_MARKED_INT_8(0xC8, value)
+                    elif -0x8000 <= value < 0x8000:
+                        buffer += PACK_MARKED_INT_16(0xC9, value)
+                    elif -0x80000000 <= value < 0x80000000:
+                        buffer += PACK_MARKED_INT_32(0xCA, value)
+                    elif INT64_MIN <= value < INT64_MAX:
+                        buffer += PACK_MARKED_INT_64(0xCB, value)
+                    else:
+                        raise OverflowError("Integer %s out of range" % value)
+                elif isinstance(value, float):
+                    buffer += PACK_MARKED_FLOAT_64(0xC1, value)
+                elif isinstance(value, str):
+                    utf_8 = value.encode("utf-8")
+                    size = len(utf_8)
+                    if size < 0x10:
+                        buffer.append(0x80 + size)
+                    else:
+                        self._pack_header(size, 0x80, b"\xD0", b"\xD1", b"\xD2",
+                                          "String header size out of range")
+                    buffer += utf_8
+                elif type(value) is PackedString:
+                    buffer += value
+                elif isinstance(value, list):
+                    size = len(value)
+                    if size < 0x10:
+                        buffer.append(0x90 + size)
+                    elif size >= VECTOR_MIN_SIZE and self._pack_vector(value):
+                        continue
+                    else:
+                        self._pack_header(size, 0x90, b"\xD4", b"\xD5", b"\xD6",
+                                          "List header size out of range")
+                    stack.append(iter(value))
+                    break
+                elif isinstance(value, dict):
+                    size = len(value)
+                    if size < 0x10:
+                        buffer.append(0xA0 + size)
+                    else:
+                        self._pack_header(size, 0xA0, b"\xD8", b"\xD9", b"\xDA",
+                                          "Map header size out of range")
+                    if string_cache is None:
+                        stack.append(chain.from_iterable(value.items()))
+                    else:
+                        stack.append(chain.from_iterable(
+                            zip(map(string_cache.get, value.keys()), value.values())))
+                    break
+                elif isinstance(value, structure_class):
+                    fields = value.fields
+                    size = len(fields)
+                    if size < 0x10:
+                        buffer.append(0xB0 + size)
+                    else:
+                        self._pack_header(size, 0xB0, b"\xDC", b"\xDD", None,
+                                          "Structure size out of range")
+                    tag = value.tag
+                    if type(tag) is int:
+                        buffer.append(tag)
+                    elif isinstance(tag, bytes) and len(tag) == 1:
+                        buffer += tag
+                    else:
+                        raise ValueError("Structure signature must be a single byte value")
+                    if string_cache is None:
+                        stack.append(iter(fields))
+                    else:
+                        stack.append(map(string_cache.get, fields))
+                    break
+                elif isinstance(value, (bytes, bytearray, memoryview)):
+                    if type(value) is memoryview:
+                        value = byte_view(value)
+                    size = len(value)
+                    self._pack_bytes_header(size)
+                    if self.passthrough_size is not None and size >= self.passthrough_size:
+                        self.references.append((len(buffer), memoryview(value)))
+                    else:
+                        buffer += value
+                elif isinstance(value, ARRAY_TYPES):
+                    if self._pack_vector(value):
+                        continue
+                    value = value.tolist()
+                    self._pack_header(len(value), 0x90, b"\xD4", b"\xD5", b"\xD6",
+                                      "List header size out of range")
+                    stack.append(iter(value))
+                    break
+                elif isinstance(value, Mapping):
+                    self._pack_header(len(value), 0xA0, b"\xD8", b"\xD9", b"\xDA",
+                                      "Map header size out of range")
+                    if string_cache is None:
+                        stack.append(chain.from_iterable(value.items()))
+                    else:
+                        stack.append(chain.from_iterable(
+                            zip(map(string_cache.get, value.keys()), value.values())))
+                    break
+                elif isinstance(value, Sized) and isinstance(value, Iterable):
+                    self._pack_header(len(value), 0x90, b"\xD4", b"\xD5", b"\xD6",
+                                      "List header size out of range")
+                    stack.append(iter(value))
+                    break
+                elif isinstance(value, Iterable):
+                    if self.stream_markers:
+                        buffer += b"\xD7"
+                        stack.append(self._stream(value, False))
+                        break
+                    self._pack_unsized(value, False)
+                elif value is EndOfStream:
+                    buffer += b"\xDF"
+                else:
+                    dehydrate = self.dehydrators.get(type(value))
+                    if dehydrate is None:
+                        raise ValueError("Values of type %s are not supported" % type(value))
+                    tag, fields = dehydrate(value)
+                    buffer += structure_header(len(fields), tag)
+                    if string_cache is None:
+                        stack.append(iter(fields))
+                    else:
+                        stack.append(map(string_cache.get, fields))
+                    break
             else:
-                raise OverflowError("Integer %s out of range" % value)
+                stack.pop()
+
+    def pack_list_header(self, size):
+        self._pack_header(size, 0x90, b"\xD4", b"\xD5", b"\xD6",
+                          "List header size out of range")
 
-        # String
-        elif isinstance(value, str):
-            encoded = value.encode("utf-8")
-            self.pack_string_header(len(encoded))
-            self.pack_raw(encoded)
+    def pack_map_header(self, size):
+        self._pack_header(size, 0xA0, b"\xD8", b"\xD9", b"\xDA",
+                          "Map header size out of range")
 
-        # Bytes
-        elif isinstance(value, bytes):
-            self.pack_bytes_header(len(value))
-            self.pack_raw(value)
-        elif isinstance(value, bytearray):
-            self.pack_bytes_header(len(value))
-            self.pack_raw(bytes(value))
-
-        # List
-        elif isinstance(value, list):
-            self.pack_list_header(len(value))
-            for item in value:
-                self._pack(item)
-
-        # Map
-        elif isinstance(value, dict):
-            self.pack_map_header(len(value))
-            for key, item in value.items():
-                self._pack(key)
-                self._pack(item)
-
-        # Structure
-        elif isinstance(value, Structure):
-            self.pack_struct(value.tag, value.fields)
-
-        # Other
+    def pack_list_stream(self, items):
+        """ Pack an iterable of unknown length as a list, consuming one item
+        at a time.
+        """
+        if self.stream_markers:
+            self.buffer += b"\xD7"
+            self._pack_all(self._stream(items, False))
         else:
-            raise ValueError("Values of type %s are not supported" % type(value))
+            self._pack_unsized(items, False)
 
-    def pack_bytes_header(self, size):
-        write = self._write
+    def pack_map_stream(self, items):
+        """ Pack an iterable of key-value pairs of unknown length as a map,
+        consuming one pair at a time.
+        """
+        if self.stream_markers:
+            self.buffer += b"\xDB"
+            self._pack_all(self._stream(items, True))
+        else:
+            self._pack_unsized(items, True)
+
+    def _stream(self, items, pairs):
+        # Yield the items of a stream followed by its end marker, flushing
+        # to the sink along the way
+        buffer = self.buffer
+        string_cache = self.string_cache
+        for item in items:
+            if pairs:
+                key, item = item
+                yield key if string_cache is None else string_cache.get(key)
+            yield item
+            if len(buffer) - self.start >= self.flush_size:
+                self.flush()
+        yield EndOfStream
+
+    def _pack_unsized(self, items, pairs):
+        # Pack the items, counting them, then insert a sized header
+        buffer = self.buffer
+        start = len(buffer)
+        size = 0
+        self._pending += 1
+        try:
+            if pairs:
+                string_cache = self.string_cache
+                for key, item in items:
+                    self._pack_all((key if string_cache is None else string_cache.get(key), item))
+                    size += 1
+            else:
+                for item in items:
+                    self._pack_all((item,))
+                    size += 1
+        finally:
+            self._pending -= 1
+        end = len(buffer)
+        if pairs:
+            Encoder.pack_map_header(self, size)
+        else:
+            Encoder.pack_list_header(self, size)
+        header = buffer[end:]
+        del buffer[end:]
+        buffer[start:start] = header
+        if self.references:
+            # Anything referenced from within the items has moved along
+            self.references[:] = [(position + len(header) if position > start else position, view)
+                                  for position, view in self.references]
+
+    def _pack_vector(self, value):
+        """ Pack a list, array or NumPy array made up entirely of floats, or
+        entirely of integers of the same size class, in bulk. If the value
+        does not fit that description, nothing is packed and False is
+        returned.
+        """
+        if not self.vectors:
+            return False
+        if isinstance(value, list):
+            types = set(map(type, value))
+            if types == {float}:
+                return self._pack_floats(len(value), lambda: big_endian(value, "d"))
+            elif types == {int}:
+                return self._pack_ints(value, min(value), max(value),
+                                       lambda width: big_endian(value, INT_TYPE_CODES[width]))
+            elif len(types) == 1:
+                dehydrate = self.dehydrators.get(types.pop())
+                if dehydrate is not None:
+                    return self._pack_dehydrated(value, dehydrate)
+        elif isinstance(value, array):
+            if value.typecode in FLOAT_TYPE_CODES:
+                return self._pack_floats(len(value), lambda: big_endian(value, "d"))
+            elif value.typecode in "bBhHiIlLqQ" and value:
+                return self._pack_ints(value, min(value), max(value),
+                                       lambda width: big_endian(value, INT_TYPE_CODES[width]))
+        elif value.ndim == 1:
+            kind = value.dtype.kind
+            if kind == "f":
+                return self._pack_floats(len(value), lambda: value.astype(">f8").tobytes())
+            elif kind in "iu" and value.size:
+                return self._pack_ints(value, int(value.min()), int(value.max()),
+                                       lambda width: value.astype(">i%d" % width).tobytes())
+        return False
+
+    def _pack_dehydrated(self, values, dehydrate):
+        # Pack a list of values of a type that each become a structure, as
+        # a single run of structure headers and fields, rather than going
+        # through the full type checks and a nested collection per item
+        headers = {}
+        string_cache = self.string_cache
+
+        def pieces():
+            for value in values:
+                tag, fields = dehydrate(value)
+                try:
+                    yield headers[len(fields), tag]
+                except KeyError:
+                    yield headers.setdefault((len(fields), tag), structure_header(len(fields), tag))
+                if string_cache is None:
+                    yield from fields
+                else:
+                    yield from map(string_cache.get, fields)
+
+        Encoder.pack_list_header(self, len(values))
+        self._pack_all(pieces())
+        return True
+
+    def _pack_floats(self, size, to_bytes):
+        Encoder.pack_list_header(self, size)
+        self._pack_interleaved(size, b"\xC1", 8, to_bytes())
+        return True
+
+    def _pack_ints(self, values, low, high, to_bytes):
+        i = common_int_class(low, high)
+        if i is None:
+            return False
+        marker, _, _, width = INT_CLASSES[i]
+        Encoder.pack_list_header(self, len(values))
+        self._pack_interleaved(len(values), marker, width, to_bytes(width))
+        return True
+
+    def _pack_interleaved(self, size, marker, width, data):
+        # Weave a marker in ahead of every `width` bytes of data
+        buffer = self.buffer
+        if not marker:
+            buffer += data
+            return
+        start = len(buffer)
+        step = width + 1
+        end = start + step * size
+        buffer += bytes(step * size)
+        buffer[start:end:step] = marker * size
+        for i in range(width):
+            buffer[start + 1 + i:end:step] = data[i::width]
+
+    def _pack_bytes_header(self, size):
+        buffer = self.buffer
         if size < 0x100:
-            write(b"\xCC")
-            write(PACKED_UINT_8[size])
+            buffer += b"\xCC"
+            buffer.append(size)
         elif size < 0x10000:
-            write(b"\xCD")
-            write(PACKED_UINT_16[size])
+            buffer += b"\xCD"
+            buffer += PACKED_UINT_16[size]
         elif size < 0x100000000:
-            write(b"\xCE")
-            write(struct_pack(">I", size))
+            buffer += b"\xCE"
+            buffer += STRUCT_UINT_32.pack(size)
         else:
             raise OverflowError("Bytes header size out of range")
 
-    def pack_string_header(self, size):
-        write = self._write
-        if size == 0x00:
-            write(b"\x80")
-        elif size == 0x01:
-            write(b"\x81")
-        elif size == 0x02:
-            write(b"\x82")
-        elif size == 0x03:
-            write(b"\x83")
-        elif size == 0x04:
-            write(b"\x84")
-        elif size == 0x05:
-            write(b"\x85")
-        elif size == 0x06:
-            write(b"\x86")
-        elif size == 0x07:
-            write(b"\x87")
-        elif size == 0x08:
-            write(b"\x88")
-        elif size == 0x09:
-            write(b"\x89")
-        elif size == 0x0A:
-            write(b"\x8A")
-        elif size == 0x0B:
-            write(b"\x8B")
-        elif size == 0x0C:
-            write(b"\x8C")
-        elif size == 0x0D:
-            write(b"\x8D")
-        elif size == 0x0E:
-            write(b"\x8E")
-        elif size == 0x0F:
-            write(b"\x8F")
+    def _pack_header(self, size, tiny, marker_8, marker_16, marker_32, error):
+        buffer = self.buffer
+        if size < 0x10:
+            buffer.append(tiny + size)
         elif size < 0x100:
-            write(b"\xD0")
-            write(PACKED_UINT_8[size])
+            buffer += marker_8
+            buffer.append(size)
         elif size < 0x10000:
-            write(b"\xD1")
-            write(PACKED_UINT_16[size])
-        elif size < 0x100000000:
-            write(b"\xD2")
-            write(struct_pack(">I", size))
+            buffer += marker_16
+            buffer += PACKED_UINT_16[size]
+        elif size < 0x100000000 and marker_32:
+            buffer += marker_32
+            buffer += STRUCT_UINT_32.pack(size)
         else:
-            raise OverflowError("String header size out of range")
+            raise OverflowError(error)
+
+
+class Packer(Encoder):
+    """ PackStream encoder that writes to a file-like `stream`. Each value
+    is packed in full by the :class:`.Encoder` and then written in one go,
+    except for streams of unknown length, which are written out in pieces
+    as they are produced.
+
+    When `stream_markers` is false, the items of such a stream are packed
+    into a spill buffer (which moves to disk once it grows beyond
+    `spill_size` bytes) and counted, so that a regular sized header can be
+    written ahead of them without holding them all in memory.
+    """
+
+    #: Size at which a spill buffer moves from memory to disk.
+    spill_size = 0x100000
+
+    #: Size of the pieces in which a spill buffer is copied out.
+    copy_size = 0x10000
+
+    #: Size from which byte arrays are written straight to the stream,
+    #: rather than copied.
+    passthrough_size = 0x10000
+
+    def __init__(self, stream, string_cache=None, stream_markers=True):
+        Encoder.__init__(self, None, string_cache, stream_markers, stream.write)
+        self.stream = stream
+
+    def pack_raw(self, data):
+        self.flush()
+        self.sink(data)
+
+    def pack(self, *values):
+        self._pack_all(values)
+        self.flush()
+
+    def pack_bytes_header(self, size):
+        self._pack_bytes_header(size)
+        self.flush()
+
+    def pack_string_header(self, size):
+        self._pack_header(size, 0x80, b"\xD0", b"\xD1", b"\xD2",
+                          "String header size out of range")
+        self.flush()
 
     def pack_list_header(self, size):
-        write = self._write
-        if size == 0x00:
-            write(b"\x90")
-        elif size == 0x01:
-            write(b"\x91")
-        elif size == 0x02:
-            write(b"\x92")
-        elif size == 0x03:
-            write(b"\x93")
-        elif size == 0x04:
-            write(b"\x94")
-        elif size == 0x05:
-            write(b"\x95")
-        elif size == 0x06:
-            write(b"\x96")
-        elif size == 0x07:
-            write(b"\x97")
-        elif size == 0x08:
-            write(b"\x98")
-        elif size == 0x09:
-            write(b"\x99")
-        elif size == 0x0A:
-            write(b"\x9A")
-        elif size == 0x0B:
-            write(b"\x9B")
-        elif size == 0x0C:
-            write(b"\x9C")
-        elif size == 0x0D:
-            write(b"\x9D")
-        elif size == 0x0E:
-            write(b"\x9E")
-        elif size == 0x0F:
-            write(b"\x9F")
-        elif size < 0x100:
-            write(b"\xD4")
-            write(PACKED_UINT_8[size])
-        elif size < 0x10000:
-            write(b"\xD5")
-            write(PACKED_UINT_16[size])
-        elif size < 0x100000000:
-            write(b"\xD6")
-            write(struct_pack(">I", size))
-        else:
-            raise OverflowError("List header size out of range")
+        super().pack_list_header(size)
+        self.flush()
 
     def pack_list_stream_header(self):
-        self._write(b"\xD7")
+        self.pack_raw(b"\xD7")
 
     def pack_map_header(self, size):
-        write = self._write
-        if size == 0x00:
-            write(b"\xA0")
-        elif size == 0x01:
-            write(b"\xA1")
-        elif size == 0x02:
-            write(b"\xA2")
-        elif size == 0x03:
-            write(b"\xA3")
-        elif size == 0x04:
-            write(b"\xA4")
-        elif size == 0x05:
-            write(b"\xA5")
-        elif size == 0x06:
-            write(b"\xA6")
-        elif size == 0x07:
-            write(b"\xA7")
-        elif size == 0x08:
-            write(b"\xA8")
-        elif size == 0x09:
-            write(b"\xA9")
-        elif size == 0x0A:
-            write(b"\xAA")
-        elif size == 0x0B:
-            write(b"\xAB")
-        elif size == 0x0C:
-            write(b"\xAC")
-        elif size == 0x0D:
-            write(b"\xAD")
-        elif size == 0x0E:
-            write(b"\xAE")
-        elif size == 0x0F:
-            write(b"\xAF")
-        elif size < 0x100:
-            write(b"\xD8")
-            write(PACKED_UINT_8[size])
-        elif size < 0x10000:
-            write(b"\xD9")
-            write(PACKED_UINT_16[size])
-        elif size < 0x100000000:
-            write(b"\xDA")
-            write(struct_pack(">I", size))
-        else:
-            raise OverflowError("Map header size out of range")
+        super().pack_map_header(size)
+        self.flush()
 
     def pack_map_stream_header(self):
-        self._write(b"\xDB")
+        self.pack_raw(b"\xDB")
 
     def pack_struct(self, signature, fields):
-        if len(signature) != 1 or not isinstance(signature, bytes):
-            raise ValueError("Structure signature must be a single byte value")
-        write = self._write
-        size = len(fields)
-        if size == 0x00:
-            write(b"\xB0")
-        elif size == 0x01:
-            write(b"\xB1")
-        elif size == 0x02:
-            write(b"\xB2")
-        elif size == 0x03:
-            write(b"\xB3")
-        elif size == 0x04:
-            write(b"\xB4")
-        elif size == 0x05:
-            write(b"\xB5")
-        elif size == 0x06:
-            write(b"\xB6")
-        elif size == 0x07:
-            write(b"\xB7")
-        elif size == 0x08:
-            write(b"\xB8")
-        elif size == 0x09:
-            write(b"\xB9")
-        elif size == 0x0A:
-            write(b"\xBA")
-        elif size == 0x0B:
-            write(b"\xBB")
-        elif size == 0x0C:
-            write(b"\xBC")
-        elif size == 0x0D:
-            write(b"\xBD")
-        elif size == 0x0E:
-            write(b"\xBE")
-        elif size == 0x0F:
-            write(b"\xBF")
-        else:
-            raise OverflowError("Structure size out of range")
-        write(signature)
-        for field in fields:
-            self._pack(field)
+        self.pack(Structure(signature, *fields))
 
     def pack_end_of_stream(self):
-        self._write(b"\xDF")
+        self.pack_raw(b"\xDF")
+
+    def pack_list_stream(self, items):
+        super().pack_list_stream(items)
+        self.flush()
+
+    def pack_map_stream(self, items):
+        super().pack_map_stream(items)
+        self.flush()
+
+    def _pack_unsized(self, items, pairs):
+        with SpooledTemporaryFile(max_size=self.spill_size) as spill:
+            packer = Packer(spill, self.string_cache, self.stream_markers)
+            size = 0
+            for item in items:
+                if pairs:
+                    key, item = item
+                    packer.pack(key if self.string_cache is None else
+                                self.string_cache.get(key), item)
+                else:
+                    packer.pack(item)
+                size += 1
+            if pairs:
+                Encoder.pack_map_header(self, size)
+            else:
+                Encoder.pack_list_header(self, size)
+            self.flush()
+            spill.seek(0)
+            read = spill.read
+            copy_size = self.copy_size
+            data = read(copy_size)
+            while data:
+                self.sink(data)
+                data = read(copy_size)
+
+
+# Sizing and packing in place
+# ---------------------------
+# Sometimes it's useful to know how big some packed data will be before
+# packing it, so that space can be set aside up front, and to then pack it
+# straight into that space. Note that in pure Python, writing into a fixed
+# region in this way costs a little more per value than appending to a
+# `bytearray`.
+#
+def _header_size(size):
+    # Marker plus size bytes for a string, list or map of the given size
+    if size < 0x10:
+        return 1
+    elif size < 0x100:
+        return 2
+    elif size < 0x10000:
+        return 3
+    elif size < 0x100000000:
+        return 5
+    else:
+        raise OverflowError("Header size out of range")
+
+
+def packed_size(*values, structure_class=Structure, dehydrators=None):
+    """ Return the exact number of bytes that an :class:`.Encoder` would
+    write for a series of values, without packing them. Iterables with no
+    known length (such as generators) cannot be sized without consuming
+    them, so these raise a ValueError.
+    """
+    if dehydrators is None:
+        dehydrators = Encoder.dehydrators
+    size = 0
+    stack = [iter(values)]
+    while stack:
+        for value in stack[-1]:
+            if value is None or value is True or value is False:
+                size += 1
+            elif isinstance(value, int):
+                if -0x10 <= value < 0x80:
+                    size += 1
+                elif -0x80 <= value < 0x80:
+                    size += 2
+                elif -0x8000 <= value < 0x8000:
+                    size += 3
+                elif -0x80000000 <= value < 0x80000000:
+                    size += 5
+                elif INT64_MIN <= value < INT64_MAX:
+                    size += 9
+                else:
+                    raise OverflowError("Integer %s out of range" % value)
+            elif isinstance(value, float):
+                size += 9
+            elif isinstance(value, str):
+                n = len(value.encode("utf-8"))
+                size += _header_size(n) + n
+            elif type(value) is PackedString:
+                size += len(value)
+            elif isinstance(value, (bytes, bytearray, memoryview)):
+                n = value.nbytes if type(value) is memoryview else len(value)
+                size += (2 if n < 0x100 else _header_size(n)) + n
+            elif isinstance(value, (list, ARRAY_TYPES)):
+                size += _header_size(len(value))
+                stack.append(iter(value.tolist() if isinstance(value, ARRAY_TYPES) else value))
+                break
+            elif isinstance(value, structure_class):
+                n = len(value.fields)
+                if n >= 0x10000:
+                    raise OverflowError("Structure size out of range")
+                size += _header_size(n) + 1
+                stack.append(iter(value.fields))
+                break
+            elif isinstance(value, Mapping):
+                size += _header_size(len(value))
+                stack.append(chain.from_iterable(value.items()))
+                break
+            elif isinstance(value, Sized) and isinstance(value, Iterable):
+                size += _header_size(len(value))
+                stack.append(iter(value))
+                break
+            elif isinstance(value, Iterable):
+                raise ValueError("Cannot size an iterable of unknown length")
+            else:
+                dehydrate = dehydrators.get(type(value))
+                if dehydrate is None:
+                    raise ValueError("Values of type %s are not supported" % type(value))
+                _, fields = dehydrate(value)
+                size += _header_size(len(fields)) + 1
+                stack.append(iter(fields))
+                break
+        else:
+            stack.pop()
+    return size
+
+
+class BufferWindow:
+    """ Stands in for a `bytearray` as the buffer of an :class:`.Encoder`,
+    but writes over a fixed region of an existing buffer, starting at
+    `offset`, rather than growing it. Writing beyond the end of the buffer
+    raises a ValueError.
+    """
+
+    def __init__(self, buffer, offset=0):
+        self.view = memoryview(buffer)
+        self.offset = offset
+
+    def __len__(self):
+        return self.offset
+
+    def __iadd__(self, data):
+        end = self.offset + len(data)
+        if end > len(self.view):
+            raise ValueError("Packed data does not fit in buffer")
+        self.view[self.offset:end] = data
+        self.offset = end
+        return self
+
+    def __setitem__(self, key, data):
+        self.view[key] = data
+
+    def append(self, value):
+        if self.offset >= len(self.view):
+            raise ValueError("Packed data does not fit in buffer")
+        self.view[self.offset] = value
+        self.offset += 1
+
+    def release(self):
+        self.view.release()
+
+
+class BufferWriter:
+    """ File-like writer that fills a fixed region of a writable buffer,
+    starting at `offset`, rather than growing it. Writing beyond the end of
+    the buffer raises a ValueError. If no offset is given, data is instead
+    appended to the buffer, which must then be a `bytearray`.
+    """
+
+    def __init__(self, buffer, offset=None):
+        if offset is None:
+            # Nothing to keep track of, so writes go straight to the buffer
+            self.view = None
+            self.write = buffer.extend
+        else:
+            self.view = memoryview(buffer)
+            self.offset = offset
+
+    def write(self, data):
+        end = self.offset + len(data)
+        if end > len(self.view):
+            raise ValueError("Packed data does not fit in buffer")
+        self.view[self.offset:end] = data
+        self.offset = end
+
+    def close(self):
+        if self.view is not None:
+            self.view.release()
+
+
+def pack_into(buffer, offset, *values, string_cache=None):
+    """ Pack a series of values directly into a writable buffer (such as a
+    `bytearray` sized using :func:`.packed_size`) at the given offset.
+    Returns the offset immediately following the packed data.
+    """
+    window = BufferWindow(buffer, offset)
+    try:
+        Encoder(window, string_cache).pack(*values)
+        return window.offset
+    finally:
+        window.release()
+
+
+def chunk_in_place(data, start, max_chunk_size=0xFFFF):
+    """ Frame a message held in a `bytearray` for transmission. The message
+    payload runs from `start + 2` to the end of `data`, with the two bytes
+    at `start` reserved for the first chunk header. Payloads larger than
+    `max_chunk_size` are split by moving each chunk along to make room for
+    its header; the end-of-message marker is then appended.
+    """
+    size = len(data) - start - 2
+    if size <= max_chunk_size:
+        data[start:start + 2] = PACKED_UINT_16[size]
+    else:
+        count = -(-size // max_chunk_size)
+        data += bytes(2 * (count - 1))
+        with memoryview(data) as view:
+            # Work backwards, so that no chunk is overwritten before it moves
+            for i in reversed(range(count)):
+                source = start + 2 + i * max_chunk_size
+                end = min(source + max_chunk_size, start + 2 + size)
+                target = source + 2 * i
+                if i:
+                    view[target:target + end - source] = view[source:end]
+                view[target - 2:target] = PACKED_UINT_16[end - source]
+    data += b"\x00\x00"
+
+
+def chunk_pieces(pieces, max_chunk_size=0xFFFF):
+    """ Frame a message for transmission, where the message payload is
+    given as a list of pieces (such as those returned by
+    :meth:`.Encoder.pieces`) rather than a single buffer. Returns a list of
+    pieces with chunk headers and the end-of-message marker in place.
+    Pieces that span more than one chunk are split using views, so that
+    none of the data is copied.
+    """
+    framed = []
+    chunk = []
+    chunk_size = 0
+    for piece in pieces:
+        if type(piece) is not memoryview:
+            piece = memoryview(piece)
+        while piece:
+            n = min(len(piece), max_chunk_size - chunk_size)
+            chunk.append(piece[:n])
+            chunk_size += n
+            piece = piece[n:]
+            if chunk_size == max_chunk_size:
+                framed.append(PACKED_UINT_16[chunk_size])
+                framed += chunk
+                chunk = []
+                chunk_size = 0
+    if chunk_size:
+        framed.append(PACKED_UINT_16[chunk_size])
+        framed += chunk
+    framed.append(b"\x00\x00")
+    return framed
+
+
+class KeyCache:
+    """ Bounded cache of decoded map keys, indexed by their raw UTF-8
+    bytes. Repeated keys are returned as the same `str` object, saving
+    both the decode and the allocation. When full, the least recently
+    used key is evicted.
+    """
+
+    default_capacity = 1024
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity or self.default_capacity
+        self._keys = OrderedDict()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def decode(self, data):
+        raw = bytes(data)
+        keys = self._keys
+        try:
+            key = keys[raw]
+        except KeyError:
+            key = keys[raw] = str(raw, "utf-8")
+            if len(keys) > self.capacity:
+                keys.popitem(last=False)
+        else:
+            keys.move_to_end(raw)
+        return key
+
+    def clear(self):
+        self._keys.clear()
 
 
 class Unpacker:
 
-    def __init__(self, unpackable):
+    def __init__(self, unpackable, key_cache=None, bytes_views=False):
         self.unpackable = unpackable
+        self.key_cache = key_cache
+        # If set, byte arrays are returned as views of the unpackable data,
+        # rather than as copies (see Decoder)
+        self.bytes_views = bytes_views
+
+    def _read_bytes(self, size):
+        if self.bytes_views:
+            return read_only(self.read(size))
+        return self.read(size).tobytes()
 
     def reset(self):
         self.unpackable.reset()
@@ -416,13 +1142,13 @@ class Unpacker:
         # Bytes
         elif marker == 0xCC:
             size, = struct_unpack(">B", self.read(1))
-            return self.read(size).tobytes()
+            return self._read_bytes(size)
         elif marker == 0xCD:
             size, = struct_unpack(">H", self.read(2))
-            return self.read(size).tobytes()
+            return self._read_bytes(size)
         elif marker == 0xCE:
             size, = struct_unpack(">I", self.read(4))
-            return self.read(size).tobytes()
+            return self._read_bytes(size)
 
         else:
             marker_high = marker & 0xF0
@@ -448,7 +1174,7 @@ class Unpacker:
                 return self._unpack_map(marker)
 
             # Structure
-            elif 0xB0 <= marker <= 0xBF:
+            elif 0xB0 <= marker <= 0xBF or marker in (0xDC, 0xDD):
                 size, tag = self._unpack_structure_header(marker)
                 value = Structure(tag, *([None] * size))
                 for i in range(len(value)):
@@ -503,41 +1229,61 @@ class Unpacker:
             size = marker & 0x0F
             value = {}
             for _ in range(size):
-                key = self._unpack()
+                key = self._unpack_key()
                 value[key] = self._unpack()
             return value
         elif marker == 0xD8:  # MAP_8:
             size, = struct_unpack(">B", self.read(1))
             value = {}
             for _ in range(size):
-                key = self._unpack()
+                key = self._unpack_key()
                 value[key] = self._unpack()
             return value
         elif marker == 0xD9:  # MAP_16:
             size, = struct_unpack(">H", self.read(2))
             value = {}
             for _ in range(size):
-                key = self._unpack()
+                key = self._unpack_key()
                 value[key] = self._unpack()
             return value
         elif marker == 0xDA:  # MAP_32:
             size, = struct_unpack(">I", self.read(4))
             value = {}
             for _ in range(size):
-                key = self._unpack()
+                key = self._unpack_key()
                 value[key] = self._unpack()
             return value
         elif marker == 0xDB:  # MAP_STREAM:
             value = {}
             key = None
             while key is not EndOfStream:
-                key = self._unpack()
+                key = self._unpack_key()
                 if key is not EndOfStream:
                     value[key] = self._unpack()
             return value
         else:
             return None
 
+    def _unpack_key(self):
+        key_cache = self.key_cache
+        if key_cache is None:
+            return self._unpack()
+        marker = self.read_u8()
+        if marker == -1:
+            raise ValueError("Nothing to unpack")
+        elif 0x80 <= marker <= 0x8F:
+            size = marker & 0x0F
+        elif marker == 0xD0:
+            size, = STRUCT_UINT_8.unpack(self.read(1))
+        elif marker == 0xD1:
+            size, = STRUCT_UINT_16.unpack(self.read(2))
+        else:
+            # Not a string short enough to cache, so step back
+            # over the marker and decode the key normally
+            self.unpackable.p -= 1
+            return self._unpack()
+        return key_cache.decode(self.read(size))
+
     def unpack_structure_header(self):
         marker = self.read_u8()
         if marker == -1:
@@ -550,9 +1296,1052 @@ class Unpacker:
         if marker_high == 0xB0:  # TINY_STRUCT
             signature = self.read(1).tobytes()
             return marker & 0x0F, signature
+        elif marker == 0xDC:  # STRUCT_8
+            size, = STRUCT_UINT_8.unpack(self.read(1))
+            signature = self.read(1).tobytes()
+            return size, signature
+        elif marker == 0xDD:  # STRUCT_16
+            size, = STRUCT_UINT_16.unpack(self.read(2))
+            signature = self.read(1).tobytes()
+            return size, signature
         else:
             raise ValueError("Expected structure, found marker %02X" % marker)
 
+    def unpack_list_header(self):
+        """ Read the header of a sized list, returning the number of items
+        that follow it.
+        """
+        marker = self.read_u8()
+        if 0x90 <= marker <= 0x9F:
+            return marker & 0x0F
+        elif marker == 0xD4:
+            return STRUCT_UINT_8.unpack(self.read(1))[0]
+        elif marker == 0xD5:
+            return STRUCT_UINT_16.unpack(self.read(2))[0]
+        elif marker == 0xD6:
+            return STRUCT_UINT_32.unpack(self.read(4))[0]
+        else:
+            raise ValueError("Expected sized list, found marker %02X" % marker)
+
+    def skip(self):
+        """ Advance past the next value without decoding it.
+        """
+        unpackable = self.unpackable
+        if unpackable.p >= unpackable.used:
+            raise ValueError("Nothing to skip")
+        unpackable.p = skip(unpackable.data, unpackable.p, unpackable.used)
+
+
+# Decoding
+# --------
+# The decoder below is the core of both the stub server and the client
+# unpackers. It works on a plain offset into the packed data: each of the
+# handler functions takes the decoder, the data and the offset at which to
+# start reading, and returns the decoded value along with the offset
+# immediately following it. The marker byte is used as an index into a pair
+# of 256-entry tables: markers which represent a value outright (tiny
+# integers, null and booleans) resolve directly via the first table; all
+# others are handed off to a function from the second. Items of lists, maps
+# and structures are dispatched inline, saving a call per item.
+#
+# Strings and byte arrays at least this long are read through a memoryview,
+# to save copying them out of the data before decoding.
+LARGE_VALUE_SIZE = 0x100
+
+
+class Decoder:
+    """ Core PackStream decoder. Structures are built by the `structure`
+    method, which callers with their own conventions for structure tags can
+    override; by default, :class:`.Structure` values with byte string tags
+    are produced. If a :class:`.KeyCache` is given, short string map keys
+    are decoded through it.
+
+    With `bytes_views` set, byte arrays are returned as read-only
+    `memoryview` slices of the data being decoded, instead of as copies.
+    Such views keep that data alive, and remain valid only for as long as
+    it is left unchanged.
+    """
+
+    def __init__(self, key_cache=None, bytes_views=False):
+        self.key_cache = key_cache
+        self.bytes_views = bytes_views
+
+    def structure(self, tag, fields):
+        return Structure(PACKED_UINT_8[tag], *fields)
+
+    def decode_from(self, data, offset=0):
+        """ Decode a single value from `data`, starting at `offset`.
+
+        Returns:
+            A 2-tuple of the decoded value and the offset immediately
+            following it in the data.
+        """
+        marker = data[offset]
+        value = MARKER_VALUES[marker]
+        if value is _HANDLED:
+            return MARKER_HANDLERS[marker](self, data, offset + 1, marker)
+        else:
+            return value, offset + 1
+
+    def decode_all(self, data, offset=0):
+        """ Decode every value from `offset` to the end of `data`, returning
+        them as a list.
+        """
+        values = []
+        end = len(data)
+        while offset < end:
+            value, offset = self.decode_from(data, offset)
+            values.append(value)
+        return values
+
+
+def _decode_float(_, data, offset, __):
+    return STRUCT_FLOAT_64.unpack_from(data, offset)[0], offset + 8
+
+
+def _decode_int_8(_, data, offset, __):
+    return STRUCT_INT_8.unpack_from(data, offset)[0], offset + 1
+
+
+def _decode_int_16(_, data, offset, __):
+    return STRUCT_INT_16.unpack_from(data, offset)[0], offset + 2
+
+
+def _decode_int_32(_, data, offset, __):
+    return STRUCT_INT_32.unpack_from(data, offset)[0], offset + 4
+
+
+def _decode_int_64(_, data, offset, __):
+    return STRUCT_INT_64.unpack_from(data, offset)[0], offset + 8
+
+
+def _decode_bytes(decoder, data, offset, size):
+    end = offset + size
+    if end > len(data):
+        raise ValueError("Bytes value extends beyond end of data")
+    if decoder.bytes_views:
+        return read_only(memoryview(data))[offset:end], end
+    if size < LARGE_VALUE_SIZE:
+        return bytes(data[offset:end]), end
+    return bytes(memoryview(data)[offset:end]), end
+
+
+def _decode_bytes_8(decoder, data, offset, _):
+    return _decode_bytes(decoder, data, offset + 1, data[offset])
+
+
+def _decode_bytes_16(decoder, data, offset, _):
+    return _decode_bytes(decoder, data, offset + 2, STRUCT_UINT_16.unpack_from(data, offset)[0])
+
+
+def _decode_bytes_32(decoder, data, offset, _):
+    return _decode_bytes(decoder, data, offset + 4, STRUCT_UINT_32.unpack_from(data, offset)[0])
+
+
+def _decode_string(data, offset, size):
+    end = offset + size
+    if end > len(data):
+        raise ValueError("String extends beyond end of data")
+    if size < LARGE_VALUE_SIZE:
+        return str(data[offset:end], "utf-8"), end
+    return str(memoryview(data)[offset:end], "utf-8"), end
+
+
+def _decode_tiny_string(_, data, offset, marker):
+    return _decode_string(data, offset, marker & 0x0F)
+
+
+def _decode_string_8(_, data, offset, __):
+    return _decode_string(data, offset + 1, data[offset])
+
+
+def _decode_string_16(_, data, offset, __):
+    return _decode_string(data, offset + 2, STRUCT_UINT_16.unpack_from(data, offset)[0])
+
+
+def _decode_string_32(_, data, offset, __):
+    return _decode_string(data, offset + 4, STRUCT_UINT_32.unpack_from(data, offset)[0])
+
+
+def _decode_list(decoder, data, offset, size):
+    values = MARKER_VALUES
+    handlers = MARKER_HANDLERS
+    items = []
+    append = items.append
+    for _ in range(size):
+        marker = data[offset]
+        item = values[marker]
+        if item is _HANDLED:
+            item, offset = handlers[marker](decoder, data, offset + 1, marker)
+        else:
+            offset += 1
+        append(item)
+    return items, offset
+
+
+def _decode_tiny_list(decoder, data, offset, marker):
+    return _decode_list(decoder, data, offset, marker & 0x0F)
+
+
+def _decode_list_8(decoder, data, offset, _):
+    return _decode_list(decoder, data, offset + 1, data[offset])
+
+
+def _decode_list_16(decoder, data, offset, _):
+    return _decode_list(decoder, data, offset + 2, STRUCT_UINT_16.unpack_from(data, offset)[0])
+
+
+def _decode_list_32(decoder, data, offset, _):
+    return _decode_list(decoder, data, offset + 4, STRUCT_UINT_32.unpack_from(data, offset)[0])
+
+
+def _decode_list_stream(decoder, data, offset, _):
+    items = []
+    while data[offset] != 0xDF:
+        item, offset = decoder.decode_from(data, offset)
+        items.append(item)
+    return items, offset + 1
+
+
+def _decode_key(decoder, data, offset):
+    # Decode a map key, through the key cache if it's a short string
+    marker = data[offset]
+    if 0x80 <= marker <= 0x8F:
+        start = offset + 1
+        end = start + (marker & 0x0F)
+    elif marker == 0xD0:
+        start = offset + 2
+        end = start + data[offset + 1]
+    elif marker == 0xD1:
+        start = offset + 3
+        end = start + STRUCT_UINT_16.unpack_from(data, offset + 1)[0]
+    else:
+        return decoder.decode_from(data, offset)
+    if end > len(data):
+        raise ValueError("String extends beyond end of data")
+    return decoder.key_cache.decode(data[start:end]), end
+
+
+def _decode_map(decoder, data, offset, size):
+    values = MARKER_VALUES
+    handlers = MARKER_HANDLERS
+    key_cache = decoder.key_cache
+    value = {}
+    for _ in range(size):
+        if key_cache is None:
+            key, offset = decoder.decode_from(data, offset)
+        else:
+            key, offset = _decode_key(decoder, data, offset)
+        marker = data[offset]
+        item = values[marker]
+        if item is _HANDLED:
+            item, offset = handlers[marker](decoder, data, offset + 1, marker)
+        else:
+            offset += 1
+        value[key] = item
+    return value, offset
+
+
+def _decode_tiny_map(decoder, data, offset, marker):
+    return _decode_map(decoder, data, offset, marker & 0x0F)
+
+
+def _decode_map_8(decoder, data, offset, _):
+    return _decode_map(decoder, data, offset + 1, data[offset])
+
+
+def _decode_map_16(decoder, data, offset, _):
+    return _decode_map(decoder, data, offset + 2, STRUCT_UINT_16.unpack_from(data, offset)[0])
+
+
+def _decode_map_32(decoder, data, offset, _):
+    return _decode_map(decoder, data, offset + 4, STRUCT_UINT_32.unpack_from(data, offset)[0])
+
+
+def _decode_map_stream(decoder, data, offset, _):
+    value = {}
+    while data[offset] != 0xDF:
+        key, offset = decoder.decode_from(data, offset)
+        value[key], offset = decoder.decode_from(data, offset)
+    return value, offset + 1
+
+
+def _decode_structure(decoder, data, offset, size):
+    tag = data[offset]
+    fields, offset = _decode_list(decoder, data, offset + 1, size)
+    return decoder.structure(tag, fields), offset
+
+
+def _decode_tiny_structure(decoder, data, offset, marker):
+    return _decode_structure(decoder, data, offset, marker & 0x0F)
+
+
+def _decode_structure_8(decoder, data, offset, _):
+    return _decode_structure(decoder, data, offset + 1, data[offset])
+
+
+def _decode_structure_16(decoder, data, offset, _):
+    return _decode_structure(decoder, data, offset + 2, STRUCT_UINT_16.unpack_from(data, offset)[0])
+
+
+def _decode_unknown(_, __, ___, marker):
+    raise ValueError("Unknown PackStream marker %02X" % marker)
+
+
+_HANDLED = object()
+
+MARKER_VALUES = [_HANDLED] * 0x100
+MARKER_VALUES[0x00:0x80] = range(0x00, 0x80)
+MARKER_VALUES[0xF0:0x100] = range(-0x10, 0x00)
+MARKER_VALUES[0xC0] = None
+MARKER_VALUES[0xC2] = False
+MARKER_VALUES[0xC3] = True
+MARKER_VALUES[0xDF] = EndOfStream
+
+MARKER_HANDLERS = [_decode_unknown] * 0x100
+MARKER_HANDLERS[0x80:0x90] = [_decode_tiny_string] * 0x10
+MARKER_HANDLERS[0x90:0xA0] = [_decode_tiny_list] * 0x10
+MARKER_HANDLERS[0xA0:0xB0] = [_decode_tiny_map] * 0x10
+MARKER_HANDLERS[0xB0:0xC0] = [_decode_tiny_structure] * 0x10
+MARKER_HANDLERS[0xC1] = _decode_float
+MARKER_HANDLERS[0xC8] = _decode_int_8
+MARKER_HANDLERS[0xC9] = _decode_int_16
+MARKER_HANDLERS[0xCA] = _decode_int_32
+MARKER_HANDLERS[0xCB] = _decode_int_64
+MARKER_HANDLERS[0xCC] = _decode_bytes_8
+MARKER_HANDLERS[0xCD] = _decode_bytes_16
+MARKER_HANDLERS[0xCE] = _decode_bytes_32
+MARKER_HANDLERS[0xD0] = _decode_string_8
+MARKER_HANDLERS[0xD1] = _decode_string_16
+MARKER_HANDLERS[0xD2] = _decode_string_32
+MARKER_HANDLERS[0xD4] = _decode_list_8
+MARKER_HANDLERS[0xD5] = _decode_list_16
+MARKER_HANDLERS[0xD6] = _decode_list_32
+MARKER_HANDLERS[0xD7] = _decode_list_stream
+MARKER_HANDLERS[0xD8] = _decode_map_8
+MARKER_HANDLERS[0xD9] = _decode_map_16
+MARKER_HANDLERS[0xDA] = _decode_map_32
+MARKER_HANDLERS[0xDB] = _decode_map_stream
+MARKER_HANDLERS[0xDC] = _decode_structure_8
+MARKER_HANDLERS[0xDD] = _decode_structure_16
+
+
+class TableUnpacker(Unpacker):
+    """ Unpacker backed by the table-driven :class:`.Decoder` core, instead
+    of walking a chain of comparisons for each marker byte.
+    """
+
+    def __init__(self, unpackable, key_cache=None, bytes_views=False):
+        super().__init__(unpackable, key_cache, bytes_views)
+        self.decoder = Decoder(key_cache, bytes_views)
+
+    def _unpack(self):
+        unpackable = self.unpackable
+        p = unpackable.p
+        used = unpackable.used
+        if p >= used:
+            raise ValueError("Nothing to unpack")
+        data = unpackable.data
+        if used < len(data):
+            # Keep the decoder from reading past the end of the valid data
+            data = memoryview(data)[:used]
+        try:
+            value, unpackable.p = self.decoder.decode_from(data, p)
+        except (IndexError, struct_error):
+            raise ValueError("Unexpected end of data")
+        finally:
+            if isinstance(data, memoryview):
+                data.release()
+        return value
+
+
+# Shape-specialised record decoding
+# ---------------------------------
+# Consecutive records in a result nearly always share one shape: the same
+# number of fields, each packed with the same kind of marker as in the record
+# before. A RecordShape is generated from one packed record as a function
+# which reads each field inline for the marker seen in its column, without
+# going through the dispatch tables. A field whose marker differs is decoded
+# through the tables as usual, and a record with a different number of fields
+# is refused altogether, to be decoded by the generic path instead.
+
+_SHAPE_GENERIC = """\
+    m = data[p]
+    v{i} = values[m]
+    if v{i} is HANDLED:
+        v{i}, p = handlers[m](decoder, data, p + 1, m)
+    else:
+        p += 1"""
+
+_SHAPE_NUMBER = """\
+    if data[p] == 0x{marker:02X}:
+        v{i}, = {struct}.unpack_from(data, p + 1)
+        p += {size}
+    else:
+        v{i}, p = decode_from(data, p)"""
+
+_SHAPE_STRING = """\
+    m = data[p]
+    if {check}:
+        q = p + {header}
+        p = q + {size}
+        if p > end:
+            raise ValueError("String extends beyond end of data")
+        v{i} = str(data[q:p], "utf-8")
+    else:
+        v{i}, p = decode_from(data, p)"""
+
+_SHAPE_NUMBERS = {
+    0xC1: ("STRUCT_FLOAT_64", 9),
+    0xC8: ("STRUCT_INT_8", 2),
+    0xC9: ("STRUCT_INT_16", 3),
+    0xCA: ("STRUCT_INT_32", 5),
+    0xCB: ("STRUCT_INT_64", 9),
+}
+
+
+class RecordShape:
+    """ Decoder for the fields of records shaped like the one packed in
+    `data` at `offset`, as the list which follows a RECORD structure header.
+    Values which are not specialised, such as nested collections and
+    byte arrays, are decoded by `decoder`.
+    """
+
+    def __init__(self, decoder, data, offset=0):
+        marker = data[offset]
+        if 0x90 <= marker <= 0x9F:
+            self.size = marker & 0x0F
+            guard = "data[p] != 0x%02X" % marker
+            header = 1
+        elif marker == 0xD4:
+            self.size = data[offset + 1]
+            guard = "data[p] != 0xD4 or data[p + 1] != %d" % self.size
+            header = 2
+        elif marker == 0xD5:
+            self.size, = STRUCT_UINT_16.unpack_from(data, offset + 1)
+            guard = "data[p] != 0xD5 or STRUCT_UINT_16.unpack_from(data, p + 1)[0] != %d" % self.size
+            header = 3
+        else:
+            raise ValueError("Record fields must be packed as a sized list")
+        lines = ["def decode_fields(data, p):",
+                 "    if %s:" % guard,
+                 "        return None, p",
+                 "    end = len(data)",
+                 "    p += %d" % header]
+        p = offset + header
+        self.markers = []
+        for i in range(self.size):
+            marker = data[p]
+            self.markers.append(marker)
+            if marker in _SHAPE_NUMBERS:
+                struct, size = _SHAPE_NUMBERS[marker]
+                lines.append(_SHAPE_NUMBER.format(i=i, marker=marker, struct=struct, size=size))
+            elif 0x80 <= marker <= 0x8F:
+                lines.append(_SHAPE_STRING.format(i=i, check="0x80 <= m <= 0x8F", header=1,
+                                                  size="(m & 0x0F)"))
+            elif marker == 0xD0:
+                lines.append(_SHAPE_STRING.format(i=i, check="m == 0xD0", header=2,
+                                                  size="data[p + 1]"))
+            else:
+                lines.append(_SHAPE_GENERIC.format(i=i))
+            p = skip(data, p)
+        lines.append("    return [%s], p" % ", ".join("v%d" % i for i in range(self.size)))
+        self.source = "\n".join(lines)
+        namespace = {
+            "decoder": decoder,
+            "decode_from": decoder.decode_from,
+            "values": MARKER_VALUES,
+            "handlers": MARKER_HANDLERS,
+            "HANDLED": _HANDLED,
+            "STRUCT_FLOAT_64": STRUCT_FLOAT_64,
+            "STRUCT_INT_8": STRUCT_INT_8,
+            "STRUCT_INT_16": STRUCT_INT_16,
+            "STRUCT_INT_32": STRUCT_INT_32,
+            "STRUCT_INT_64": STRUCT_INT_64,
+            "STRUCT_UINT_16": STRUCT_UINT_16,
+        }
+        exec(self.source, namespace)
+        self._decode_fields = namespace["decode_fields"]
+
+    def __repr__(self):
+        return "<RecordShape markers=%s>" % " ".join("%02X" % marker for marker in self.markers)
+
+    def decode_from(self, data, offset=0):
+        """ Decode the fields of a record from `data`, starting at `offset`.
+
+        Returns:
+            A 2-tuple of the list of fields and the offset immediately
+            following them, or of None and `offset` if the record has a
+            different number of fields to this shape.
+        """
+        return self._decode_fields(data, offset)
+
+
+def unpack_list_header(data, offset=0):
+    """ Read the header of a packed list, returning the number of items in
+    the list along with the offset of its first item.
+    """
+    marker = data[offset]
+    if 0x90 <= marker < 0xA0:
+        return marker & 0x0F, offset + 1
+    elif marker == 0xD4:
+        return data[offset + 1], offset + 2
+    elif marker == 0xD5:
+        return STRUCT_UINT_16.unpack_from(data, offset + 1)[0], offset + 3
+    elif marker == 0xD6:
+        return STRUCT_UINT_32.unpack_from(data, offset + 1)[0], offset + 5
+    else:
+        raise ValueError("Expected a list, found marker byte {:02X}".format(marker))
+
+
+def unpack_structure_header(data, offset=0):
+    """ Read the header of a packed structure, returning the number of
+    fields in the structure, its tag and the offset of its first field.
+    """
+    marker = data[offset]
+    if 0xB0 <= marker < 0xC0:
+        return marker & 0x0F, data[offset + 1], offset + 2
+    elif marker == 0xDC:
+        return data[offset + 1], data[offset + 2], offset + 3
+    elif marker == 0xDD:
+        return STRUCT_UINT_16.unpack_from(data, offset + 1)[0], data[offset + 3], offset + 4
+    else:
+        raise ValueError("Expected a structure, found marker byte {:02X}".format(marker))
+
+
+# Skipping and measuring
+# ----------------------
+# Sometimes all that's needed is to know where a value ends, or what kind of
+# value it is and how big, rather than the value itself; for example, when
+# counting records or logging message sizes. The `skip` and `measure`
+# functions walk the packed data to answer these questions without creating
+# any Python objects for the contents. Nested containers are handled with an
+# explicit stack of item counts rather than by recursion. Both functions
+# accept an `end` offset, beyond which the data is not valid.
+#
+Extent = namedtuple("Extent", ["type", "count", "start", "end"])
+
+_BYTES = 1      # followed by a number of bytes of data
+_ITEMS = 2      # followed by a number of values
+_PAIRS = 3      # followed by a number of key-value pairs
+_FIELDS = 4     # followed by a tag byte and a number of values
+_STREAM = 5     # followed by values up to an end-of-stream marker
+
+SIZE_STRUCTS = {1: STRUCT_UINT_8, 2: STRUCT_UINT_16, 4: STRUCT_UINT_32}
+
+# Entries are (type, width of size header, size, contents) and the size is
+# a count of bytes, items, pairs or fields, according to the contents.
+SIZE_TABLE = [(None, 0, 0, None)] * 0x100
+SIZE_TABLE[0x00:0x80] = [("Integer", 0, 0, _BYTES)] * 0x80
+SIZE_TABLE[0xF0:0x100] = [("Integer", 0, 0, _BYTES)] * 0x10
+SIZE_TABLE[0x80:0x90] = [("String", 0, size, _BYTES) for size in range(0x10)]
+SIZE_TABLE[0x90:0xA0] = [("List", 0, size, _ITEMS) for size in range(0x10)]
+SIZE_TABLE[0xA0:0xB0] = [("Map", 0, size, _PAIRS) for size in range(0x10)]
+SIZE_TABLE[0xB0:0xC0] = [("Structure", 0, size, _FIELDS) for size in range(0x10)]
+SIZE_TABLE[0xC0] = ("Null", 0, 0, _BYTES)
+SIZE_TABLE[0xC1] = ("Float", 0, 8, _BYTES)
+SIZE_TABLE[0xC2] = ("Boolean", 0, 0, _BYTES)
+SIZE_TABLE[0xC3] = ("Boolean", 0, 0, _BYTES)
+SIZE_TABLE[0xC8] = ("Integer", 0, 1, _BYTES)
+SIZE_TABLE[0xC9] = ("Integer", 0, 2, _BYTES)
+SIZE_TABLE[0xCA] = ("Integer", 0, 4, _BYTES)
+SIZE_TABLE[0xCB] = ("Integer", 0, 8, _BYTES)
+SIZE_TABLE[0xCC] = ("Bytes", 1, 0, _BYTES)
+SIZE_TABLE[0xCD] = ("Bytes", 2, 0, _BYTES)
+SIZE_TABLE[0xCE] = ("Bytes", 4, 0, _BYTES)
+SIZE_TABLE[0xD0] = ("String", 1, 0, _BYTES)
+SIZE_TABLE[0xD1] = ("String", 2, 0, _BYTES)
+SIZE_TABLE[0xD2] = ("String", 4, 0, _BYTES)
+SIZE_TABLE[0xD4] = ("List", 1, 0, _ITEMS)
+SIZE_TABLE[0xD5] = ("List", 2, 0, _ITEMS)
+SIZE_TABLE[0xD6] = ("List", 4, 0, _ITEMS)
+SIZE_TABLE[0xD7] = ("List", 0, 0, _STREAM)
+SIZE_TABLE[0xD8] = ("Map", 1, 0, _PAIRS)
+SIZE_TABLE[0xD9] = ("Map", 2, 0, _PAIRS)
+SIZE_TABLE[0xDA] = ("Map", 4, 0, _PAIRS)
+SIZE_TABLE[0xDB] = ("Map", 0, 0, _STREAM)
+SIZE_TABLE[0xDC] = ("Structure", 1, 0, _FIELDS)
+SIZE_TABLE[0xDD] = ("Structure", 2, 0, _FIELDS)
+
+
+def _read_header(data, offset, end):
+    # Read a marker and any size that follows it, returning the table
+    # entry (with the actual size filled in) and the offset of the content
+    if offset >= end:
+        raise ValueError("Unexpected end of data")
+    marker = data[offset]
+    type_name, width, size, contents = SIZE_TABLE[marker]
+    if type_name is None:
+        raise ValueError("Unknown marker byte {:02X}".format(marker))
+    offset += 1
+    if width:
+        if offset + width > end:
+            raise ValueError("Unexpected end of data")
+        size, = SIZE_STRUCTS[width].unpack_from(data, offset)
+        offset += width
+    return type_name, size, contents, offset
+
+
+def _skip_values(data, offset, remaining, end):
+    # Skip a number of consecutive values; a count of -1 means "up to and
+    # including the next end-of-stream marker"
+    stack = []
+    while remaining or stack:
+        if not remaining:
+            remaining = stack.pop()
+            continue
+        if remaining < 0 and offset < end and data[offset] == 0xDF:
+            offset += 1
+            remaining = stack.pop() if stack else 0
+            continue
+        _, size, contents, offset = _read_header(data, offset, end)
+        if remaining > 0:
+            remaining -= 1
+        if contents == _BYTES:
+            offset += size
+        elif contents == _STREAM:
+            stack.append(remaining)
+            remaining = -1
+        else:
+            if contents == _FIELDS:
+                offset += 1
+            if contents == _PAIRS:
+                size *= 2
+            if size:
+                stack.append(remaining)
+                remaining = size
+    if offset > end:
+        raise ValueError("Unexpected end of data")
+    return offset
+
+
+def skip(data, offset=0, end=None):
+    """ Step over a single value in `data`, starting at `offset`, without
+    decoding it. Returns the offset immediately following the value.
+    """
+    return _skip_values(data, offset, 1, len(data) if end is None else end)
+
+
+def measure(data, offset=0, end=None):
+    """ Describe a single value in `data`, starting at `offset`, without
+    decoding it.
+
+    Returns:
+        An `Extent` holding the PackStream type name of the value, its
+        element count (the number of bytes in a string or byte array, items
+        in a list, entries in a map, or fields in a structure; None for
+        other types) and the offsets at which the value starts and ends.
+    """
+    if end is None:
+        end = len(data)
+    type_name, size, contents, content_offset = _read_header(data, offset, end)
+    if contents == _BYTES:
+        value_end = content_offset + size
+        if value_end > end:
+            raise ValueError("Unexpected end of data")
+        if type_name not in ("String", "Bytes"):
+            size = None
+    elif contents == _STREAM:
+        size = 0
+        value_end = content_offset
+        while value_end < end and data[value_end] != 0xDF:
+            value_end = skip(data, value_end, end)
+            size += 1
+        if value_end >= end:
+            raise ValueError("Unexpected end of data")
+        value_end += 1
+        if type_name == "Map":
+            size //= 2
+    elif contents == _FIELDS:
+        value_end = _skip_values(data, content_offset + 1, size, end)
+    elif contents == _PAIRS:
+        value_end = _skip_values(data, content_offset, 2 * size, end)
+    else:
+        value_end = _skip_values(data, content_offset, size, end)
+    return Extent(type_name, size, offset, value_end)
+
+
+# Canonical form
+# --------------
+# The same value can be packed in more than one way, chiefly because map
+# entries may come in any order. The canonical form of a packed value has
+# the entries of every map sorted by the packed bytes of their keys, and
+# every stream replaced by a regular sized list or map. Since the canonical
+# form can be produced from packed data directly, two packed values can be
+# compared (or hashed, using `canonical_digest`) without decoding either of
+# them. Packed values that are already canonical, which includes any value
+# without maps of more than one entry, are passed over without copying.
+#
+# Note that producing the canonical form walks every value in Python, so
+# costs about as much as decoding. Where packed data is expected to arrive
+# in a known form, comparing `message_digest` values first is far cheaper.
+#
+def _canonical_header(type_name, size):
+    # Sized header to replace that of a stream
+    encoder = Encoder()
+    if type_name == "Map":
+        encoder.pack_map_header(size)
+    else:
+        encoder.pack_list_header(size)
+    return bytes(encoder.buffer)
+
+
+def _canonical_item(data, p, end):
+    # Return the offset following the value at `p`, along with its
+    # canonical form, or None if the value is canonical already
+    marker = data[p]
+    _, width, size, contents = SIZE_TABLE[marker]
+    if contents == _BYTES and not width:
+        # Fixed-size scalars and tiny strings need no further work
+        p += 1 + size
+        if p > end:
+            raise ValueError("Unexpected end of data")
+        return p, None
+    return _canonical(data, p, end)
+
+
+def _canonical(data, offset, end):
+    type_name, size, contents, p = _read_header(data, offset, end)
+    if contents == _BYTES:
+        p += size
+        if p > end:
+            raise ValueError("Unexpected end of data")
+        return p, None
+    stream = contents == _STREAM
+    if contents == _FIELDS:
+        if p >= end:
+            raise ValueError("Unexpected end of data")
+        p += 1
+    elif contents == _PAIRS:
+        size *= 2
+    if type_name == "Map":
+        # Collect the entries as pieces of packed data, and sort them
+        items = []
+        changed = stream
+        while stream or len(items) < size:
+            if p >= end:
+                raise ValueError("Unexpected end of data")
+            if stream and data[p] == 0xDF:
+                p += 1
+                break
+            start = p
+            p, canonical = _canonical_item(data, p, end)
+            if canonical is None:
+                canonical = data[start:p]
+            else:
+                changed = True
+            items.append(canonical)
+        entries = list(zip(items[0::2], items[1::2]))
+        ordered = sorted(entries, key=lambda entry: bytes(entry[0]))
+        if not changed and ordered == entries:
+            return p, None
+        header = _canonical_header(type_name, len(entries))
+        return p, b"".join([header] + list(chain.from_iterable(ordered)))
+    # For lists and structures, only those items that change are replaced,
+    # with the packed data in between them copied over as it is
+    if stream:
+        pieces = []
+        copied = p
+    else:
+        pieces = None
+        copied = offset
+    count = 0
+    while stream or count < size:
+        if p >= end:
+            raise ValueError("Unexpected end of data")
+        if stream and data[p] == 0xDF:
+            pieces.append(data[copied:p])
+            pieces.insert(0, _canonical_header(type_name, count))
+            return p + 1, b"".join(pieces)
+        start = p
+        p, canonical = _canonical_item(data, p, end)
+        if canonical is not None:
+            if pieces is None:
+                pieces = []
+            pieces.append(data[copied:start])
+            pieces.append(canonical)
+            copied = p
+        count += 1
+    if pieces is None:
+        return p, None
+    pieces.append(data[copied:p])
+    return p, b"".join(pieces)
+
+
+def canonicalize(data, offset=0, end=None):
+    """ Return the canonical form of the packed values in `data`, from
+    `offset` up to `end`, as bytes.
+    """
+    if end is None:
+        end = len(data)
+    pieces = []
+    changed = False
+    start = offset
+    while offset < end:
+        p, canonical = _canonical(data, offset, end)
+        if canonical is None:
+            canonical = data[offset:p]
+        else:
+            changed = True
+        pieces.append(canonical)
+        offset = p
+    if not changed:
+        return bytes(data[start:end])
+    return b"".join(pieces)
+
+
+def canonical_encoding(*values):
+    """ Pack a series of values in canonical form.
+    """
+    encoder = Encoder()
+    encoder.pack(*values)
+    return canonicalize(encoder.getvalue())
+
+
+def message_digest(data):
+    """ Return a stable 16-byte digest of packed data, exactly as given.
+    """
+    return md5(data).digest()
+
+
+def canonical_digest(data, offset=0, end=None):
+    """ Return a 16-byte digest of the canonical form of packed data. Packed
+    values that differ only in the order of map entries, or in the use of
+    streams, have the same digest.
+    """
+    return message_digest(canonicalize(data, offset, end))
+
+
+class LimitExceeded(ValueError):
+    """ Raised when packed data breaks one of the limits imposed by a
+    :class:`.BoundedUnpacker`.
+    """
+
+
+class Incomplete(Exception):
+    """ Raised internally when more data is needed to finish decoding the
+    current value.
+    """
+
+
+_LIST = 0
+_MAP = 1
+_STRUCT = 2
+_LIST_STREAM = 3
+_MAP_STREAM = 4
+
+_NO_KEY = object()
+
+
+class BoundedUnpacker(Unpacker):
+    """ Unpacker that walks nested values with an explicit stack instead of
+    recursion, and which enforces the following limits:
+
+    - `max_depth`: how deeply lists, maps and structures may be nested
+    - `max_length`: how many items a single list, map or structure may hold
+    - `max_bytes`: the packed size of a single top-level value
+
+    Each size header is checked against these limits before any memory is
+    allocated for the value it describes, and a breach of any limit raises
+    :class:`.LimitExceeded`.
+    """
+
+    default_max_depth = 100
+    default_max_length = 0x100000
+    default_max_bytes = 0x4000000
+
+    def __init__(self, unpackable, key_cache=None, max_depth=None,
+                 max_length=None, max_bytes=None, bytes_views=False):
+        super().__init__(unpackable, key_cache, bytes_views)
+        self.max_depth = max_depth or self.default_max_depth
+        self.max_length = max_length or self.default_max_length
+        self.max_bytes = max_bytes or self.default_max_bytes
+        self.decoder = Decoder(key_cache, bytes_views)
+        self._start = 0
+
+    def _unpack(self):
+        if self.unpackable.used <= self.unpackable.p:
+            raise ValueError("Nothing to unpack")
+        self._start = self.unpackable.p
+        try:
+            return self._resume([])
+        except Incomplete:
+            raise ValueError("Unexpected end of data")
+
+    def _resume(self, stack):
+        """ Decode values, continuing from the state held in `stack`, until
+        a complete top-level value is available. If the data runs out before
+        then, :class:`.Incomplete` is raised, leaving the buffer positioned
+        at the start of the last item that could not be read. The stack then
+        holds everything decoded so far, so that decoding can be resumed once
+        more data has arrived.
+        """
+        unpackable = self.unpackable
+        data = unpackable.data
+        key_cache = self.key_cache
+        max_depth = self.max_depth
+        max_length = self.max_length
+        limit = self._start + self.max_bytes
+        while True:
+            p = unpackable.p
+            available = unpackable.used - p
+            if available < 1:
+                raise Incomplete()
+            marker = data[p]
+            value = MARKER_VALUES[marker]
+            if value is _HANDLED:
+                type_name, width, size, kind = SIZE_TABLE[marker]
+                if available <= width:
+                    raise Incomplete()
+                if width:
+                    size, = SIZE_STRUCTS[width].unpack_from(data, p + 1)
+                header = 1 + width
+                if kind == _BYTES:
+                    end = p + header + size
+                    if end > limit:
+                        raise LimitExceeded("Value exceeds limit of %d bytes" % self.max_bytes)
+                    if end > unpackable.used:
+                        raise Incomplete()
+                    if (key_cache is not None and stack and stack[-1][3] is _NO_KEY
+                            and stack[-1][2] in (_MAP, _MAP_STREAM)
+                            and (0x80 <= marker <= 0x8F or marker in (0xD0, 0xD1))):
+                        value = key_cache.decode(data[p + header:end])
+                        unpackable.p = end
+                    else:
+                        value, unpackable.p = MARKER_HANDLERS[marker](self.decoder, data, p + 1, marker)
+                elif type_name is None:
+                    raise ValueError("Unknown PackStream marker %02X" % marker)
+                else:
+                    if len(stack) >= max_depth:
+                        raise LimitExceeded("Value exceeds limit of %d nesting "
+                                            "levels" % max_depth)
+                    if kind == _STREAM:
+                        unpackable.p = p + 1
+                        if marker == 0xD7:
+                            stack.append([[], -1, _LIST_STREAM, None])
+                        else:
+                            stack.append([{}, -1, _MAP_STREAM, _NO_KEY])
+                        continue
+                    if size > max_length:
+                        raise LimitExceeded("Value of %d items exceeds limit of "
+                                            "%d items" % (size, max_length))
+                    if kind == _FIELDS:
+                        header += 1
+                    # Every item takes at least one byte
+                    if p + header + (2 * size if kind == _PAIRS else size) > limit:
+                        raise LimitExceeded("Value exceeds limit of %d bytes" % self.max_bytes)
+                    if available < header:
+                        raise Incomplete()
+                    unpackable.p = p + header
+                    if kind == _ITEMS:
+                        frame = [[], size, _LIST, None]
+                    elif kind == _PAIRS:
+                        frame = [{}, size, _MAP, _NO_KEY]
+                    else:
+                        frame = [[], size, _STRUCT, bytes(data[p + header - 1:p + header])]
+                    if size:
+                        stack.append(frame)
+                        continue
+                    elif kind == _FIELDS:
+                        value = Structure(frame[3])
+                    else:
+                        value = frame[0]
+            else:
+                unpackable.p = p + 1
+
+            # Hand the value up to its container, closing off each
+            # container in turn as it becomes complete
+            while stack:
+                frame = stack[-1]
+                container, remaining, kind, extra = frame
+                if kind == _LIST or kind == _STRUCT:
+                    container.append(value)
+                elif kind == _MAP:
+                    if extra is _NO_KEY:
+                        frame[3] = value
+                        break
+                    container[extra] = value
+                    frame[3] = _NO_KEY
+                elif value is not EndOfStream:
+                    if kind == _LIST_STREAM:
+                        container.append(value)
+                    elif extra is _NO_KEY:
+                        frame[3] = value
+                        break
+                    else:
+                        container[extra] = value
+                        frame[3] = _NO_KEY
+                    if len(container) > max_length:
+                        raise LimitExceeded("Value exceeds limit of %d items" % max_length)
+                    break
+                if remaining > 0:
+                    remaining -= 1
+                    frame[1] = remaining
+                    if remaining:
+                        break
+                stack.pop()
+                if kind == _STRUCT:
+                    value = Structure(extra, *container)
+                else:
+                    value = container
+            else:
+                return value
+
+
+class FeedUnpacker(BoundedUnpacker):
+    """ Incremental unpacker, for data that arrives in pieces. Bytes are
+    passed in with `feed` as they become available, and `next_value` returns
+    each value as soon as it is complete. A value may be split across any
+    number of pieces at any point: decoding resumes from where it left off,
+    rather than starting again from the beginning of the value.
+    """
+
+    #: Consumed bytes are discarded from the front of the buffer once
+    #: there are at least this many of them.
+    compact_threshold = 0x10000
+
+    def __init__(self, key_cache=None, max_depth=None, max_length=None, max_bytes=None):
+        super().__init__(UnpackableBuffer(), key_cache, max_depth, max_length, max_bytes)
+        self._stack = []
+
+    def feed(self, data):
+        """ Append data to the end of the buffer.
+        """
+        buffer = self.unpackable
+        if buffer.p >= self.compact_threshold:
+            p = buffer.p
+            del buffer.data[:p]
+            buffer.used -= p
+            buffer.p = 0
+            self._start -= p
+        end = buffer.used + len(data)
+        buffer.data[buffer.used:end] = data
+        buffer.used = end
+
+    def next_value(self):
+        """ Return the next complete value, raising :class:`.Incomplete` if
+        more data is needed first.
+        """
+        if not self._stack:
+            self._start = self.unpackable.p
+        return self._resume(self._stack)
+
+    def values(self):
+        """ Iterate through all values that can be completed with the data
+        received so far.
+        """
+        while True:
+            try:
+                yield self.next_value()
+            except Incomplete:
+                return
+
+    def pending(self):
+        """ Return true if there is undecoded data in the buffer or a value
+        partially decoded.
+        """
+        return bool(self._stack) or self.unpackable.used > self.unpackable.p
+
 
 class UnpackableBuffer:
 
@@ -562,6 +2351,10 @@ class UnpackableBuffer:
         if data is None:
             self.data = bytearray(self.initial_capacity)
             self.used = 0
+        elif isinstance(data, bytearray):
+            # Adopt the bytearray as-is, to avoid copying it
+            self.data = data
+            self.used = len(self.data)
         else:
             self.data = bytearray(data)
             self.used = len(self.data)
@@ -578,6 +2371,12 @@ class UnpackableBuffer:
         self.p = q
         return subview
 
+    def skip(self, n):
+        q = self.p + n
+        if q > self.used:
+            raise ValueError("Cannot skip beyond end of data")
+        self.p = q
+
     def read_u8(self):
         if self.used - self.p >= 1:
             value = self.data[self.p]
@@ -609,20 +2408,138 @@ class UnpackableBuffer:
             self.used += n
 
 
+_UNDECODED = object()
+
+
+class LazyRecord:
+    """ Record (list of field values) that keeps hold of its packed bytes
+    and decodes each field only on first access. On construction, the
+    buffer must be positioned at the list header of the record; the fields
+    are then stepped over to build an index of their offsets, without
+    creating any Python objects for the values themselves.
+
+    Fields are decoded by `decoder` (such as the :class:`.Decoder` of the
+    connection on which the record arrived) if one is given, so that they
+    come out exactly as they would have been decoded up front. Otherwise,
+    an unpacker of `unpacker_class` is used.
+    """
+
+    unpacker_class = TableUnpacker
+
+    def __init__(self, buffer, decoder=None):
+        self._buffer = buffer
+        self._decoder = decoder
+        self._unpacker = unpacker = self.unpacker_class(buffer)
+        size = unpacker.unpack_list_header()
+        offsets = [0] * (size + 1)
+        for i in range(size):
+            offsets[i] = buffer.p
+            unpacker.skip()
+        offsets[size] = buffer.p
+        self._offsets = offsets
+        self._values = [_UNDECODED] * size
+
+    def __len__(self):
+        return len(self._values)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        value = self._values[index]
+        if value is _UNDECODED:
+            if index < 0:
+                index += len(self)
+            buffer = self._buffer
+            if self._decoder is None:
+                buffer.p = self._offsets[index]
+                value = self._unpacker.unpack()
+            else:
+                value, _ = self._decoder.decode_from(buffer.data, self._offsets[index])
+            self._values[index] = value
+        return value
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        except TypeError:
+            return False
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return "<LazyRecord size=%d>" % len(self)
+
+    def raw(self, index):
+        """ Return a memoryview over the packed bytes of a single field,
+        without decoding it.
+        """
+        if index < 0:
+            index += len(self)
+        start, end = self._offsets[index], self._offsets[index + 1]
+        return memoryview(self._buffer.data)[start:end]
+
+
 class PackStream:
     """ Asynchronous chunked message reader/writer for PackStream
     messaging.
     """
 
-    def __init__(self, reader, writer):
+    #: Unpacker implementation used to decode incoming messages. By default,
+    #: this is a :class:`.BoundedUnpacker`, so that a hostile or corrupted
+    #: message cannot exhaust the stack or cause huge allocations. It can
+    #: be set to :class:`.TableUnpacker` or :class:`.Unpacker` to decode
+    #: without limits.
+    unpacker_class = BoundedUnpacker
+
+    #: Limits applied to each incoming message (see :class:`.BoundedUnpacker`).
+    #: Where left as :const:`None`, the unpacker defaults are used.
+    max_depth = None
+    max_length = None
+    max_bytes = None
+
+    #: If true, each chunk is decoded as soon as it arrives, using a
+    #: :class:`.FeedUnpacker`, instead of waiting for the whole message.
+    incremental = False
+
+    #: Size from which byte arrays in outgoing messages are written out
+    #: from where they are, rather than copied (see :class:`.Encoder`).
+    passthrough_size = 0x10000
+
+    def __init__(self, reader, writer, unpacker_class=None, incremental=None,
+                 max_depth=None, max_length=None, max_bytes=None):
         self._reader = reader
         self._writer = writer
+        if unpacker_class is not None:
+            self.unpacker_class = unpacker_class
+        if incremental is not None:
+            self.incremental = incremental
+        if max_depth is not None:
+            self.max_depth = max_depth
+        if max_length is not None:
+            self.max_length = max_length
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        self.key_cache = KeyCache()
+        self.string_cache = None
 
     async def read_message(self):
         """ Read a chunked message.
 
         :return:
         """
+        if self.incremental:
+            return await self._read_message_incrementally()
+        return self.unpack_message(await self.read_raw_message())
+
+    async def read_raw_message(self):
+        """ Read a chunked message, returning its packed contents as bytes
+        without decoding them.
+        """
         data = []
         more = True
         while more:
@@ -633,10 +2550,39 @@ class PackStream:
                 data.append(chunk_data)
             else:
                 more = False
-        buffer = UnpackableBuffer(b"".join(data))
-        unpacker = Unpacker(buffer)
+        return b"".join(data)
+
+    def unpack_message(self, data):
+        """ Decode a message read by :meth:`.read_raw_message`.
+        """
+        buffer = UnpackableBuffer(data)
+        if issubclass(self.unpacker_class, BoundedUnpacker):
+            unpacker = self.unpacker_class(buffer, self.key_cache, self.max_depth,
+                                           self.max_length, self.max_bytes)
+        else:
+            unpacker = self.unpacker_class(buffer, self.key_cache)
         return unpacker.unpack()
 
+    async def _read_message_incrementally(self):
+        unpacker = FeedUnpacker(self.key_cache, self.max_depth, self.max_length, self.max_bytes)
+        message = None
+        more = True
+        while more:
+            chunk_header = await self._reader.readexactly(2)
+            chunk_size, = struct_unpack(">H", chunk_header)
+            if chunk_size:
+                unpacker.feed(await self._reader.readexactly(chunk_size))
+                if message is None:
+                    try:
+                        message = unpacker.next_value()
+                    except Incomplete:
+                        pass
+            else:
+                more = False
+        if message is None or unpacker.pending():
+            raise ValueError("Message does not hold exactly one value")
+        return message
+
     def write_message(self, message):
         """ Write a chunked message.
 
@@ -645,13 +2591,18 @@ class PackStream:
         """
         if not isinstance(message, Structure):
             raise TypeError("Message must be a Structure instance")
-        b = BytesIO()
-        packer = Packer(b)
-        packer.pack(message)
-        data = b.getvalue()
-        # TODO: multi-chunk messages
-        header = bytearray(divmod(len(data), 0x100))
-        self._writer.write(header + data + b"\x00\x00")
+        # Pack straight into the outgoing buffer, after a space reserved
+        # for the chunk header, which is then filled in. Large byte arrays
+        # are not copied into the buffer, but written out from where they
+        # are, between the chunks around them.
+        data = bytearray(2)
+        encoder = Encoder(data, self.string_cache, passthrough_size=self.passthrough_size)
+        encoder.pack(message)
+        if encoder.references:
+            self._writer.writelines(chunk_pieces(encoder.pieces(2)))
+        else:
+            chunk_in_place(data, 0)
+            self._writer.write(data)
 
     async def drain(self):
         """ Flush the writer.
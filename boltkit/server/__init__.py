@@ -31,7 +31,7 @@ from time import monotonic, sleep
 
 from boltkit.addressing import Address
 from boltkit.auth import Auth, make_auth
-from boltkit.client import AddressList, Connection
+from boltkit.client import AddressList, ConnectionPool
 from boltkit.server.images import resolve_image
 from boltkit.server.console import Neo4jConsole, Neo4jClusterConsole
 
@@ -174,7 +174,7 @@ class Neo4jMachine:
 
     ready = 0
 
-    def __init__(self, spec, image, auth):
+    def __init__(self, spec, image, auth, pool=None):
         from docker import DockerClient
         from docker.errors import ImageNotFound
         self.spec = spec
@@ -182,6 +182,9 @@ class Neo4jMachine:
         self.address = Address(("localhost", self.spec.bolt_port))
         self.addresses = AddressList([("localhost", self.spec.bolt_port)])
         self.auth = auth
+        # Connections come from the service pool, if there is one
+        self.own_pool = pool is None
+        self.pool = ConnectionPool(auth) if pool is None else pool
         self.docker = DockerClient.from_env(version="auto")
         environment = {}
         if self.auth:
@@ -247,8 +250,7 @@ class Neo4jMachine:
 
     def ping(self, timeout):
         try:
-            with Connection.open(*self.addresses, auth=self.auth,
-                                 timeout=timeout):
+            with self.pool.connection(*self.addresses, open_timeout=timeout):
                 log.info("Machine {!r} available".format(self.spec.fq_name))
 
         except OSError:
@@ -282,6 +284,8 @@ class Neo4jMachine:
 
     def stop(self, timeout=None):
         log.info("Stopping machine %r", self.spec.fq_name)
+        if self.own_pool:
+            self.pool.close()
         self.container.stop(timeout=timeout)
         self.container.remove(force=True)
 
@@ -378,6 +382,7 @@ class Neo4jService:
         self.network = None
         self.routing_tables = {"system": Neo4jRoutingTable()}
         self.console = None
+        self.pool = ConnectionPool(self.auth)
 
     def __enter__(self):
         try:
@@ -456,6 +461,7 @@ class Neo4jService:
         def _stop(machine):
             machine.stop(timeout)
 
+        self.pool.close()
         self._for_each_machine(_stop)
         if self.network:
             self.network.remove()
@@ -477,7 +483,7 @@ class Neo4jService:
     def update_routing_info(self, tx_context, *, force=False):
         if self._has_valid_routing_table(tx_context) and not force:
             return None
-        with Connection.open(*self.addresses, auth=self.auth) as cx:
+        with self.pool.connection(*self.addresses) as cx:
             routing_context = {}
             records = []
             if cx.bolt_version >= (4, 0):
@@ -547,6 +553,7 @@ class Neo4jStandaloneService(Neo4jService):
             spec,
             self.image,
             auth=self.auth,
+            pool=self.pool,
         )   
 
 
@@ -658,7 +665,7 @@ class Neo4jClusterService(Neo4jService):
                     "causal_clustering.initial_discovery_members":
                         ",".join(discovery_addresses),
                 })
-                self.machines[spec] = Neo4jMachine(spec, self.image, self.auth)
+                self.machines[spec] = Neo4jMachine(spec, self.image, self.auth, self.pool)
 
     def cores(self):
         return [machine for spec, machine in self.machines.items()
@@ -23,7 +23,7 @@ Server components, including stub server and proxy server.
 """
 
 
-from logging import getLogger
+from logging import getLogger, DEBUG
 from socket import socket, SOL_SOCKET, SO_REUSEADDR, AF_INET, AF_INET6
 from struct import unpack_from as raw_unpack
 from threading import Thread
@@ -31,7 +31,8 @@ from threading import Thread
 from boltkit.addressing import Address, AddressList
 from boltkit.server.bytetools import h
 from boltkit.client import CLIENT, SERVER
-from boltkit.client.packstream import UINT_32, Unpackable
+from boltkit.client.packstream import UINT_32
+from boltkit.packstream import BoundedUnpacker, UnpackableBuffer, measure
 
 
 log = getLogger("boltkit")
@@ -47,6 +48,10 @@ class Peer(object):
 
 class ProxyPair(Thread):
 
+    #: Fields that pack to more than this many bytes are logged by type and
+    #: size only, rather than being decoded.
+    log_value_size = 0x400
+
     def __init__(self, client, server):
         super(ProxyPair, self).__init__()
         self.client = client
@@ -96,17 +101,45 @@ class ProxyPair(Thread):
             d += data
         return d
 
+    @classmethod
+    def describe_fields(cls, message):
+        """ Describe the fields of a forwarded message for logging. Each
+        field is first measured, without being decoded (see
+        :func:`.measure`). Fields that pack to no more than `log_value_size`
+        bytes are then decoded, with a :class:`.BoundedUnpacker`, and shown
+        in full; larger ones are shown only by type, element count and size.
+        """
+        descriptions = []
+        offset = 2
+        while offset < len(message):
+            extent = measure(message, offset)
+            size = extent.end - extent.start
+            description = None
+            if size <= cls.log_value_size:
+                buffer = UnpackableBuffer(message[extent.start:extent.end])
+                try:
+                    description = repr(BoundedUnpacker(buffer).unpack())
+                except ValueError:
+                    pass
+            if description is None:
+                description = "<{} count={} size={}>".format(extent.type, extent.count, size)
+            descriptions.append(description)
+            offset = extent.end
+        return descriptions
+
     def forward_exchange(self, client, server):
         rq_message = self.forward_message(client, server)
         rq_signature = rq_message[1]
-        rq_data = Unpackable(rq_message[2:]).unpack_all()
-        log.debug("C: {} {}".format(self.client_messages[rq_signature], " ".join(map(repr, rq_data))))
+        if log.isEnabledFor(DEBUG):
+            rq_data = self.describe_fields(rq_message)
+            log.debug("C: {} {}".format(self.client_messages[rq_signature], " ".join(rq_data)))
         more = True
         while more:
             rs_message = self.forward_message(server, client)
             rs_signature = rs_message[1]
-            rs_data = Unpackable(rs_message[2:]).unpack_all()
-            log.debug("S: {} {}".format(self.server_messages[rs_signature], " ".join(map(repr, rs_data))))
+            if log.isEnabledFor(DEBUG):
+                rs_data = self.describe_fields(rs_message)
+                log.debug("S: {} {}".format(self.server_messages[rs_signature], " ".join(rs_data)))
             more = rs_signature == 0x71
 
 
@@ -23,7 +23,8 @@ from asyncio import sleep, IncompleteReadError
 from json import JSONDecoder
 from textwrap import wrap
 
-from boltkit.packstream import Structure
+from boltkit.packstream import Encoder, Structure, canonicalize, message_digest, \
+    unpack_structure_header
 
 
 def splart(s):
@@ -42,6 +43,10 @@ class BoltScript:
         "S": {},
     }
 
+    # Reverse lookup of `messages`, from name to tag, for each role. This is
+    # built separately for each class, the first time that it is needed.
+    tags = None
+
     def __new__(cls, *lines, auto=None, filename=None, handshake_data=None,
                 port=None, version=None):
         if version is None or version in {(1,), (3, 0), (3, 1), (3, 2), (3, 3)}:
@@ -75,6 +80,7 @@ class BoltScript:
 
     def append(self, line):
         line.script = self
+        line.compile()
         self._lines.append(line)
 
     def auto_match(self, tag):
@@ -95,10 +101,13 @@ class BoltScript:
 
     @classmethod
     def tag(cls, role, name):
-        tags = [k for k, v in cls.messages[role].items() if v == name]
-        if tags:
-            return tags[0]
-        else:
+        tags = cls.__dict__.get("tags")
+        if tags is None:
+            tags = cls.tags = {r: {n: t for t, n in reversed(list(messages.items()))}
+                               for r, messages in cls.messages.items()}
+        try:
+            return tags[role][name]
+        except KeyError:
             raise ValueError("Message %r not available for protocol "
                              "version %s" % (name, ".".join(map(str, cls.protocol_version))))
 
@@ -422,6 +431,11 @@ class Line:
 
     line_no = None
 
+    def compile(self):
+        """ Prepare anything needed to play this line that can be worked out
+        in advance, once the line has been added to a script.
+        """
+
     async def action(self, actor):
         pass
 
@@ -442,10 +456,28 @@ class ServerLine(Line):
 
 class ClientMessageLine(ClientLine):
 
+    # Digests of the expected message, packed with its map entries both in
+    # script order and in canonical order
+    digests = frozenset()
+
     def __init__(self, tag_name, *fields):
         self.tag_name = tag_name
         self.fields = fields
 
+    def compile(self):
+        # Incoming requests that hash to one of these digests can be matched
+        # without being decoded. The tag of a message that is not available
+        # in this protocol version is left to be reported at match time.
+        try:
+            tag = self.script.tag("C", self.tag_name)
+            encoder = Encoder()
+            encoder.pack(Structure(tag, *self.fields))
+        except (ValueError, OverflowError):
+            self.digests = frozenset()
+        else:
+            data = encoder.getvalue()
+            self.digests = frozenset([message_digest(data), message_digest(canonicalize(data))])
+
     def __str__(self):
         return "C: %s %s" % (self.tag_name, " ".join(map(repr, self.fields)))
 
@@ -461,7 +493,7 @@ class ClientMessageLine(ClientLine):
         more = True
         while more:
             try:
-                request = await actor.stream.read_message()
+                request = ReceivedMessage(actor.stream, await actor.stream.read_raw_message())
             except IncompleteReadError as error:
                 if not line and error.expected == 2 and error.partial == b"":
                     # Likely failed reading a new chunk header, and we're not
@@ -470,7 +502,7 @@ class ClientMessageLine(ClientLine):
                 else:
                     raise
             tag = script.tag_name("C", request.tag)
-            c_msg = ClientMessageLine(tag, *request.fields)
+            c_msg = ReceivedMessageLine(tag, request)
             c_msg.script = script
             if script.auto_match(request.tag):
                 # Auto-matched
@@ -497,7 +529,50 @@ class ClientMessageLine(ClientLine):
 
     def match(self, message):
         tag = self.script.tag("C", self.tag_name)
-        return tag == message.tag and tuple(self.fields) == tuple(message.fields)
+        if tag != message.tag:
+            return False
+        if isinstance(message, ReceivedMessage) and message.digest() in self.digests:
+            return True
+        # Fall back to comparing decoded fields, under which map entries may
+        # come in any order, and (for example) an integer in the script
+        # matches an equal float
+        return tuple(self.fields) == tuple(message.fields)
+
+
+class ReceivedMessage:
+    """ Message received from a client, held in packed form. The fields are
+    only decoded when first needed.
+    """
+
+    def __init__(self, stream, data):
+        self.stream = stream
+        self.data = data
+        _, tag, _ = unpack_structure_header(data)
+        self.tag = bytes([tag])
+        self._fields = None
+
+    @property
+    def fields(self):
+        if self._fields is None:
+            self._fields = self.stream.unpack_message(self.data).fields
+        return self._fields
+
+    def digest(self):
+        return message_digest(self.data)
+
+
+class ReceivedMessageLine(ClientMessageLine):
+    """ Script line describing a received message, for logging and for
+    error reports, which only decodes the message when displayed.
+    """
+
+    def __init__(self, tag_name, message):
+        self.tag_name = tag_name
+        self.message = message
+
+    @property
+    def fields(self):
+        return self.message.fields
 
 
 class ServerMessageLine(ServerLine):
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) 2002-2019 "Neo4j,"
+# Neo4j Sweden AB [http://neo4j.com]
+#
+# This file is part of Neo4j.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from unittest import TestCase
+
+from boltkit.bench import CODECS, ProxyCodec, compare, run_codec_benchmarks, samples
+
+
+class CodecBenchmarkTestCase(TestCase):
+
+    def test_codecs_round_trip_samples(self):
+        for codec_class in CODECS:
+            codec = codec_class()
+            if not codec.round_trip:
+                continue
+            for name, value in samples(codec.structure).items():
+                self.assertEqual(codec.decode(bytes(codec.encode(value))), value, name)
+
+    def test_proxy_describes_large_values(self):
+        codec = ProxyCodec()
+        values = samples(codec.structure)
+        self.assertEqual(codec.decode(codec.encode(values["scalars"])), repr(values["scalars"]))
+        self.assertEqual(codec.decode(codec.encode(values["long_string"])),
+                         "<String count=76000 size=76005>")
+
+    def test_run(self):
+        results = run_codec_benchmarks(number=1, repeat=1, names=["scalars"])
+        self.assertEqual(sorted(results), ["client.decode.scalars", "client.encode.scalars",
+                                           "client_scalar.decode.scalars",
+                                           "client_scalar.encode.scalars",
+                                           "proxy.decode.scalars", "proxy.encode.scalars",
+                                           "stub.decode.scalars", "stub.encode.scalars"])
+
+    def test_compare(self):
+        ratios, regressions = compare({"a": 2.0, "b": 1.1, "c": 1.0},
+                                      {"a": 1.0, "b": 1.0}, threshold=0.25)
+        self.assertEqual(ratios, {"a": 2.0, "b": 1.1})
+        self.assertEqual(regressions, ["a"])
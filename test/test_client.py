@@ -19,9 +19,21 @@
 # limitations under the License.
 
 
-from unittest import TestCase
+from array import array
+from socket import create_connection, socket
+from datetime import date, datetime, time, timedelta, timezone
+from unittest import TestCase, skipIf
 
-from boltkit.client import pack
+from boltkit.client import Connection, pack
+from boltkit.client.packstream import ColumnarRecords, Decoder, Duration, Node, Packer, Path, \
+    Point2D, Point3D, Relationship, Structure, UnboundRelationship, ZoneInfo, measure, skip, \
+    unpack, unpack_coordinates, unpack_from, unpack_all, packed_size, pack_into
+from boltkit.packstream import KeyCache, LazyRecord, StringCache, UnpackableBuffer
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 from boltkit.server.bytetools import h
 
 
@@ -43,3 +55,626 @@ class PackerTestCase(TestCase):
     def test_mixed_list(self):
         self.assertEqual(h(pack([1, True, 3.14, "fünf"])),
                          '94:01:C3:C1:40:09:1E:B8:51:EB:85:1F:85:66:C3:BC:6E:66')
+
+
+class ReusablePackerTestCase(TestCase):
+
+    values = [None, True, False, 0, -16, -17, -128, 127, 128, 1234, -32769, 2 ** 40,
+              3.14, "", "fünf", "x" * 300, [], [1, [2, [3]]], list(range(100)),
+              {}, {"a": 1, "b": [{"c": None}]}, Structure(0x4E, 1, ["A"], {"x": 1})]
+
+    def test_matches_pack(self):
+        for value in self.values:
+            packer = Packer()
+            packer.pack(value)
+            self.assertEqual(packer.getvalue(), pack(value))
+
+    def test_multiple_values(self):
+        packer = Packer()
+        packer.pack(*self.values)
+        self.assertEqual(packer.getvalue(), pack(*self.values))
+
+    def test_string_cache(self):
+        cache = StringCache()
+        packer = Packer(string_cache=cache)
+        for _ in range(3):
+            packer.reset()
+            packer.pack(*self.values)
+            self.assertEqual(packer.getvalue(), pack(*self.values))
+        self.assertGreater(cache.hits, 0)
+
+    def test_reset(self):
+        packer = Packer()
+        packer.pack("hello")
+        packer.reset()
+        packer.pack(1)
+        self.assertEqual(h(packer.getvalue()), '01')
+
+    def test_caller_supplied_buffer(self):
+        buffer = bytearray(b"\x00\x02")
+        packer = Packer(buffer)
+        packer.pack(1, 2)
+        self.assertEqual(h(buffer), '00:02:01:02')
+        packer.reset()
+        self.assertEqual(h(buffer), '00:02')
+
+    def test_deep_nesting(self):
+        value = []
+        for _ in range(5000):
+            value = [value]
+        packer = Packer()
+        packer.pack(value)
+        self.assertEqual(len(packer), 5001)
+
+
+class UnpackTestCase(TestCase):
+
+    def test_round_trip(self):
+        for value in ReusablePackerTestCase.values:
+            data = pack(value)
+            self.assertEqual(unpack_from(data), (value, len(data)))
+
+    def test_offset(self):
+        data = b"\xFF\xFF" + pack("hello", [1, 2])
+        value, offset = unpack_from(data, 2)
+        self.assertEqual(value, "hello")
+        self.assertEqual(unpack_from(data, offset), ([1, 2], len(data)))
+
+    def test_unpack_all(self):
+        data = pack(1, "two", [3], {"four": 4.0})
+        self.assertEqual(unpack_all(data), [1, "two", [3], {"four": 4.0}])
+        self.assertEqual(unpack_all(memoryview(data), 1), ["two", [3], {"four": 4.0}])
+
+    def test_large_structure(self):
+        value = Structure(0x7F, *range(20))
+        self.assertEqual(unpack(pack(value)), value)
+
+    def test_unknown_marker(self):
+        with self.assertRaises(ValueError):
+            unpack(b"\xE0")
+
+
+class BytesTestCase(TestCase):
+
+    def test_pack(self):
+        for value, expected in [(b"", 'CC:00'), (b"\x01\x02", 'CC:02:01:02'),
+                                (bytearray(b"\xFF"), 'CC:01:FF'),
+                                (memoryview(b"abc")[1:], 'CC:02:62:63')]:
+            self.assertEqual(h(pack(value)), expected)
+            self.assertEqual(h(packed(value)), expected)
+        self.assertEqual(pack(b"x" * 300)[:3], b"\xCD\x01\x2C")
+        self.assertEqual(pack(b"x" * 70000)[:5], b"\xCE\x00\x01\x11\x70")
+
+    def test_pack_any_buffer(self):
+        value = array("d", [1.5, -2.0])
+        self.assertEqual(pack(memoryview(value)), pack(value.tobytes()))
+        self.assertEqual(packed(memoryview(value)), pack(value.tobytes()))
+        self.assertEqual(packed_size(memoryview(value)), 18)
+
+    def test_unpack(self):
+        data = pack(b"abc", bytearray(b"x" * 300))
+        self.assertEqual(unpack_all(data), [b"abc", b"x" * 300])
+        view, _ = Decoder(bytes_views=True).decode_from(data)
+        self.assertIsInstance(view, memoryview)
+        self.assertTrue(view.readonly)
+        self.assertEqual(view, b"abc")
+
+    def test_passthrough(self):
+        value = bytearray(b"x" * 100)
+        packer = Packer(passthrough_size=100)
+        packer.pack([1, value, b"y" * 99])
+        self.assertEqual(len(packer.references), 1)
+        self.assertIs(packer.references[0][1].obj, value)
+        self.assertEqual(len(packer), len(pack([1, value, b"y" * 99])))
+        self.assertEqual(packer.getvalue(), pack([1, value, b"y" * 99]))
+
+
+class HydrationTestCase(TestCase):
+
+    def test_node(self):
+        node = unpack(pack(Structure(0x4E, 1, ["Person"], {"name": "Alice"})))
+        self.assertIsInstance(node, Node)
+        self.assertEqual((node.id, node.labels, node.properties), (1, ["Person"], {"name": "Alice"}))
+        self.assertEqual(node, Structure(0x4E, 1, ["Person"], {"name": "Alice"}))
+        self.assertFalse(hasattr(node, "__dict__"))
+
+    def test_relationship(self):
+        rel = unpack(pack(Structure(0x52, 9, 1, 2, "KNOWS", {})))
+        self.assertIsInstance(rel, Relationship)
+        self.assertEqual((rel.id, rel.start, rel.end, rel.type), (9, 1, 2, "KNOWS"))
+
+    def test_path(self):
+        nodes = [Node(1, [], {}), Node(2, [], {})]
+        relationships = [UnboundRelationship(9, "KNOWS", {})]
+        path = unpack(pack(Path(nodes, relationships, [1, 1])))
+        self.assertIsInstance(path, Path)
+        self.assertIsInstance(path.nodes[1], Node)
+        self.assertIsInstance(path.relationships[0], UnboundRelationship)
+        self.assertEqual(path.sequence, [1, 1])
+
+    def test_repack(self):
+        data = pack([Structure(0x4E, 1, ["Person"], {}), Structure(0x52, 9, 1, 2, "KNOWS", {})])
+        packer = Packer()
+        packer.pack(unpack(data))
+        self.assertEqual(packer.getvalue(), data)
+
+    def test_generic_structures(self):
+        data = pack(Structure(0x4E, 1, ["Person"], {}))
+        value, _ = Decoder(structure_types={}).decode_from(data)
+        self.assertIs(type(value), Structure)
+
+    def test_wrong_field_count(self):
+        for structure in [Structure(0x4E, 1, ["Person"]), Structure(0x44),
+                          Structure(0x58, 7203, 1.0, 2.0, 3.0)]:
+            value = unpack(pack(structure))
+            self.assertIs(type(value), Structure)
+            self.assertEqual(value, structure)
+
+    def test_compare_with_other_types(self):
+        self.assertNotEqual(Structure(0x44, 1), None)
+        self.assertNotEqual(Structure(0x44, 1), (0x44, 1))
+        self.assertFalse(Structure(0x44, 1) == 1)
+        self.assertIn(Structure(0x44, 1), [None, Structure(0x44, 1)])
+
+    def test_lazy_record(self):
+        data = pack([Structure(0x4E, 1, ["Person"], {}), b"abc"])
+        record = LazyRecord(UnpackableBuffer(data), Decoder(bytes_views=True))
+        self.assertIsInstance(record[0], Node)
+        self.assertEqual(record[0], unpack(data)[0])
+        self.assertIsInstance(record[1], memoryview)
+
+
+def packed(*values):
+    packer = Packer()
+    packer.pack(*values)
+    return packer.getvalue()
+
+
+class TemporalTestCase(TestCase):
+
+    values = [
+        (date(2019, 6, 1), Structure(0x44, 18048)),
+        (date(1969, 12, 31), Structure(0x44, -1)),
+        (time(12, 30, 15, 250), Structure(0x74, 45015000250000)),
+        (time(12, 30, tzinfo=timezone(timedelta(hours=1))), Structure(0x54, 45000000000000, 3600)),
+        (datetime(2019, 6, 1, 12, 0, 0, 5), Structure(0x64, 1559390400, 5000)),
+        (datetime(1969, 12, 31, 23, 59, 59), Structure(0x64, -1, 0)),
+        (datetime(2019, 6, 1, 12, tzinfo=timezone(timedelta(hours=-5))),
+         Structure(0x46, 1559390400, 0, -18000)),
+        (timedelta(days=3, seconds=4, microseconds=5), Structure(0x45, 0, 3, 4, 5000)),
+    ]
+
+    def test_pack(self):
+        for value, structure in self.values:
+            self.assertEqual(packed(value), pack(structure))
+            self.assertEqual(packed_size(value), len(pack(structure)))
+
+    def test_unpack(self):
+        for value, structure in self.values:
+            if isinstance(value, timedelta):
+                value = Duration(0, value.days, value.seconds, value.microseconds * 1000)
+            self.assertEqual(unpack(pack(structure)), value)
+
+    def test_out_of_range(self):
+        for structure in [Structure(0x44, 10 ** 8), Structure(0x64, -10 ** 12, 0),
+                          Structure(0x54, 0, 86400), Structure(0x46, 0, 0, -86400),
+                          Structure(0x74, 86400 * 10 ** 9)]:
+            value = unpack(pack(structure))
+            self.assertIs(type(value), Structure)
+            self.assertEqual(value, structure)
+
+    @skipIf(ZoneInfo is None, "zoneinfo not available")
+    def test_unknown_zone_id(self):
+        structure = Structure(0x66, 1559390400, 0, "No/Such_Zone")
+        value = unpack(packed([structure, date(2019, 6, 1)]))
+        self.assertEqual(value, [structure, date(2019, 6, 1)])
+        self.assertIs(type(value[0]), Structure)
+
+    def test_nanoseconds_are_truncated(self):
+        self.assertEqual(unpack(pack(Structure(0x64, 0, 1999))), datetime(1970, 1, 1, 0, 0, 0, 1))
+
+    @skipIf(ZoneInfo is None, "zoneinfo not available")
+    def test_zone_id(self):
+        value = datetime(2019, 6, 1, 12, tzinfo=ZoneInfo("Europe/Stockholm"))
+        structure = Structure(0x66, 1559390400, 0, "Europe/Stockholm")
+        self.assertEqual(packed(value), pack(structure))
+        self.assertEqual(unpack(pack(structure)), value)
+
+    @skipIf(ZoneInfo is None, "zoneinfo not available")
+    def test_time_in_named_zone(self):
+        with self.assertRaises(ValueError):
+            Packer().pack(time(12, tzinfo=ZoneInfo("Europe/Berlin")))
+
+    def test_lists(self):
+        values = [datetime(2019, 6, 1) + timedelta(minutes=i) for i in range(100)]
+        self.assertEqual(packed(values), pack([Structure(0x64, 1559347200 + 60 * i, 0)
+                                               for i in range(100)]))
+        self.assertEqual(unpack(packed(values)), values)
+
+    def test_connection_parameters(self):
+        run = Structure(0x10, "RETURN $x", {"x": date(2019, 6, 1)}, {})
+        self.assertEqual(packed(run), pack(Structure(0x10, "RETURN $x",
+                                                     {"x": Structure(0x44, 18048)}, {})))
+
+
+class PointTestCase(TestCase):
+
+    def test_round_trip(self):
+        for value in [Point2D(7203, 1.5, -2.0), Point3D(4979, 1.0, 2.0, 3.0)]:
+            self.assertEqual(unpack(packed(value)), value)
+            self.assertIs(type(unpack(packed(value))), type(value))
+
+    def test_lists(self):
+        values = [Point2D(7203, float(i), -float(i)) for i in range(20)]
+        self.assertEqual(packed(values), pack(values))
+
+    def test_unpack_coordinates(self):
+        values = [Point2D(4326, i / 2, -i / 4) for i in range(20)]
+        data = pack(values, "after")
+        dimensions, srids, coordinates, offset = unpack_coordinates(data)
+        self.assertEqual(dimensions, 2)
+        self.assertEqual(srids, array("q", [4326] * 20))
+        self.assertEqual(coordinates, array("d", [c for i in range(20) for c in (i / 2, -i / 4)]))
+        self.assertEqual(unpack(data, offset), "after")
+
+    def test_unpack_mixed_coordinates(self):
+        values = [Point3D(4979, 1.0, 2.0, 3.0), Point3D(9157, 4.0, 5.0, 6.0)]
+        dimensions, srids, coordinates, _ = unpack_coordinates(pack(values))
+        self.assertEqual(dimensions, 3)
+        self.assertEqual(srids, array("q", [4979, 9157]))
+        self.assertEqual(coordinates, array("d", [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]))
+        with self.assertRaises(ValueError):
+            unpack_coordinates(pack([Point2D(7203, 1.0, 2.0), Point3D(9157, 4.0, 5.0, 6.0)]))
+
+
+class VectorPackerTestCase(TestCase):
+
+    def assertPacksAs(self, value, expected):
+        packer = Packer()
+        packer.pack(value)
+        self.assertEqual(h(packer.getvalue()), h(pack(expected)))
+
+    def test_float_list(self):
+        value = [i / 3 for i in range(100)]
+        self.assertPacksAs(value, value)
+
+    def test_int_lists(self):
+        for value in [list(range(-16, 100)), list(range(-128, -16)), list(range(128, 400)),
+                      list(range(-40000, -32769)), [2 ** 40 + i for i in range(20)]]:
+            self.assertPacksAs(value, value)
+
+    def test_mixed_int_sizes(self):
+        value = list(range(-200, 200, 7))
+        self.assertPacksAs(value, value)
+
+    def test_mixed_types(self):
+        value = [1, 2.0] * 20 + [True]
+        self.assertPacksAs(value, value)
+
+    def test_arrays(self):
+        for value in [array("d", [0.5] * 20), array("f", [1.0, 2.0]),
+                      array("q", range(1000, 1020)), array("H", [7, 300]), array("u", "hi")]:
+            self.assertPacksAs(value, value.tolist())
+
+    def test_out_of_range(self):
+        with self.assertRaises(OverflowError):
+            Packer().pack(array("Q", [2 ** 64 - 1] * 20))
+
+    def test_vectors_disabled(self):
+        for value in [[i / 3 for i in range(100)], array("q", range(1000, 1020))]:
+            packer = Packer()
+            packer.vectors = False
+            packer.pack(value)
+            self.assertEqual(h(packer.getvalue()), h(pack(list(value))))
+
+    @skipIf(numpy is None, "NumPy not installed")
+    def test_numpy_arrays(self):
+        for value in [numpy.arange(20.0), numpy.arange(1000, 1020, dtype="int32"),
+                      numpy.array([-1, 1000]), numpy.zeros((2, 3)), numpy.array([True])]:
+            self.assertPacksAs(value, value.tolist())
+
+
+class ColumnarRecordsTestCase(TestCase):
+
+    def test_typed_columns(self):
+        records = ColumnarRecords(["n", "x"])
+        records.append([1, 0.5])
+        records.append([2 ** 40, 1.5])
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records["n"].values, array("q", [1, 2 ** 40]))
+        self.assertEqual(records[1].values, array("d", [0.5, 1.5]))
+        self.assertEqual(list(records), [[1, 0.5], [2 ** 40, 1.5]])
+
+    def test_mixed_column_reverts_to_list(self):
+        records = ColumnarRecords(["n"])
+        for value in [1, 2, None, 3.0, True, 2 ** 63]:
+            records.append([value])
+        self.assertFalse(records["n"].typed)
+        self.assertEqual(records["n"].values, [1, 2, None, 3.0, True, 2 ** 63])
+
+    def test_append_packed(self):
+        records = ColumnarRecords()
+        data = pack(Structure(0x71, [1, "a", 2.5]), Structure(0x71, [-300, "b", 3.5]))
+        offset = 0
+        while offset < len(data):
+            offset = records.append_packed(data, offset + 2)
+        self.assertEqual(records.fields, [0, 1, 2])
+        self.assertEqual(records[0].values, array("q", [1, -300]))
+        self.assertEqual(records[1].values, ["a", "b"])
+        self.assertEqual(records[2].values, array("d", [2.5, 3.5]))
+
+    def test_append_packed_with_decoder(self):
+        records = ColumnarRecords(["n", "b"])
+        records.append_packed(pack([1, b"abc"]), decoder=Decoder(bytes_views=True))
+        self.assertEqual(records["n"].values, array("q", [1]))
+        self.assertIsInstance(records["b"].values[0], memoryview)
+        self.assertEqual(records["b"].values[0], b"abc")
+
+    def test_wrong_size(self):
+        records = ColumnarRecords(["a", "b"])
+        with self.assertRaises(ValueError):
+            records.append([1])
+        with self.assertRaises(ValueError):
+            records.append_packed(pack([1, 2, 3]))
+
+    @skipIf(numpy is None, "NumPy not installed")
+    def test_to_numpy(self):
+        records = ColumnarRecords(["n", "s"])
+        records.append([1, "a"])
+        records.append([2, "b"])
+        arrays = records.to_numpy()
+        self.assertEqual(arrays["n"].tolist(), [1, 2])
+        self.assertEqual(arrays["s"].tolist(), ["a", "b"])
+
+
+class SkipTestCase(TestCase):
+
+    values = [None, True, 1, -16, 200, -40000, 2 ** 40, 1.5, "", "hello", "x" * 300,
+              [], [1, [2, [3]]], list(range(300)), {}, {"a": {"b": [1, {}]}},
+              Structure(0x4E, 1, ["L"], {"k": "v"}), [Structure(0x70)] * 20]
+
+    def test_skip(self):
+        for value in self.values:
+            data = pack(value, "after")
+            self.assertEqual(unpack(data, skip(data)), "after")
+
+    def test_skip_streams(self):
+        data = bytes.fromhex("D7 01 DB 81 61 D7 DF DF 02 DF 03")
+        self.assertEqual(skip(data), len(data) - 1)
+
+    def test_measure(self):
+        for value, type_name, count in [(None, "Null", None), (False, "Boolean", None),
+                                        (-40000, "Integer", None), (1.5, "Float", None),
+                                        ("hällo", "String", 6), (list(range(20)), "List", 20),
+                                        ({"a": 1, "b": []}, "Map", 2),
+                                        (Structure(0x71, [1, 2]), "Structure", 1)]:
+            data = pack(0, value, 0)
+            self.assertEqual(measure(data, 1), (type_name, count, 1, len(data) - 1))
+
+    def test_measure_streams(self):
+        self.assertEqual(measure(bytes.fromhex("D7 01 D7 DF 02 DF")), ("List", 3, 0, 6))
+        self.assertEqual(measure(bytes.fromhex("DB 81 61 01 DF")), ("Map", 1, 0, 5))
+
+    def test_truncated(self):
+        for data in [b"", b"\xC1\x00", b"\x92\x01", b"\xD0\x05abc", b"\xD7\x01"]:
+            with self.assertRaises(ValueError):
+                skip(data)
+            with self.assertRaises(ValueError):
+                measure(data)
+
+    def test_unknown_marker(self):
+        with self.assertRaises(ValueError):
+            skip(b"\x91\xDF")
+
+
+class PackedSizeTestCase(TestCase):
+
+    values = SkipTestCase.values + [[0.5] * 20, list(range(1000, 1100)), array("q", range(20))]
+
+    def test_packed_size(self):
+        for value in self.values:
+            packer = Packer()
+            packer.pack(value)
+            self.assertEqual(packed_size(value), len(packer))
+        self.assertEqual(packed_size(1, "two", [3]), len(pack(1, "two", [3])))
+
+    def test_pack_into(self):
+        for value in self.values:
+            packer = Packer()
+            packer.pack(value)
+            buffer = bytearray(b"?" * (len(packer) + 4))
+            self.assertEqual(pack_into(buffer, 2, value), len(packer) + 2)
+            self.assertEqual(buffer, b"??" + packer.getvalue() + b"??")
+        buffer = bytearray(packed_size({"a": 1}, "b"))
+        self.assertEqual(pack_into(buffer, 0, {"a": 1}, "b", string_cache=StringCache()),
+                         len(buffer))
+        self.assertEqual(buffer, pack({"a": 1}, "b"))
+
+    def test_pack_into_too_small(self):
+        for value in ["hello", [1.5] * 20]:
+            with self.assertRaises(ValueError):
+                pack_into(bytearray(4), 1, value)
+
+
+def message(tag, *fields):
+    data = pack(Structure(tag, *fields))
+    return b"".join(len(piece).to_bytes(2, "big") + piece
+                    for piece in [data[i:i + 100] for i in range(0, len(data), 100)]) + b"\x00\x00"
+
+
+class FakeSocket:
+    """ Socket that has already received `data`, and which returns it
+    `piece_size` bytes at a time.
+    """
+
+    def __init__(self, data, piece_size=1):
+        self.data = data
+        self.piece_size = piece_size
+        self.sent = bytearray()
+        self.calls = 0
+
+    def getpeername(self):
+        return "127.0.0.1", 7687
+
+    def recv_into(self, buffer):
+        self.calls += 1
+        size = min(len(buffer), self.piece_size, len(self.data))
+        buffer[:size] = self.data[:size]
+        self.data = self.data[size:]
+        return size
+
+    def sendall(self, data):
+        self.calls += 1
+        self.sent += data
+
+    def close(self):
+        pass
+
+
+class ScatterSocket(FakeSocket):
+    """ Fake socket that can also gather buffers, sending no more than
+    `piece_size` bytes per call.
+    """
+
+    def sendmsg(self, buffers):
+        self.calls += 1
+        data = b"".join(buffers)[:self.piece_size]
+        self.sent += data
+        return len(data)
+
+
+class ReceiveTestCase(TestCase):
+
+    def received(self):
+        return (message(0x70, {"server": "Neo4j/4.0.0"}) + b"\x00\x00" +
+                message(0x70, {"fields": ["x"]}) +
+                b"".join(message(0x71, [i, "x" * i]) for i in range(200)) +
+                message(0x70, {}))
+
+    def test_partial_reads(self):
+        for piece_size in [1, 3, 1000, 0x10000]:
+            s = FakeSocket(self.received(), piece_size)
+            cx = Connection(s, (4, 0), auth=None)
+            records = []
+            cx.run("UNWIND range(0, 199) AS x RETURN x, x * 'x'")
+            cx.pull(-1, -1, records)
+            cx.send_all()
+            cx.fetch_all()
+            self.assertEqual(records, [[i, "x" * i] for i in range(200)])
+            self.assertEqual(cx.server_agent, "Neo4j/4.0.0")
+
+    def test_large_reads(self):
+        s = FakeSocket(self.received(), 0x10000)
+        cx = Connection(s, (4, 0), auth=None)
+        cx.run("RETURN 1")
+        cx.pull(-1, -1, [])
+        cx.send_all()
+        cx.fetch_all()
+        self.assertLess(s.calls, 10)
+
+    def test_closed(self):
+        s = FakeSocket(message(0x70, {"server": "Neo4j/4.0.0"}) + b"\x00\x03\xB1", 10)
+        cx = Connection(s, (4, 0), auth=None)
+        cx.reset()
+        with self.assertRaises(OSError):
+            cx.fetch_all()
+        self.assertTrue(cx.closed)
+
+
+class SendTestCase(TestCase):
+
+    def requests(self, socket_class, piece_size):
+        s = socket_class(message(0x70, {"server": "Neo4j/4.0.0"}), piece_size)
+        cx = Connection(s, (4, 0), auth=None)
+        s.sent.clear()
+        s.calls = 0
+        blob = bytes(range(256)) * 1000
+        for i in range(4):
+            cx.run("RETURN $x", {"x": blob, "i": i})
+        cx.send_all()
+        return s
+
+    def test_single_call(self):
+        s = self.requests(ScatterSocket, 0x100000)
+        self.assertEqual(s.calls, 1)
+        self.assertEqual(s.sent, self.requests(FakeSocket, 1).sent)
+
+    def test_partial_writes(self):
+        expected = self.requests(FakeSocket, 1).sent
+        for piece_size in [1000, 65537, 100000]:
+            self.assertEqual(self.requests(ScatterSocket, piece_size).sent, expected)
+
+
+def socket_pair():
+    with socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        client = create_connection(listener.getsockname())
+        server, _ = listener.accept()
+    return client, server
+
+
+class PipelineTestCase(TestCase):
+
+    def setUp(self):
+        self.client, self.server = socket_pair()
+        self.server.sendall(message(0x70, {"server": "Neo4j/4.0.0"}))
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+
+    def test_window(self):
+        for i in range(50):
+            self.server.sendall(message(0x70, {"fields": ["i"]}) + message(0x71, [i]) +
+                                message(0x70, {}))
+        cx = Connection(self.client, (4, 0), auth=None, flush_count=2, max_in_flight=4)
+        records = []
+        for i in range(50):
+            cx.run("RETURN $i", {"i": i})
+            cx.pull(-1, -1, records)
+            self.assertLessEqual(cx.in_flight, 4)
+            self.assertLessEqual(cx.unsent, 1)
+        cx.fetch_all()
+        self.assertEqual(records, [[i] for i in range(50)])
+        self.assertFalse(cx.responses)
+
+    def test_flush_size(self):
+        cx = Connection(self.client, (4, 0), auth=None, flush_size=1000)
+        cx.run("RETURN $x", {"x": "x" * 500})
+        self.assertEqual(cx.unsent, 1)
+        cx.run("RETURN $x", {"x": "x" * 500})
+        self.assertEqual(cx.unsent, 0)
+        self.assertEqual(cx.in_flight, 2)
+
+    def test_fetch_sends_first(self):
+        self.server.sendall(message(0x70, {}))
+        cx = Connection(self.client, (4, 0), auth=None, flush_count=10)
+        response = cx.begin()
+        cx.fetch_all()
+        self.assertTrue(response.complete)
+
+    def test_key_cache(self):
+        key_cache = KeyCache()
+        self.server.sendall(message(0x70, {"fields": ["name"], "qid": 1}))
+        cx = Connection(self.client, (4, 0), auth=None, key_cache=key_cache)
+        cx.run("RETURN 1 AS name")
+        cx.fetch_all()
+        self.assertEqual(cx.query.metadata["fields"], ["name"])
+        self.assertEqual(len(key_cache), 3)  # server, fields, qid
+
+    def test_string_cache(self):
+        string_cache = StringCache()
+        cx = Connection(self.client, (4, 0), auth=None, string_cache=string_cache)
+        cx.run("RETURN $x", {"x": 1})
+        cx.send_all()
+        misses = string_cache.misses
+        for _ in range(2):
+            cx.run("RETURN $x", {"x": 1})
+            cx.send_all()
+        self.assertEqual(string_cache.misses, misses)
+        self.assertEqual(string_cache.hits, 4)
+
+    def test_unknown_setting(self):
+        with self.assertRaises(TypeError):
+            Connection(self.client, (4, 0), auth=None, flush_interval=1)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) 2002-2019 "Neo4j,"
+# Neo4j Sweden AB [http://neo4j.com]
+#
+# This file is part of Neo4j.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from io import BytesIO
+from unittest import TestCase
+
+from boltkit.client import packstream as client
+from boltkit import packstream as stub
+
+
+# Each value is given once with integer structure tags, as used by the
+# client, and is converted for the stub, which uses byte string tags.
+VALUES = [
+    None, True, False, 0, 1, -1, 127, -16, -17, -128, -129, 32767, -32768,
+    2 ** 31, -(2 ** 31) - 1, 2 ** 62, 3.14159, -0.0, "", "A", "Größenmaßstäbe",
+    "x" * 300, "y" * 70000, b"", b"\x00\x01", b"z" * 70000, [], [1, 2, 3], list(range(300)), [0.5] * 20,
+    {}, {"one": "eins"}, {"k%d" % i: i for i in range(20)},
+    [{"a": [1, {"b": None}]}],
+    client.Structure(0x4E, 1, ["Person"], {"name": "Alice"}),
+    client.Structure(0x7F, *range(20)),
+    client.Structure(0x7F, *range(300)),
+    [client.Structure(0x71, [i, "x"]) for i in range(20)],
+]
+
+
+def to_stub(value):
+    if isinstance(value, client.Structure):
+        return stub.Structure(bytes([value.tag]), *map(to_stub, value.fields))
+    elif isinstance(value, list):
+        return list(map(to_stub, value))
+    elif isinstance(value, dict):
+        return {key: to_stub(item) for key, item in value.items()}
+    else:
+        return value
+
+
+def stub_packed(value):
+    b = BytesIO()
+    stub.Packer(b).pack(value)
+    return b.getvalue()
+
+
+class EncodingConformanceTestCase(TestCase):
+
+    def test_all_encoders_agree(self):
+        for value in VALUES:
+            expected = client.pack(value)
+            packer = client.Packer()
+            packer.pack(value)
+            self.assertEqual(packer.getvalue(), expected)
+            encoder = stub.Encoder()
+            encoder.pack(to_stub(value))
+            self.assertEqual(encoder.getvalue(), expected)
+            self.assertEqual(stub_packed(to_stub(value)), expected)
+
+    def test_packed_size_agrees(self):
+        for value in VALUES:
+            size = len(client.pack(value))
+            self.assertEqual(client.packed_size(value), size)
+            self.assertEqual(stub.packed_size(to_stub(value)), size)
+
+    def test_out_of_range(self):
+        for value in [2 ** 63, -(2 ** 63) - 1]:
+            with self.assertRaises(OverflowError):
+                client.pack(value)
+            with self.assertRaises(OverflowError):
+                client.Packer().pack(value)
+            with self.assertRaises(OverflowError):
+                stub.Encoder().pack(value)
+
+    def test_unsized_iterables(self):
+        # The stub writes streams; the client writes sized lists
+        self.assertEqual(stub_packed(iter([1, 2])), b"\xD7\x01\x02\xDF")
+        packer = client.Packer()
+        packer.pack(iter([1, 2]))
+        self.assertEqual(packer.getvalue(), b"\x92\x01\x02")
+
+
+class DecodingConformanceTestCase(TestCase):
+
+    def test_all_decoders_agree(self):
+        for value in VALUES:
+            data = client.pack(value)
+            expected = to_stub(value)
+            self.assertEqual(client.unpack(data), value)
+            for unpacker_class in [stub.Unpacker, stub.TableUnpacker, stub.BoundedUnpacker]:
+                unpacker = unpacker_class(stub.UnpackableBuffer(data))
+                self.assertEqual(unpacker.unpack(), expected, unpacker_class.__name__)
+            feed = stub.FeedUnpacker()
+            for i in range(len(data)):
+                feed.feed(data[i:i + 1])
+            self.assertEqual(feed.next_value(), expected)
+
+    def test_skip_and_measure_agree(self):
+        for value in VALUES:
+            data = client.pack(0, value, 0)
+            _, end = client.unpack_from(data, 1)
+            self.assertEqual(client.skip(data, 1), end)
+            self.assertEqual(stub.measure(data, 1).end, end)
+            unpacker = stub.Unpacker(stub.UnpackableBuffer(data))
+            unpacker.unpack()
+            unpacker.skip()
+            self.assertEqual(unpacker.unpackable.p, end)
+
+    def test_streams(self):
+        data = b"\xD7\x01\xDB\x81a\xD7\xDF\xDF\xDF"
+        self.assertEqual(client.unpack(data), [1, {"a": []}])
+        self.assertEqual(stub.TableUnpacker(stub.UnpackableBuffer(data)).unpack(),
+                         [1, {"a": []}])
+
+    def test_truncated(self):
+        for data in [b"\xC1\x00", b"\x92\x01", b"\xD0\x05abc", b"\xDC\x01"]:
+            for unpacker_class in [stub.TableUnpacker, stub.BoundedUnpacker]:
+                with self.assertRaises(ValueError):
+                    unpacker_class(stub.UnpackableBuffer(data)).unpack()
@@ -0,0 +1,480 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) 2002-2019 "Neo4j,"
+# Neo4j Sweden AB [http://neo4j.com]
+#
+# This file is part of Neo4j.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from asyncio import new_event_loop, StreamReader
+from io import BytesIO
+from unittest import TestCase
+
+from boltkit.packstream import Packer, Unpacker, TableUnpacker, Decoder, RecordShape, \
+    UnpackableBuffer, Structure, LazyRecord, KeyCache, StringCache, \
+    BoundedUnpacker, LimitExceeded, FeedUnpacker, Incomplete, PackStream, \
+    Encoder, packed_size, pack_into, chunk_in_place, chunk_pieces, canonicalize, \
+    canonical_digest, canonical_encoding, message_digest, unpack_structure_header
+
+
+VALUES = [
+    None, True, False, 0, 1, -1, 127, -16, -17, -128, -129, 32767, -32768,
+    2 ** 31, -(2 ** 31) - 1, 2 ** 62, 3.14159, -0.0, "", "A", "Größenmaßstäbe",
+    "x" * 300, "y" * 70000, b"", b"\x00\x01", bytearray(b"abc") * 100,
+    [], [1, 2, 3], list(range(300)), {}, {"one": "eins"},
+    {"k%d" % i: i for i in range(20)}, [{"a": [1, {"b": None}]}],
+    Structure(b"\x4E", 1, ["Person"], {"name": "Alice"}),
+]
+
+
+def packed(value, string_cache=None):
+    b = BytesIO()
+    Packer(b, string_cache).pack(value)
+    return b.getvalue()
+
+
+class TableUnpackerTestCase(TestCase):
+
+    def test_matches_unpacker(self):
+        for value in VALUES:
+            data = packed(value)
+            expected = Unpacker(UnpackableBuffer(data)).unpack()
+            actual = TableUnpacker(UnpackableBuffer(data)).unpack()
+            self.assertEqual(actual, expected)
+            self.assertEqual(type(actual), type(expected))
+
+    def test_stream_markers(self):
+        data = b"\xD7\x01\x02\xDF\xDB\x81a\x01\xDF"
+        unpacker = TableUnpacker(UnpackableBuffer(data))
+        self.assertEqual(unpacker.unpack(), [1, 2])
+        self.assertEqual(unpacker.unpack(), {"a": 1})
+
+    def test_unknown_marker(self):
+        with self.assertRaises(ValueError):
+            TableUnpacker(UnpackableBuffer(b"\xE0")).unpack()
+
+    def test_nothing_to_unpack(self):
+        with self.assertRaises(ValueError):
+            TableUnpacker(UnpackableBuffer(b"")).unpack()
+
+
+class SkipTestCase(TestCase):
+
+    def test_skip_lands_on_next_value(self):
+        for value in VALUES:
+            buffer = UnpackableBuffer(packed(value) + b"\x2A")
+            unpacker = Unpacker(buffer)
+            unpacker.skip()
+            self.assertEqual(unpacker.unpack(), 42)
+
+    def test_skip_stream(self):
+        unpacker = Unpacker(UnpackableBuffer(b"\xD7\x01\x92\x02\x03\xDF\x2A"))
+        unpacker.skip()
+        self.assertEqual(unpacker.unpack(), 42)
+
+    def test_skip_truncated(self):
+        with self.assertRaises(ValueError):
+            Unpacker(UnpackableBuffer(b"\xD0\x10abc")).skip()
+
+
+class LazyRecordTestCase(TestCase):
+
+    def test_fields_decoded_on_access(self):
+        fields = ["x" * 1000, [1, 2, 3], {"a": 1}, None, 3.5]
+        record = LazyRecord(UnpackableBuffer(packed(fields)))
+        self.assertEqual(len(record), 5)
+        self.assertEqual(record[1], [1, 2, 3])
+        self.assertEqual(record[-1], 3.5)
+        self.assertEqual(record[2:4], [{"a": 1}, None])
+        self.assertEqual(list(record), fields)
+        self.assertEqual(record, fields)
+
+    def test_raw_field(self):
+        record = LazyRecord(UnpackableBuffer(packed([1, "hello"])))
+        self.assertEqual(record.raw(1).tobytes(), b"\x85hello")
+
+
+class RecordShapeTestCase(TestCase):
+
+    def test_same_shape(self):
+        shape = RecordShape(Decoder(), packed([1, 2.5, "abc", "x" * 40, -300, None]))
+        for fields in [[1, 2.5, "abc", "x" * 40, -300, None], [-5, 0.0, "", "y" * 200, 70000, True]]:
+            data = packed(fields)
+            self.assertEqual(shape.decode_from(data), (fields, len(data)))
+
+    def test_different_markers(self):
+        shape = RecordShape(Decoder(), packed([1, 2.5, "abc", [1, {"a": 2}]]))
+        fields = [2 ** 40, "two", 2.5, None]
+        data = b"??" + packed(fields)
+        self.assertEqual(shape.decode_from(data, 2), (fields, len(data)))
+
+    def test_different_size(self):
+        shape = RecordShape(Decoder(), packed([1, 2]))
+        for fields in [[1], [1, 2, 3], list(range(20))]:
+            self.assertEqual(shape.decode_from(packed(fields)), (None, 0))
+        shape = RecordShape(Decoder(), packed(list(range(300))))
+        self.assertEqual(shape.decode_from(packed(list(range(300))))[0], list(range(300)))
+        self.assertEqual(shape.decode_from(packed(list(range(299)))), (None, 0))
+
+    def test_truncated(self):
+        shape = RecordShape(Decoder(), packed(["hello"]))
+        with self.assertRaises(ValueError):
+            shape.decode_from(packed(["hello"])[:-1])
+
+
+class KeyCacheTestCase(TestCase):
+
+    def test_repeated_keys_are_shared(self):
+        data = packed([{"name": 1, "x" * 20: 2}, {"name": 3, "x" * 20: 4}])
+        for unpacker_class in (Unpacker, TableUnpacker):
+            cache = KeyCache()
+            first, second = unpacker_class(UnpackableBuffer(data), cache).unpack()
+            self.assertEqual(first, {"name": 1, "x" * 20: 2})
+            self.assertEqual(second, {"name": 3, "x" * 20: 4})
+            for a, b in zip(first, second):
+                self.assertIs(a, b)
+            self.assertEqual(len(cache), 2)
+
+    def test_non_string_keys(self):
+        data = b"\xA2\x01\x02\xC0\x03"
+        value = TableUnpacker(UnpackableBuffer(data), KeyCache()).unpack()
+        self.assertEqual(value, {1: 2, None: 3})
+
+    def test_truncated_map(self):
+        for data in [b"\xA1", b"\xA2\x81a\x01", b"\xDB\x81a\x01"]:
+            for unpacker_class in (Unpacker, TableUnpacker, BoundedUnpacker):
+                with self.assertRaises(ValueError):
+                    unpacker_class(UnpackableBuffer(data), KeyCache()).unpack()
+
+    def test_least_recently_used_key_is_evicted(self):
+        cache = KeyCache(2)
+        a = cache.decode(b"a")
+        cache.decode(b"b")
+        cache.decode(b"a")
+        cache.decode(b"c")
+        self.assertEqual(len(cache), 2)
+        self.assertIs(cache.decode(b"a"), a)
+        self.assertEqual(sorted(cache._keys), [b"a", b"c"])
+
+
+class StringCacheTestCase(TestCase):
+
+    def test_packs_identically(self):
+        cache = StringCache()
+        for value in VALUES:
+            self.assertEqual(packed(value, cache), packed(value))
+
+    def test_counters(self):
+        cache = StringCache()
+        message = Structure(b"\x10", "RETURN $x", {"x": 1}, {})
+        packed(message, cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+        packed(message, cache)
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+    def test_size_bound(self):
+        cache = StringCache(max_bytes=64)
+        for i in range(100):
+            cache.get("key%d" % i)
+        self.assertLessEqual(cache.size, 64)
+        cache.get("x" * 10)
+        self.assertNotIn("x" * 10, cache._strings)
+
+
+class BoundedUnpackerTestCase(TestCase):
+
+    def test_matches_unpacker(self):
+        for value in VALUES:
+            data = packed(value)
+            expected = Unpacker(UnpackableBuffer(data)).unpack()
+            actual = BoundedUnpacker(UnpackableBuffer(data)).unpack()
+            self.assertEqual(actual, expected)
+
+    def test_stream_markers(self):
+        data = b"\xD7\x01\xD7\x02\xDF\xDF\xDB\x81a\x01\xDF"
+        unpacker = BoundedUnpacker(UnpackableBuffer(data))
+        self.assertEqual(unpacker.unpack(), [1, [2]])
+        self.assertEqual(unpacker.unpack(), {"a": 1})
+
+    def test_deep_nesting_does_not_recurse(self):
+        data = b"\x91" * 5000 + b"\x90"
+        value = BoundedUnpacker(UnpackableBuffer(data), max_depth=5001).unpack()
+        for _ in range(5000):
+            value, = value
+        self.assertEqual(value, [])
+
+    def test_max_depth(self):
+        with self.assertRaises(LimitExceeded):
+            BoundedUnpacker(UnpackableBuffer(b"\x91\x91\x91\x90"), max_depth=2).unpack()
+
+    def test_max_length(self):
+        with self.assertRaises(LimitExceeded):
+            BoundedUnpacker(UnpackableBuffer(packed(list(range(20)))), max_length=10).unpack()
+        with self.assertRaises(LimitExceeded):
+            BoundedUnpacker(UnpackableBuffer(b"\xD7" + b"\x01" * 20 + b"\xDF"),
+                            max_length=10).unpack()
+
+    def test_huge_size_header(self):
+        with self.assertRaises(LimitExceeded):
+            BoundedUnpacker(UnpackableBuffer(b"\xD6\xFF\xFF\xFF\xFF\x01")).unpack()
+        with self.assertRaises(LimitExceeded):
+            BoundedUnpacker(UnpackableBuffer(b"\xD2\xFF\xFF\xFF\xFFabc"),
+                            max_bytes=1000).unpack()
+
+    def test_truncated(self):
+        with self.assertRaises(ValueError):
+            BoundedUnpacker(UnpackableBuffer(b"\x93\x01\x02")).unpack()
+
+
+class FeedUnpackerTestCase(TestCase):
+
+    def test_byte_at_a_time(self):
+        data = b"".join(map(packed, VALUES))
+        unpacker = FeedUnpacker()
+        unpacker.compact_threshold = 16
+        values = []
+        for i in range(len(data)):
+            unpacker.feed(data[i:i + 1])
+            values.extend(unpacker.values())
+        self.assertEqual(values, [Unpacker(UnpackableBuffer(packed(value))).unpack()
+                                  for value in VALUES])
+        self.assertFalse(unpacker.pending())
+
+    def test_incomplete(self):
+        unpacker = FeedUnpacker()
+        unpacker.feed(b"\x92\x01")
+        with self.assertRaises(Incomplete):
+            unpacker.next_value()
+        self.assertTrue(unpacker.pending())
+        unpacker.feed(b"\x02\x03")
+        self.assertEqual(unpacker.next_value(), [1, 2])
+        self.assertEqual(unpacker.next_value(), 3)
+
+    def test_limits_apply_across_pieces(self):
+        unpacker = FeedUnpacker(max_bytes=100)
+        unpacker.compact_threshold = 1
+        unpacker.feed(b"\xD4\x40")
+        with self.assertRaises(Incomplete):
+            unpacker.next_value()
+        for _ in range(30):
+            unpacker.feed(b"\x01")
+            with self.assertRaises(Incomplete):
+                unpacker.next_value()
+        unpacker.feed(b"\xD0\x80")
+        with self.assertRaises(LimitExceeded):
+            unpacker.next_value()
+
+
+class BytesTestCase(TestCase):
+
+    def test_passthrough(self):
+        blob = bytes(range(256)) * 300
+        stream = []
+        packer = Packer(BufferList(stream))
+        packer.pack([blob, "x"])
+        self.assertIn(blob, [bytes(piece) for piece in stream
+                             if isinstance(piece, memoryview)])
+        self.assertEqual(b"".join(stream), packed([blob, "x"]))
+
+    def test_references_in_streams(self):
+        blob = b"z" * 100
+        b = BytesIO()
+        packer = Packer(b, stream_markers=False)
+        packer.passthrough_size = 10
+        packer.pack({"x": (value for value in [1, blob, blob])})
+        self.assertEqual(b.getvalue(), packed({"x": [1, blob, blob]}))
+
+    def test_views(self):
+        data = packed([b"abc", bytearray(300)])
+        for unpacker_class in (Unpacker, TableUnpacker, BoundedUnpacker):
+            value = unpacker_class(UnpackableBuffer(data), bytes_views=True).unpack()
+            self.assertEqual(value, [b"abc", bytes(300)])
+            self.assertIsInstance(value[1], memoryview)
+
+    def test_chunk_pieces(self):
+        blob = bytes(range(256)) * 3
+        encoder = Encoder(passthrough_size=256)
+        encoder.pack(["head", blob, "tail"])
+        for max_chunk_size in (1000, 256, 300, 7):
+            data = bytearray(b"\x00\x00") + encoder.getvalue()
+            chunk_in_place(data, 0, max_chunk_size)
+            self.assertEqual(b"".join(chunk_pieces(encoder.pieces(0), max_chunk_size)), data)
+
+
+class CanonicalTestCase(TestCase):
+
+    def test_map_order(self):
+        first = packed({"b": 1, "aa": {"y": [], "x": 2}, "a": None})
+        second = packed({"a": None, "b": 1, "aa": {"x": 2, "y": []}})
+        self.assertNotEqual(first, second)
+        self.assertEqual(canonicalize(first), canonicalize(second))
+        self.assertEqual(canonicalize(first), packed({"a": None, "b": 1, "aa": {"x": 2, "y": []}}))
+        self.assertEqual(canonical_digest(first), canonical_digest(second))
+        self.assertNotEqual(message_digest(first), message_digest(second))
+        self.assertEqual(canonical_encoding({"b": 1, "a": 2}), packed({"a": 2, "b": 1}))
+
+    def test_canonical_values_are_unchanged(self):
+        for value in VALUES:
+            data = packed(value)
+            if not isinstance(value, dict) or len(value) < 2:
+                self.assertEqual(canonicalize(data), data)
+            self.assertEqual(canonicalize(canonicalize(data)), canonicalize(data))
+
+    def test_streams(self):
+        data = b"\xDB\x81b\xD7\x01\xDF\x81a\x02\xDF"
+        self.assertEqual(canonicalize(data), packed({"a": 2, "b": [1]}))
+
+    def test_digest_distinguishes_values(self):
+        digests = {canonical_digest(packed(value)) for value in VALUES}
+        self.assertEqual(len(digests), len(VALUES))
+
+    def test_truncated(self):
+        for data in [b"\xA2\x81a\x01\x81b", b"\xD7\x01", b"\xB1"]:
+            with self.assertRaises(ValueError):
+                canonicalize(data)
+
+    def test_structure_header(self):
+        self.assertEqual(unpack_structure_header(packed(Structure(b"\x10", "x", {}))),
+                         (2, 0x10, 2))
+        self.assertEqual(unpack_structure_header(packed(Structure(b"\x7F", *range(20)))),
+                         (20, 0x7F, 3))
+
+
+class BufferList:
+
+    def __init__(self, pieces):
+        self.pieces = pieces
+
+    def write(self, data):
+        self.pieces.append(data)
+
+
+class PackStreamTestCase(TestCase):
+
+    def read_message(self, data, **kwargs):
+        async def read():
+            reader = StreamReader()
+            reader.feed_data(data)
+            reader.feed_eof()
+            return await PackStream(reader, None, **kwargs).read_message()
+
+        loop = new_event_loop()
+        try:
+            return loop.run_until_complete(read())
+        finally:
+            loop.close()
+
+    def test_incremental_multi_chunk_message(self):
+        message = Structure(b"\x10", "RETURN $x", {"x": list(range(100))}, {})
+        payload = packed(message)
+        data = (b"\x00\x10" + payload[:16] + bytes(divmod(len(payload) - 16, 0x100)) +
+                payload[16:] + b"\x00\x00")
+        self.assertEqual(self.read_message(data), message)
+        self.assertEqual(self.read_message(data, incremental=True), message)
+
+    def test_write_message_with_large_bytes(self):
+        message = Structure(b"\x71", [b"x" * 0x20000, 1])
+        writer = BytesIO()
+        PackStream(None, writer).write_message(message)
+        self.assertEqual(self.read_message(writer.getvalue()), message)
+
+    def test_limits_by_default(self):
+        payload = b"\xB1\x71" + b"\x91" * 200 + b"\x90"
+        data = bytes(divmod(len(payload), 0x100)) + payload + b"\x00\x00"
+        for incremental in (False, True):
+            with self.assertRaises(LimitExceeded):
+                self.read_message(data, incremental=incremental)
+        message = self.read_message(data, max_depth=300)
+        self.assertEqual(message.tag, b"\x71")
+        payload = packed(Structure(b"\x71", list(range(20))))
+        data = bytes(divmod(len(payload), 0x100)) + payload + b"\x00\x00"
+        with self.assertRaises(LimitExceeded):
+            self.read_message(data, max_length=10)
+
+
+class StreamingPackerTestCase(TestCase):
+
+    def test_generator_uses_stream_markers(self):
+        b = BytesIO()
+        Packer(b).pack(x for x in range(3))
+        self.assertEqual(b.getvalue(), b"\xD7\x00\x01\x02\xDF")
+
+    def test_map_stream(self):
+        b = BytesIO()
+        Packer(b).pack_map_stream((k, len(k)) for k in ["a", "bb"])
+        self.assertEqual(b.getvalue(), b"\xDB\x81a\x01\x82bb\x02\xDF")
+        self.assertEqual(Unpacker(UnpackableBuffer(b.getvalue())).unpack(), {"a": 1, "bb": 2})
+
+    def test_sized_mode(self):
+        for n in (0, 3, 20, 300):
+            b = BytesIO()
+            packer = Packer(b, stream_markers=False)
+            packer.spill_size = 64
+            packer.copy_size = 100
+            packer.pack({"x": (str(i) for i in range(n))})
+            self.assertEqual(b.getvalue(), packed({"x": [str(i) for i in range(n)]}))
+
+    def test_nested_generators(self):
+        value = ((j for j in range(i)) for i in range(4))
+        for stream_markers in (True, False):
+            b = BytesIO()
+            Packer(b, stream_markers=stream_markers).pack(value)
+            value = ((j for j in range(i)) for i in range(4))
+            self.assertEqual(TableUnpacker(UnpackableBuffer(b.getvalue())).unpack(),
+                             [[], [0], [0, 1], [0, 1, 2]])
+
+    def test_sized_iterables(self):
+        self.assertEqual(packed((1, 2)), packed([1, 2]))
+        self.assertEqual(packed(range(20)), packed(list(range(20))))
+
+
+class PackedSizeTestCase(TestCase):
+
+    def test_packed_size(self):
+        for value in VALUES + [(1, 2), frozenset("ab"), VALUES]:
+            self.assertEqual(packed_size(value), len(packed(value)))
+
+    def test_unknown_length(self):
+        with self.assertRaises(ValueError):
+            packed_size(x for x in range(3))
+
+    def test_pack_into(self):
+        string_cache = StringCache()
+        for value in VALUES:
+            data = packed(value)
+            buffer = bytearray(b"?" * (len(data) + 4))
+            self.assertEqual(pack_into(buffer, 2, value, string_cache=string_cache),
+                             len(data) + 2)
+            self.assertEqual(buffer, b"??" + data + b"??")
+        buffer = bytearray(packed_size(1, "two", [3]))
+        self.assertEqual(pack_into(buffer, 0, 1, "two", [3]), len(buffer))
+        self.assertEqual(buffer, packed(1) + packed("two") + packed([3]))
+
+    def test_pack_into_too_small(self):
+        with self.assertRaises(ValueError):
+            pack_into(bytearray(4), 1, "hello")
+
+    def test_chunk_in_place(self):
+        payload = bytes(range(256)) * 3
+        for max_chunk_size, sizes in [(1000, [768]), (256, [256] * 3), (300, [300, 300, 168])]:
+            data = bytearray(b"??\x00\x00") + payload
+            chunk_in_place(data, 2, max_chunk_size)
+            expected = bytearray(b"??")
+            offset = 0
+            for size in sizes:
+                expected += size.to_bytes(2, "big") + payload[offset:offset + size]
+                offset += size
+            self.assertEqual(data, expected + b"\x00\x00")
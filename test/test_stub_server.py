@@ -21,8 +21,10 @@
 
 from pytest import mark, raises
 
-from boltkit.client import Connection
-from boltkit.server.scripting import ScriptMismatch
+from boltkit.client import AsyncConnection, Connection, ConnectionPool
+from boltkit.client.packstream import ColumnarRecords
+from boltkit.packstream import Encoder, PackStream, Structure
+from boltkit.server.scripting import BoltScript, ReceivedMessage, ScriptMismatch
 from boltkit.server.stub import BoltStubService
 
 
@@ -32,6 +34,34 @@ def script(*paths):
     return join(dirname(import_module("test").__file__), "scripts", *paths)
 
 
+def received(*values):
+    encoder = Encoder()
+    encoder.pack(*values)
+    return ReceivedMessage(PackStream(None, None), encoder.getvalue())
+
+
+def test_script_lines_match_by_digest():
+    line, = BoltScript.parse('!: BOLT 4\nC: RUN "RETURN $x" {"yy": [2], "x": 1} {}')
+    for parameters in [{"yy": [2], "x": 1}, {"x": 1, "yy": [2]}]:
+        message = received(Structure(b"\x10", "RETURN $x", parameters, {}))
+        assert line.match(message)
+        assert message._fields is None
+
+
+def test_script_lines_match_in_any_order():
+    line, = BoltScript.parse('!: BOLT 4\nC: RUN "RETURN $x" {"b": 1, "a": 2, "c": 3} {}')
+    message = received(Structure(b"\x10", "RETURN $x", {"c": 3, "b": 1, "a": 2}, {}))
+    assert line.match(message)
+    assert message._fields is not None
+
+
+def test_script_lines_fall_back_to_fields():
+    line, = BoltScript.parse('!: BOLT 4\nC: RUN "RETURN $x" {"x": 1} {}')
+    assert line.match(received(Structure(b"\x10", "RETURN $x", {"x": 1.0}, {})))
+    assert not line.match(received(Structure(b"\x10", "RETURN $x", {"x": 2}, {})))
+    assert not line.match(received(Structure(b"\x11", {})))
+
+
 @mark.skip
 @mark.asyncio
 async def test_v1():
@@ -131,6 +161,63 @@ async def test_v4x0():
             assert cx.bolt_version == (4, 0)
 
 
+@mark.asyncio
+async def test_v4x0_async():
+
+    async with BoltStubService.load(script("v4.0", "return_1_as_x_explicit.bolt")) as service:
+
+        # Given
+        async with await AsyncConnection.open(*service.addresses, auth=service.auth) as cx:
+
+            # When
+            records = []
+            cx.begin()
+            cx.run("RETURN $x", {"x": 1})
+            cx.pull(-1, -1, records)
+            cx.commit()
+            await cx.send_all()
+            await cx.fetch_all()
+
+            # Then
+            assert records == [[1]]
+            assert cx.bolt_version == (4, 0)
+            assert cx.server_agent
+
+
+@mark.asyncio
+async def test_v4x0_pool():
+
+    async with BoltStubService.load(script("v4.0", "return_1_as_x.bolt")) as service:
+
+        # Given
+        with ConnectionPool(service.auth, max_size=1, acquire_timeout=0.1) as pool:
+
+            # When
+            with pool.connection(*service.addresses) as cx:
+                records = []
+                cx.run("RETURN $x", {"x": 1})
+                cx.pull(-1, -1, records)
+                cx.send_all()
+                cx.fetch_all()
+                with raises(TimeoutError):
+                    pool.acquire(*service.addresses)
+
+            # Then
+            assert records == [[1]]
+            assert pool.stats() == {"in_use": 0, "idle": 1, "created": 1, "evicted": 0, "waits": 1}
+            assert pool.acquire(*service.addresses) is cx
+            pool.release(cx)
+
+            # When
+            pool.max_idle_time = 0
+            pool.evict()
+
+            # Then
+            assert pool.stats()["idle"] == 0
+            assert pool.stats()["evicted"] == 1
+            assert cx.closed
+
+
 @mark.asyncio
 async def test_v4x0_with_pull_n():
 
@@ -159,6 +246,74 @@ async def test_v4x0_with_pull_n():
             assert records == [[1], [2], [3], [4], [5]]
 
 
+@mark.asyncio
+async def test_v4x0_with_lazy_records():
+
+    async with BoltStubService.load(script("v4.0", "return_5_records.bolt")) as service:
+
+        # Given
+        with Connection.open(*service.addresses, auth=service.auth) as cx:
+
+            records = []
+            cx.run("UNWIND range(1, 5) AS n RETURN n")
+
+            # When
+            cx.pull(3, -1, records, lazy=True)
+            cx.pull(3, -1, records, lazy=True)
+            cx.send_all()
+            cx.fetch_all()
+
+            # Then
+            assert [record[0] for record in records] == [1, 2, 3, 4, 5]
+            assert records == [[1], [2], [3], [4], [5]]
+
+
+@mark.asyncio
+async def test_v4x0_with_columnar_records():
+
+    async with BoltStubService.load(script("v4.0", "return_5_records.bolt")) as service:
+
+        # Given
+        with Connection.open(*service.addresses, auth=service.auth) as cx:
+
+            records = ColumnarRecords()
+            cx.run("UNWIND range(1, 5) AS n RETURN n")
+
+            # When
+            cx.pull(3, -1, records)
+            cx.pull(3, -1, records)
+            cx.send_all()
+            cx.fetch_all()
+
+            # Then
+            assert records.fields == ["1"]
+            assert list(records["1"]) == [1, 2, 3, 4, 5]
+            assert records["1"].typed
+
+
+@mark.asyncio
+async def test_v4x0_with_shaped_records():
+
+    async with BoltStubService.load(script("v4.0", "return_5_records.bolt")) as service:
+
+        # Given
+        with Connection.open(*service.addresses, auth=service.auth) as cx:
+
+            records = []
+            cx.run("UNWIND range(1, 5) AS n RETURN n")
+
+            # When
+            response = cx.pull(3, -1, records, shaped=True)
+            cx.pull(3, -1, records, shaped=True)
+            cx.send_all()
+            cx.fetch_all()
+
+            # Then
+            assert records == [[1], [2], [3], [4], [5]]
+            assert response.shaped
+            assert response.shape.size == 1
+
+
 @mark.asyncio
 async def test_v4x0_explicit():
 